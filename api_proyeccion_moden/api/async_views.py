@@ -0,0 +1,147 @@
+"""
+Vistas asincronas (ASGI) para los endpoints de alta frecuencia del player:
+stream, heartbeat, state, current_item y bundle.
+
+Se enrutan en ``proyeccion_moden/urls.py`` antes del router de DRF, en las
+mismas URLs ``/api/device/...`` que usaba ``DeviceViewSet``. Bajo ASGI una
+conexion SSE abierta no ocupa ningun hilo; bajo WSGI (runserver, tests) las
+mismas vistas siguen funcionando con el generador sincrono.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from api.device import (
+    aevent_stream, authenticate_device, bundle_payload, current_bundle_etag,
+    current_item_payload, event_stream, heartbeat_buffer,
+)
+from api.ranges import etag_matches
+
+BUNDLE_NEXT_DEFAULT = 3
+BUNDLE_NEXT_MAX = 20
+
+
+def _unauthorized():
+    return JsonResponse({'detail': 'Unauthorized'}, status=401)
+
+
+def _json_body(request):
+    if not request.body:
+        return {}
+    try:
+        data = json.loads(request.body)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@require_GET
+async def device_stream(request):
+    """
+    Server-Sent Events (SSE) stream for real-time updates.
+    """
+    mesa = await sync_to_async(authenticate_device)(request)
+    if not mesa:
+        return _unauthorized()
+
+    if isinstance(request, ASGIRequest):
+        content = aevent_stream(mesa)
+    else:
+        # Django consumiria entero un iterador async bajo WSGI.
+        content = event_stream(mesa)
+
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable Nginx buffering
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def device_heartbeat(request):
+    mesa = await sync_to_async(authenticate_device)(request)
+    if not mesa:
+        return _unauthorized()
+
+    from api.serializers import DeviceHeartbeatSerializer
+
+    data = _json_body(request)
+    if data is not None and DeviceHeartbeatSerializer(data=data).is_valid():
+        # Sin escritura por ping: se vuelca en bloque cada HEARTBEAT_FLUSH_SECONDS.
+        await sync_to_async(heartbeat_buffer.record)(mesa.id, timezone.now())
+
+    return JsonResponse({'status': 'ok'})
+
+
+@require_GET
+async def device_state(request):
+    mesa = await sync_to_async(authenticate_device)(request)
+    if not mesa:
+        return _unauthorized()
+
+    from api.models import Mesa
+    from api.serializers import MesaStateSerializer
+
+    # La mesa autenticada es un snapshot parcial (cache de tokens): cargar la fila completa.
+    mesa = await Mesa.objects.select_related('imagen_actual').aget(pk=mesa.pk)
+    data = await sync_to_async(lambda: MesaStateSerializer(mesa).data)()
+    return JsonResponse(data)
+
+
+@require_GET
+async def device_current_item(request):
+    """
+    Device-friendly current item endpoint.
+    Returns current MOSTRANDO item plus preloaded image list for that modulo/fase.
+    """
+    mesa = await sync_to_async(authenticate_device)(request)
+    if not mesa:
+        return _unauthorized()
+
+    item_data = await sync_to_async(current_item_payload)(mesa, request)
+    return JsonResponse(item_data, safe=False)
+
+
+def _bundle_next_count(request):
+    default = getattr(settings, 'DEVICE_BUNDLE_NEXT', BUNDLE_NEXT_DEFAULT)
+    try:
+        count = int(request.GET.get('next', default))
+    except (TypeError, ValueError):
+        count = default
+    return max(0, min(count, BUNDLE_NEXT_MAX))
+
+
+@require_GET
+async def device_bundle(request):
+    """
+    Estado de la mesa + item actual + los ``?next=N`` siguientes, con sus
+    imagenes. ETag = version de la mesa (``Mesa.version``): si el player
+    manda ``If-None-Match`` y nada ha cambiado responde 304 con una sola
+    consulta y sin serializar.
+    """
+    mesa = await sync_to_async(authenticate_device)(request)
+    if not mesa:
+        return _unauthorized()
+
+    if request.headers.get('If-None-Match'):
+        etag = await sync_to_async(current_bundle_etag)(mesa.pk)
+        if etag is not None and etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+    etag, payload = await sync_to_async(bundle_payload)(mesa.pk, request, _bundle_next_count(request))
+    if payload is None:
+        return _unauthorized()
+    response = JsonResponse(payload)
+    response['ETag'] = etag
+    # El navegador guarda la respuesta pero la revalida en cada peticion.
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,101 @@
+"""
+Almacen de planos direccionado por contenido.
+
+Cada fichero subido se hashea (SHA-256) mientras se escribe y se guarda una
+sola vez en ``cas/<ab>/<sha256>.<ext>`` bajo MEDIA_ROOT. Varias ``Imagen``
+pueden apuntar al mismo fichero: reimportar un proyecto o reutilizar un
+plano en otros modulos no ocupa mas disco.
+
+El digest queda en ``Imagen.checksum`` y, al estar en la propia ruta, el
+fichero nunca cambia: ``api.media`` lo sirve con ETag = checksum y cache
+inmutable. El nombre original se conserva en ``Imagen.nombre_archivo``.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+
+CAS_DIR = 'cas'
+CHUNK_SIZE = 256 * 1024
+
+_CAS_PATH_RE = re.compile(r'^cas/([0-9a-f]{2})/([0-9a-f]{64})(?:\.[a-z0-9]{1,10})?$')
+_EXT_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+StoredBlob = namedtuple('StoredBlob', ['path', 'url', 'checksum', 'size', 'created'])
+
+
+def blob_path(checksum, ext=''):
+    return f"{CAS_DIR}/{checksum[:2]}/{checksum}{ext}"
+
+
+def _normalized_ext(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext if _EXT_RE.match(ext) else ''
+
+
+def checksum_from_path(path):
+    """El SHA-256 si ``path`` (relativa a MEDIA_ROOT) es un fichero del almacen."""
+    match = _CAS_PATH_RE.match(path or '')
+    if match is None or match.group(2)[:2] != match.group(1):
+        return None
+    return match.group(2)
+
+
+def store_chunks(chunks, name):
+    """
+    Guarda el contenido de ``chunks`` en el almacen y devuelve un
+    ``StoredBlob``. ``created`` es False si ya existia (deduplicado).
+    """
+    tmp_dir = os.path.join(settings.MEDIA_ROOT, CAS_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in chunks:
+                digest.update(chunk)
+                fh.write(chunk)
+                size += len(chunk)
+        checksum = digest.hexdigest()
+        relative = blob_path(checksum, _normalized_ext(name))
+        target = os.path.join(settings.MEDIA_ROOT, relative)
+        created = not os.path.exists(target)
+        if not created:
+            # Reutilizado: el mtime cuenta como "reciente" para dedupe_imagenes
+            # --gc mientras la Imagen que lo usa aun no se ha confirmado.
+            try:
+                os.utime(target)
+            except FileNotFoundError:
+                created = True
+        if created:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # mkstemp crea con 0600; el servidor web (x-accel) tiene que leerlo.
+            os.chmod(tmp, 0o644)
+            # Dos subidas simultaneas del mismo contenido escriben lo mismo.
+            os.replace(tmp, target)
+            tmp = None
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+    return StoredBlob(relative, settings.MEDIA_URL + relative, checksum, size, created)
+
+
+def store_upload(uploaded_file):
+    return store_chunks(uploaded_file.chunks(), uploaded_file.name)
+
+
+def store_path(path):
+    """Guarda en el almacen un fichero que ya esta en disco (no lo borra)."""
+    def read():
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    return store_chunks(read(), path)
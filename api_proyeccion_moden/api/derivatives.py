@@ -0,0 +1,178 @@
+"""
+Derivados de los planos (Imagen) a resolucion de proyector y miniaturas.
+
+Por cada Imagen se generan, junto al original, ficheros
+``<original>.<tamano>.<formato>`` (p.ej. ``plano.png.1080.webp``):
+
+- ``1080`` / ``2160``: caben en 1920x1080 / 3840x2160 (nunca se amplia; si el
+  original ya es menor ese tamano se omite y el player usa el original).
+- ``thumb``: miniatura para las rejillas del dashboard.
+
+Las rutas quedan en ``Imagen.variantes`` (``{tamano: {formato: url}}``). Se
+generan en un pool de hilos tras el commit de la Imagen (``schedule_variants``)
+y en bloque con ``manage.py generate_imagen_variants``.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {
+    '1080': (1920, 1080),
+    '2160': (3840, 2160),
+    'thumb': (320, 180),
+}
+DEFAULT_FORMATS = ('webp', 'jpg')
+
+_PIL_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpg': 'JPEG'}
+_SAVE_OPTIONS = {
+    'webp': {'quality': 82, 'method': 4},
+    'avif': {'quality': 60},
+    'jpg': {'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+
+def variant_sizes():
+    return getattr(settings, 'IMAGEN_VARIANT_SIZES', DEFAULT_SIZES)
+
+
+def variant_formats():
+    from PIL import features
+
+    formats = getattr(settings, 'IMAGEN_VARIANT_FORMATS', DEFAULT_FORMATS)
+    # AVIF depende de como se compilo Pillow; si no esta, se omite sin fallar.
+    return tuple(f for f in formats if f != 'avif' or features.check('avif'))
+
+
+def variant_path(original_path, size_key, fmt):
+    return f"{original_path}.{size_key}.{fmt}"
+
+
+def original_path_for_variant(path):
+    """Ruta del original si ``path`` tiene forma de derivado, si no None."""
+    root, fmt = os.path.splitext(path)
+    original, size_key = os.path.splitext(root)
+    if fmt[1:] in _PIL_FORMATS and size_key[1:] in variant_sizes():
+        return original
+    return None
+
+
+def _media_relative(url):
+    if not url or not url.startswith(settings.MEDIA_URL):
+        return None
+    return url[len(settings.MEDIA_URL):].split('?', 1)[0]
+
+
+def generate_variants(imagen, force=False):
+    """
+    Genera los derivados de ``imagen`` y devuelve el dict de ``variantes``
+    (no lo guarda). Los ficheros ya existentes y mas nuevos que el original
+    se reutilizan salvo ``force``.
+    """
+    from PIL import Image, ImageOps
+
+    relative = _media_relative(imagen.url)
+    if relative is None:
+        return {}
+    source = os.path.join(settings.MEDIA_ROOT, relative)
+    if not os.path.isfile(source):
+        return {}
+    source_mtime = os.path.getmtime(source)
+    formats = variant_formats()
+
+    variantes = {}
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'L'):
+            # Fondo blanco para los planos con transparencia (JPEG no la admite).
+            background = Image.new('RGB', original.size, 'white')
+            rgba = original.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            original = background
+        width, height = original.size
+
+        for size_key, (max_w, max_h) in variant_sizes().items():
+            is_thumb = size_key == 'thumb'
+            if not is_thumb and width <= max_w and height <= max_h:
+                continue
+            resized = None
+            for fmt in formats:
+                target_rel = variant_path(relative, size_key, fmt)
+                target = os.path.join(settings.MEDIA_ROOT, target_rel)
+                fresh = os.path.isfile(target) and os.path.getmtime(target) >= source_mtime
+                if force or not fresh:
+                    if resized is None:
+                        resized = original.copy()
+                        resized.thumbnail((max_w, max_h), Image.Resampling.LANCZOS)
+                    tmp = f"{target}.tmp"
+                    resized.save(tmp, _PIL_FORMATS[fmt], **_SAVE_OPTIONS[fmt])
+                    os.replace(tmp, target)
+                variantes.setdefault(size_key, {})[fmt] = settings.MEDIA_URL + target_rel
+    return variantes
+
+
+def update_variants(imagen_id, force=False):
+    """
+    Genera los derivados de una Imagen y los guarda sin disparar senales, en
+    ella y en las demas Imagen del mismo fichero (api.blobstore).
+    """
+    from api.models import Imagen, Mesa
+
+    imagen = Imagen.objects.filter(pk=imagen_id).only('id', 'url').first()
+    if imagen is None:
+        return None
+    try:
+        variantes = generate_variants(imagen, force=force)
+    except Exception:
+        logger.exception("[VARIANTS] No se pudieron generar los derivados de la imagen %s", imagen_id)
+        return None
+    Imagen.objects.filter(url=imagen.url).update(variantes=variantes)
+    # Los derivados salen en el bundle del player de las mesas con esos modulos.
+    Mesa.bump_version_for_modulos(Imagen.objects.filter(url=imagen.url).values('modulo_id'))
+    return variantes
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGEN_VARIANT_WORKERS', 2),
+                thread_name_prefix='imagen-variants',
+            )
+        return _executor
+
+
+def _run(imagen_id):
+    try:
+        update_variants(imagen_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(imagen_id):
+    """Genera los derivados en segundo plano cuando confirme la transaccion."""
+    if not getattr(settings, 'IMAGEN_VARIANTS_ENABLED', True):
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run, imagen_id))
+
+
+def schedule_bulk_variants(imagenes):
+    """
+    ``schedule_variants`` para Imagen creadas con ``bulk_create`` (que no
+    emite ``post_save``): un trabajo por fichero, no por Imagen.
+    """
+    by_url = {}
+    for imagen in imagenes:
+        by_url.setdefault(imagen.url, imagen.pk)
+    for imagen_id in by_url.values():
+        schedule_variants(imagen_id)
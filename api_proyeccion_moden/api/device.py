@@ -0,0 +1,414 @@
+"""
+Logica compartida de los endpoints de dispositivo (mini-PC / player).
+
+La usan tanto ``DeviceViewSet`` (DRF, sincrono) como las vistas asincronas
+de ``api.async_views`` para que ambos caminos autentiquen y respondan igual.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, DateTimeField, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from api.events import AsyncMesaSubscription, MesaSubscription, bus, ensure_listener
+from api.models import Imagen, Mesa, MesaQueueItem, MesaQueueStatus
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+CALIBRATION_FIELDS = ('calibration_json', 'mapper_enabled', 'current_image_index')
+BUNDLE_MESA_FIELDS = ('id', 'nombre', 'locked', 'blackout', 'version') + CALIBRATION_FIELDS
+
+
+def get_device_token(request):
+    """Bearer token de la cabecera Authorization o del query param ``token``."""
+    auth_header = request.headers.get('Authorization')
+    token = None
+
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+    else:
+        # DRF Request expone query_params; HttpRequest (vistas async) solo GET.
+        params = getattr(request, 'query_params', request.GET)
+        token = params.get('token')
+
+    if not token or token.lower() in ['undefined', 'null', '']:
+        return None
+    return token
+
+
+def hash_device_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class DeviceTokenCache:
+    """
+    LRU con TTL: hash del token -> snapshot minimo de la Mesa.
+
+    Solo guarda campos que identifican al dispositivo; el resto se carga bajo
+    demanda (``load_mesa_fields``, de una vez), asi una entrada nunca sirve estado viejo de
+    calibracion o cola. Se invalida en pair/unbind/revoke/status y con cualquier
+    evento de la mesa (tambien los de otros workers via LISTEN/NOTIFY); el TTL
+    acota lo que pudiera escaparse.
+    """
+
+    SNAPSHOT_FIELDS = ('id', 'nombre', 'usuario_id', 'device_token_hash')
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hashes_by_mesa = {}
+        self._listening = False
+
+    def get(self, token_hash):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at < now:
+                self._pop(token_hash)
+                return None
+            self._entries.move_to_end(token_hash)
+        return Mesa.from_db(DEFAULT_DB_ALIAS, list(self.SNAPSHOT_FIELDS), list(values))
+
+    def put(self, token_hash, mesa):
+        if not self._listening:
+            bus.subscribe_all(self.invalidate_mesa)
+            self._listening = True
+        ensure_listener()
+        values = tuple(getattr(mesa, field) for field in self.SNAPSHOT_FIELDS)
+        with self._lock:
+            self._pop(token_hash)
+            self._entries[token_hash] = (time.monotonic() + self.ttl, values)
+            self._hashes_by_mesa.setdefault(mesa.id, set()).add(token_hash)
+            while len(self._entries) > self.maxsize:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate_mesa(self, mesa_id):
+        with self._lock:
+            for token_hash in list(self._hashes_by_mesa.get(mesa_id, ())):
+                self._pop(token_hash)
+
+    def invalidate_hash(self, token_hash):
+        with self._lock:
+            self._pop(token_hash)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hashes_by_mesa.clear()
+
+    def _pop(self, token_hash):
+        entry = self._entries.pop(token_hash, None)
+        if entry is None:
+            return
+        mesa_id = entry[1][0]
+        hashes = self._hashes_by_mesa.get(mesa_id)
+        if hashes is not None:
+            hashes.discard(token_hash)
+            if not hashes:
+                del self._hashes_by_mesa[mesa_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+device_token_cache = DeviceTokenCache(
+    maxsize=getattr(settings, 'DEVICE_TOKEN_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'DEVICE_TOKEN_CACHE_TTL', 60),
+)
+
+
+def authenticate_device(request):
+    """
+    Devuelve la Mesa vinculada al token del dispositivo, o None.
+    En cache hit no hace ninguna consulta; los campos no incluidos en el
+    snapshot se cargan al acceder a ellos.
+    """
+    token = get_device_token(request)
+    if token is None:
+        return None
+    token_hash = hash_device_token(token)
+    mesa = device_token_cache.get(token_hash)
+    if mesa is not None:
+        return mesa
+    mesa = Mesa.objects.filter(device_token_hash=token_hash).first()
+    if mesa is not None:
+        device_token_cache.put(token_hash, mesa)
+    return mesa
+
+
+def load_mesa_fields(mesa, fields):
+    """
+    Carga en una sola consulta los ``fields`` de ``mesa`` que sigan diferidos
+    (la mesa autenticada es el snapshot de DeviceTokenCache). Sin esto cada
+    atributo leido hace su propia consulta.
+    """
+    deferred = [field for field in fields if field not in mesa.__dict__]
+    if deferred:
+        mesa.refresh_from_db(fields=deferred)
+    return mesa
+
+
+class HeartbeatBuffer:
+    """
+    Write-behind de ``Mesa.last_seen``.
+
+    Cada heartbeat solo actualiza un dict en memoria; como mucho una vez cada
+    ``flush_interval`` segundos se vuelca todo con un unico UPDATE. Las
+    lecturas (``last_seen`` / ``is_online``) combinan el buffer con la BD.
+    """
+
+    def __init__(self, flush_interval=30):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seen = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, mesa_id, when=None):
+        when = when or timezone.now()
+        with self._lock:
+            self._pending[mesa_id] = when
+            self._seen[mesa_id] = when
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def last_seen(self, mesa_id):
+        with self._lock:
+            return self._seen.get(mesa_id)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._seen.clear()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            return Mesa.objects.filter(id__in=pending.keys()).update(
+                last_seen=Case(
+                    *[When(id=mesa_id, then=Value(when)) for mesa_id, when in pending.items()],
+                    output_field=DateTimeField(),
+                )
+            )
+        except Exception:
+            # Reintentar en el proximo flush sin pisar pings mas nuevos.
+            with self._lock:
+                for mesa_id, when in pending.items():
+                    self._pending.setdefault(mesa_id, when)
+            logger.exception("[HEARTBEAT] Error volcando last_seen")
+            return 0
+
+
+heartbeat_buffer = HeartbeatBuffer(
+    flush_interval=getattr(settings, 'HEARTBEAT_FLUSH_SECONDS', 30),
+)
+atexit.register(heartbeat_buffer.flush)
+
+
+def mesa_last_seen(mesa):
+    """last_seen mas reciente entre el buffer de heartbeats y la BD."""
+    buffered = heartbeat_buffer.last_seen(mesa.id)
+    stored = mesa.last_seen
+    if buffered is None:
+        return stored
+    if stored is None:
+        return buffered
+    return max(buffered, stored)
+
+
+def is_mesa_online(mesa):
+    last_seen = mesa_last_seen(mesa)
+    if last_seen is None:
+        return False
+    threshold = getattr(settings, 'DEVICE_ONLINE_SECONDS', 90)
+    return (timezone.now() - last_seen).total_seconds() <= threshold
+
+
+def calibration_payload(values):
+    calibration = values.get('calibration_json') or {}
+    return {
+        'type': 'calibration',
+        'data': {
+            'corners': calibration.get('corners') if isinstance(calibration, dict) else None,
+            'mapper_enabled': values.get('mapper_enabled'),
+            'current_image_index': values.get('current_image_index')
+        }
+    }
+
+
+def _sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def event_stream(mesa):
+    """
+    Generador SSE sincrono (WSGI): bloquea un hilo por conexion pero no
+    consulta la BD salvo cuando llega un evento de la mesa.
+    """
+    mesa_id = mesa.id
+    # Suscribirse antes de leer el estado inicial para no perder cambios intermedios.
+    subscription = MesaSubscription(mesa_id)
+    try:
+        values = Mesa.objects.filter(pk=mesa_id).values(*CALIBRATION_FIELDS).first()
+        if values is None:
+            return
+        last_payload = calibration_payload(values)
+        yield _sse(last_payload)
+
+        while True:
+            # Bloquea hasta que la mesa cambie; el timeout solo marca el keep-alive.
+            if not subscription.wait(timeout=KEEPALIVE_SECONDS):
+                yield ": keep-alive\n\n"
+                continue
+
+            values = Mesa.objects.filter(pk=mesa_id).values(*CALIBRATION_FIELDS).first()
+            if values is None:
+                return
+            payload = calibration_payload(values)
+            if payload != last_payload:
+                last_payload = payload
+                yield _sse(payload)
+    finally:
+        subscription.close()
+
+
+async def aevent_stream(mesa):
+    """Version asincrona (ASGI) de ``event_stream``: no ocupa ningun hilo en espera."""
+    mesa_id = mesa.id
+    subscription = AsyncMesaSubscription(mesa_id)
+    try:
+        values = await Mesa.objects.filter(pk=mesa_id).values(*CALIBRATION_FIELDS).afirst()
+        if values is None:
+            return
+        last_payload = calibration_payload(values)
+        yield _sse(last_payload)
+
+        while True:
+            if not await subscription.wait(timeout=KEEPALIVE_SECONDS):
+                yield ": keep-alive\n\n"
+                continue
+
+            values = await Mesa.objects.filter(pk=mesa_id).values(*CALIBRATION_FIELDS).afirst()
+            if values is None:
+                return
+            payload = calibration_payload(values)
+            if payload != last_payload:
+                last_payload = payload
+                yield _sse(payload)
+    finally:
+        subscription.close()
+
+
+def queue_item_payload(item, request, images=None):
+    """
+    Item de cola serializado con su lista de imagenes activas (orden de
+    proyeccion). ``images`` evita la consulta si ya vienen cargadas (bundle).
+    Es la unica forma de un item que ve el player: current_item, mark_done
+    y el bundle pasan todos por aqui.
+    """
+    from api.serializers import ImagenSerializer, MesaQueueItemSerializer
+
+    if item is None:
+        return None
+    item_data = MesaQueueItemSerializer(item, context={'request': request}).data
+    if images is None:
+        images = Imagen.objects.filter(
+            modulo_id=item.modulo_id,
+            fase=item.fase,
+            activo=True
+        ).order_by('orden')
+    item_data['images'] = ImagenSerializer(images, many=True, context={'request': request}).data
+    return item_data
+
+
+def current_item_payload(mesa, request):
+    """
+    Item MOSTRANDO de la mesa con su lista de imagenes precargada,
+    o None si la mesa no tiene nada en pantalla.
+    """
+    item = mesa.queue_items.select_related(
+        'modulo', 'imagen', 'mesa', 'modulo__planta', 'modulo__planta__proyecto'
+    ).filter(status=MesaQueueStatus.MOSTRANDO).first()
+    return queue_item_payload(item, request)
+
+
+def bundle_etag(mesa_id, version):
+    return f'"{mesa_id}-{version}"'
+
+
+def bundle_payload(mesa_id, request, next_count):
+    """
+    Estado de la mesa, item MOSTRANDO y los ``next_count`` siguientes EN_COLA,
+    cada uno con sus imagenes activas y la misma forma que
+    ``queue_item_payload``. Devuelve ``(etag, payload)`` o ``(None, None)``
+    si la mesa ya no existe.
+
+    La version se lee antes que la cola: si algo cambia entre medias el
+    player vuelve a pedir el bundle, pero nunca guarda contenido viejo bajo
+    un ETag nuevo.
+    """
+    mesa = Mesa.objects.filter(pk=mesa_id).values(*BUNDLE_MESA_FIELDS).first()
+    if mesa is None:
+        return None, None
+    items = list(
+        MesaQueueItem.objects.filter(
+            mesa_id=mesa_id, status__in=[MesaQueueStatus.MOSTRANDO, MesaQueueStatus.EN_COLA]
+        )
+        .annotate(_showing=Case(
+            When(status=MesaQueueStatus.MOSTRANDO, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        ))
+        .select_related('modulo', 'imagen', 'mesa', 'modulo__planta', 'modulo__grupo_bastidor')
+        .prefetch_related('modulo__detalles_fase')
+        .order_by('_showing', 'position', 'id')[:next_count + 1]
+    )
+    current = items[0] if items and items[0].status == MesaQueueStatus.MOSTRANDO else None
+    upcoming = items[1:] if current is not None else items[:next_count]
+
+    images_by_key = {}
+    if items:
+        keys = Q()
+        for item in items:
+            keys |= Q(modulo_id=item.modulo_id, fase=item.fase)
+        imagenes = Imagen.objects.filter(keys, activo=True).select_related('modulo').order_by('orden', 'id')
+        for imagen in imagenes:
+            images_by_key.setdefault((imagen.modulo_id, imagen.fase), []).append(imagen)
+
+    def item_payload(item):
+        return queue_item_payload(item, request, images_by_key.get((item.modulo_id, item.fase), []))
+
+    version = mesa.pop('version')
+    calibration = {field: mesa.pop(field) for field in CALIBRATION_FIELDS}
+    payload = {
+        'version': version,
+        'mesa': {**mesa, **calibration_payload(calibration)['data']},
+        'current': item_payload(current) if current is not None else None,
+        'next': [item_payload(item) for item in upcoming],
+    }
+    return bundle_etag(mesa_id, version), payload
+
+
+def current_bundle_etag(mesa_id):
+    """ETag actual del bundle de la mesa con una sola consulta (None si no existe)."""
+    version = Mesa.objects.filter(pk=mesa_id).values_list('version', flat=True).first()
+    return None if version is None else bundle_etag(mesa_id, version)
@@ -0,0 +1,240 @@
+"""
+Bus de eventos por mesa (publish/subscribe) para el stream SSE de los players.
+
+Cada vez que cambia el estado de una mesa se llama a ``publish_mesa_event``;
+los streams abiertos para esa mesa se despiertan en lugar de consultar la BD
+cada segundo.
+
+- Dentro de un proceso el reparto es en memoria (``MesaEventBus``).
+- Con PostgreSQL, ademas, se emite ``NOTIFY`` y un hilo por proceso hace
+  ``LISTEN`` para reenviar los eventos de otros workers a sus suscriptores.
+"""
+import asyncio
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'mesa_events'
+
+# Identifica a este proceso para ignorar sus propios NOTIFY (ya repartidos en local).
+_PROCESS_TAG = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class MesaEventBus:
+    """Registro thread-safe de suscriptores por mesa."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._global_subscribers = set()
+        self._seq = defaultdict(int)
+
+    def subscribe(self, mesa_id, callback):
+        with self._lock:
+            self._subscribers[mesa_id].add(callback)
+
+    def unsubscribe(self, mesa_id, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(mesa_id)
+            if callbacks is None:
+                return
+            callbacks.discard(callback)
+            if not callbacks:
+                del self._subscribers[mesa_id]
+
+    def subscribe_all(self, callback):
+        """Callback para los eventos de cualquier mesa (p.ej. invalidar caches)."""
+        with self._lock:
+            self._global_subscribers.add(callback)
+
+    def unsubscribe_all(self, callback):
+        with self._lock:
+            self._global_subscribers.discard(callback)
+
+    def seq(self, mesa_id):
+        with self._lock:
+            return self._seq[mesa_id]
+
+    def subscriber_count(self, mesa_id=None):
+        with self._lock:
+            if mesa_id is None:
+                return sum(len(c) for c in self._subscribers.values())
+            return len(self._subscribers.get(mesa_id, ()))
+
+    def dispatch(self, mesa_id):
+        with self._lock:
+            self._seq[mesa_id] += 1
+            callbacks = list(self._subscribers.get(mesa_id, ()))
+            callbacks.extend(self._global_subscribers)
+        for callback in callbacks:
+            try:
+                callback(mesa_id)
+            except Exception:
+                logger.exception("[EVENTS] Error notificando mesa %s", mesa_id)
+
+
+bus = MesaEventBus()
+
+
+class MesaSubscription:
+    """
+    Suscripcion sincrona a los eventos de una mesa.
+
+    ``wait(timeout)`` bloquea hasta que llega un evento o vence el timeout y
+    devuelve True si hubo evento. Los eventos que llegan mientras no se
+    espera no se pierden: quedan marcados hasta el siguiente ``wait``.
+    """
+
+    def __init__(self, mesa_id):
+        self.mesa_id = mesa_id
+        self._event = threading.Event()
+        bus.subscribe(mesa_id, self._notify)
+        ensure_listener()
+
+    def _notify(self, mesa_id):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        fired = self._event.wait(timeout)
+        self._event.clear()
+        return fired
+
+    def close(self):
+        bus.unsubscribe(self.mesa_id, self._notify)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncMesaSubscription:
+    """
+    Equivalente asincrono de ``MesaSubscription`` para vistas ASGI.
+    Debe crearse dentro del event loop que va a esperar.
+    """
+
+    def __init__(self, mesa_id):
+        self.mesa_id = mesa_id
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        bus.subscribe(mesa_id, self._notify)
+        ensure_listener()
+
+    def _notify(self, mesa_id):
+        # Los eventos llegan desde otros hilos (on_commit, listener).
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+    def close(self):
+        bus.unsubscribe(self.mesa_id, self._notify)
+
+
+def _uses_pg_notify():
+    return (
+        connection.vendor == 'postgresql'
+        and getattr(settings, 'MESA_EVENTS_PG_NOTIFY', True)
+    )
+
+
+def _deliver(mesa_id):
+    bus.dispatch(mesa_id)
+    if not _uses_pg_notify():
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)",
+                [NOTIFY_CHANNEL, f"{_PROCESS_TAG}:{mesa_id}"],
+            )
+    except Exception:
+        logger.exception("[EVENTS] No se pudo emitir NOTIFY para mesa %s", mesa_id)
+
+
+def publish_mesa_event(mesa_id):
+    """
+    Notifica a los suscriptores de ``mesa_id`` cuando la transaccion actual
+    confirme (inmediatamente si no hay transaccion abierta).
+    Usar tambien tras ``QuerySet.update()``, que no dispara senales.
+    """
+    if mesa_id is None:
+        return
+    transaction.on_commit(lambda: _deliver(mesa_id))
+
+
+# ---------------------------------------------------------------------------
+# LISTEN/NOTIFY (PostgreSQL)
+# ---------------------------------------------------------------------------
+
+_listener_lock = threading.Lock()
+_listener_thread = None
+
+
+def ensure_listener():
+    """Arranca (una vez por proceso) el hilo LISTEN si la BD es PostgreSQL."""
+    global _listener_thread
+    if not _uses_pg_notify():
+        return
+    with _listener_lock:
+        if _listener_thread is not None and _listener_thread.is_alive():
+            return
+        _listener_thread = threading.Thread(
+            target=_listen_forever, name='mesa-events-listener', daemon=True
+        )
+        _listener_thread.start()
+
+
+def _listen_forever():
+    while True:
+        pg_conn = None
+        try:
+            # Conexion propia: la de Django es por hilo y entra en transacciones.
+            pg_conn = connection.get_new_connection(connection.get_connection_params())
+            pg_conn.autocommit = True
+            with pg_conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while True:
+                ready, _, _ = select.select([pg_conn], [], [], 30)
+                if not ready:
+                    continue
+                pg_conn.poll()
+                while pg_conn.notifies:
+                    _handle_notify(pg_conn.notifies.pop(0).payload)
+        except Exception:
+            logger.exception("[EVENTS] Listener caido, reintentando en 5s")
+            time.sleep(5)
+        finally:
+            if pg_conn is not None:
+                try:
+                    pg_conn.close()
+                except Exception:
+                    pass
+
+
+def _handle_notify(payload):
+    tag, _, raw_id = (payload or '').rpartition(':')
+    if tag == _PROCESS_TAG:
+        return
+    try:
+        mesa_id = int(raw_id)
+    except (TypeError, ValueError):
+        return
+    bus.dispatch(mesa_id)
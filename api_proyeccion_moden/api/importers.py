@@ -0,0 +1,946 @@
+"""
+Importacion de proyectos: normalizacion de datos tecnicos (JSON, CSV, SQLite)
+y carga de la estructura plantas -> modulos -> imagenes -> detalles.
+
+``import_structure`` prepara todo en memoria, guarda los ficheros en un pool
+de hilos y escribe cada tabla con ``bulk_create`` por lotes: el numero de
+consultas no depende del tamano del edificio.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api.models import DetalleModuloFase, Fase, Imagen, Modulo, Planta, Proyecto
+
+logger = logging.getLogger(__name__)
+
+TECHNICAL_FIELD_ALIASES = {
+    'espesor_cm': ['espesor_cm', 'espesor', 'canto', 'thickness_cm', 'thickness'],
+    'peso_malla_inicial_kg': ['peso_malla_inicial_kg', 'peso_malla_inicial', 'malla_inicial_kg', 'peso_mallazo_inicial_kg'],
+    'peso_malla_final_kg': ['peso_malla_final_kg', 'peso_malla_final', 'malla_final_kg', 'peso_mallazo_final_kg'],
+    'desperdicio_kg': ['desperdicio_kg', 'desperdicio', 'peso_desperdicio_kg'],
+    'cantidad_cortes': ['cantidad_cortes', 'cortes', 'numero_cortes'],
+    'cantidad_refuerzos': ['cantidad_refuerzos', 'refuerzos', 'numero_refuerzos'],
+    'peso_refuerzos_kg': ['peso_refuerzos_kg', 'peso_refuerzos'],
+    'metros_refuerzos': ['metros_refuerzos', 'refuerzos_metros', 'refuerzos_metros_lineales', 'm_refuerzos', 'metros_refuerzo'],
+    'cantidad_zunchos': ['cantidad_zunchos', 'zunchos', 'numero_zunchos'],
+    'peso_zunchos_kg': ['peso_zunchos_kg', 'peso_zunchos'],
+    'metros_zunchos': ['metros_zunchos', 'zunchos_metros', 'zunchos_metros_lineales', 'm_zunchos', 'metros_zuncho'],
+    'cantidad_separadores': ['cantidad_separadores', 'separadores', 'numero_separadores'],
+    'peso_separadores_kg': ['peso_separadores_kg', 'peso_separadores'],
+    'metros_separadores': ['metros_separadores', 'separadores_metros', 'separadores_metros_lineales', 'm_separadores', 'metros_separador'],
+    'cantidad_punzos': ['cantidad_punzos', 'punzos', 'numero_punzos'],
+    'peso_punzos_kg': ['peso_punzos_kg', 'peso_punzos'],
+    'metros_punzos': ['metros_punzos', 'punzos_metros', 'punzos_metros_lineales', 'm_punzos', 'metros_punzo'],
+    'dificultad_fabricacion': ['dificultad_fabricacion', 'dificultad', 'complejidad'],
+    'observaciones': ['observaciones', 'observacion', 'notas', 'comentarios'],
+}
+MODULE_FIELD_ALIASES = {
+    'ancho_cm': [
+        'ancho_cm', 'ancho', 'ancho_modulo_cm', 'ancho_modulo',
+        'module_width_cm', 'module_width', 'width_cm', 'width',
+        'canto_armado_cm', 'canto_armado', 'canto',
+    ],
+    'codigos_color': [
+        'codigos_color', 'codigo_color', 'colores', 'color_codes', 'colors',
+    ],
+}
+
+MODULE_NAME_ALIASES = ['modulo', 'modulo_nombre', 'nombre_modulo', 'module', 'module_name']
+PLANTA_NAME_ALIASES = ['planta', 'planta_nombre', 'nombre_planta', 'nivel', 'floor']
+FASE_ALIASES = ['fase', 'phase', 'subfase', 'fase_nombre']
+PHASE_PREFIXES = {
+    'inf': 'INFERIOR',
+    'inferior': 'INFERIOR',
+    'sup': 'SUPERIOR',
+    'superior': 'SUPERIOR',
+}
+
+
+def _canonicalize_key(value):
+    if value is None:
+        return ''
+    normalized = unicodedata.normalize('NFKD', str(value))
+    ascii_only = normalized.encode('ascii', 'ignore').decode('ascii')
+    ascii_only = ascii_only.strip().lower()
+    ascii_only = re.sub(r'[^a-z0-9]+', '_', ascii_only)
+    return ascii_only.strip('_')
+
+
+def _clean_cell(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value == '':
+            return None
+    return value
+
+
+def _normalize_phase(value):
+    if value is None:
+        return None
+    canonical = _canonicalize_key(value)
+    return PHASE_PREFIXES.get(canonical)
+
+
+DECIMAL_FIELDS_2_PLACES = {
+    'espesor_cm',
+    'peso_malla_inicial_kg',
+    'peso_malla_final_kg',
+    'desperdicio_kg',
+    'peso_refuerzos_kg',
+    'peso_zunchos_kg',
+    'peso_separadores_kg',
+    'peso_punzos_kg',
+    'metros_refuerzos',
+    'metros_zunchos',
+    'metros_separadores',
+    'metros_punzos',
+    'dificultad_fabricacion',
+    'ancho_cm',
+}
+TWO_PLACES = Decimal('0.01')
+
+
+def _coerce_decimal_2_places(value):
+    """Round decimal fields to 2 places so they fit the model's DecimalField precision."""
+    try:
+        dec = Decimal(str(value))
+    except (TypeError, InvalidOperation):
+        return value
+    return dec.quantize(TWO_PLACES)
+
+
+class _RecordPlan:
+    """
+    Como se leen los campos de las filas que tienen unas columnas dadas.
+
+    Los alias de cada campo se resuelven una vez contra las cabeceras (no en
+    cada fila): cada campo queda como las columnas originales que lo pueden
+    traer, por prioridad, y su conversion.
+    """
+
+    def __init__(self, keys):
+        # Como en un dict por comprension: si dos cabeceras se normalizan
+        # igual, gana la ultima.
+        self._columns = {_canonicalize_key(key): key for key in keys}
+        self.modulo = self._present(MODULE_NAME_ALIASES)
+        self.planta = self._present(PLANTA_NAME_ALIASES)
+        self.fase = self._present(FASE_ALIASES)
+        self.module_fields = self._fields(MODULE_FIELD_ALIASES)
+        self.detail_fields = {None: self._fields(TECHNICAL_FIELD_ALIASES)}
+        for prefix in PHASE_PREFIXES:
+            self.detail_fields[prefix] = self._fields(TECHNICAL_FIELD_ALIASES, prefix)
+
+    def _present(self, aliases):
+        keys = []
+        for alias in aliases:
+            canonical = _canonicalize_key(alias)
+            if canonical in self._columns and self._columns[canonical] not in keys:
+                keys.append(self._columns[canonical])
+        return tuple(keys)
+
+    def _fields(self, aliases_by_field, prefix=None):
+        fields = []
+        for target_field, aliases in aliases_by_field.items():
+            search_aliases = list(aliases)
+            if prefix:
+                prefixed = []
+                for alias in aliases:
+                    canonical_alias = _canonicalize_key(alias)
+                    prefixed.extend([
+                        f'{prefix}_{canonical_alias}',
+                        f'{prefix}{canonical_alias}',
+                    ])
+                search_aliases = prefixed + search_aliases
+            keys = self._present(search_aliases)
+            if keys:
+                coerce = _coerce_decimal_2_places if target_field in DECIMAL_FIELDS_2_PLACES else None
+                fields.append((target_field, keys, coerce))
+        return tuple(fields)
+
+
+@lru_cache(maxsize=128)
+def _record_plan(keys):
+    return _RecordPlan(keys)
+
+
+def _first_cell(row, keys):
+    for key in keys:
+        value = _clean_cell(row.get(key))
+        if value is not None:
+            return value
+    return None
+
+
+def _extract_fields(row, plan_fields):
+    fields = {}
+    for target_field, keys, coerce in plan_fields:
+        value = _first_cell(row, keys)
+        if value is not None:
+            fields[target_field] = coerce(value) if coerce else value
+    return fields
+
+
+def _extract_detail_fields(row, prefix=None):
+    return _extract_fields(row, _record_plan(tuple(row)).detail_fields[prefix])
+
+
+def _extract_module_fields(row):
+    return _extract_fields(row, _record_plan(tuple(row)).module_fields)
+
+
+def _normalize_technical_records(records):
+    normalized_records = []
+
+    for raw_row in records:
+        # Las filas de un mismo fichero comparten cabeceras: mismo plan.
+        plan = _record_plan(tuple(raw_row))
+        modulo_nombre = _first_cell(raw_row, plan.modulo)
+        planta_nombre = _first_cell(raw_row, plan.planta)
+        module_fields = _extract_fields(raw_row, plan.module_fields)
+
+        if not modulo_nombre:
+            continue
+
+        explicit_phase = _normalize_phase(_first_cell(raw_row, plan.fase))
+        explicit_fields = _extract_fields(raw_row, plan.detail_fields[None])
+
+        if explicit_phase and explicit_fields:
+            normalized_records.append({
+                'modulo_nombre': modulo_nombre,
+                'planta_nombre': planta_nombre,
+                'fase': explicit_phase,
+                'fields': explicit_fields,
+                'module_fields': module_fields,
+            })
+            continue
+
+        record_added = False
+        for prefix, fase in PHASE_PREFIXES.items():
+            prefixed_fields = _extract_fields(raw_row, plan.detail_fields[prefix])
+            if not prefixed_fields:
+                continue
+            record_added = True
+            normalized_records.append({
+                'modulo_nombre': modulo_nombre,
+                'planta_nombre': planta_nombre,
+                'fase': fase,
+                'fields': prefixed_fields,
+                'module_fields': module_fields,
+            })
+
+        if not record_added and module_fields:
+            normalized_records.append({
+                'modulo_nombre': modulo_nombre,
+                'planta_nombre': planta_nombre,
+                'fase': None,
+                'fields': {},
+                'module_fields': module_fields,
+            })
+
+    return normalized_records
+
+
+def _flatten_json_technical_data(payload):
+    if isinstance(payload, list):
+        return payload
+
+    if isinstance(payload, dict):
+        for key in ['records', 'rows', 'items', 'data', 'detalles', 'detalles_fase']:
+            value = payload.get(key)
+            if isinstance(value, list):
+                return value
+
+        modules = payload.get('modulos')
+        if isinstance(modules, list):
+            flattened = []
+            for module in modules:
+                if not isinstance(module, dict):
+                    continue
+                modulo_nombre = module.get('nombre') or module.get('modulo') or module.get('modulo_nombre')
+                planta_nombre = module.get('planta') or module.get('planta_nombre')
+                ancho_cm = module.get('ancho_cm') or module.get('ancho') or module.get('ancho_modulo_cm')
+                for detalle in module.get('detalles_fase', []):
+                    if not isinstance(detalle, dict):
+                        continue
+                    flattened.append({
+                        'modulo': modulo_nombre,
+                        'planta': planta_nombre,
+                        'ancho_cm': ancho_cm,
+                        **detalle,
+                    })
+            return flattened
+
+    return []
+
+
+# -- lectura de ficheros de datos tecnicos ------------------------------------
+
+TECHNICAL_BATCH_SIZE = 1000
+
+# Tabla ``resumen`` de la exportacion SQLite: campo del registro tecnico ->
+# columnas de origen (la primera con valor; las demas son de bases antiguas).
+SQLITE_RESUMEN_COLUMNS = {
+    'inf_peso_malla_inicial_kg': ('peso_mallazo_pedido_inf',),
+    'sup_peso_malla_inicial_kg': ('peso_mallazo_pedido_sup',),
+    'inf_desperdicio_kg': ('peso_mallazo_desperdicio_inf',),
+    'sup_desperdicio_kg': ('peso_mallazo_desperdicio_sup',),
+    'inf_peso_malla_final_kg': ('peso_mallazo_recortado_inf',),
+    'sup_peso_malla_final_kg': ('peso_mallazo_recortado_sup',),
+    # Cuts split per phase (older DBs had a single numero_cortes_mallazo)
+    'inf_cantidad_cortes': ('numero_cortes_mallazo_inf', 'numero_cortes_mallazo'),
+    'sup_cantidad_cortes': ('numero_cortes_mallazo_sup',),
+    'inf_cantidad_refuerzos': ('cantidad_refuerzos_inf',),
+    'sup_cantidad_refuerzos': ('cantidad_refuerzos_sup',),
+    'inf_peso_refuerzos_kg': ('peso_refuerzos_inf',),
+    'sup_peso_refuerzos_kg': ('peso_refuerzos_sup',),
+    # 'longitud_*' in the DB maps to metros_* on our side
+    'inf_metros_refuerzos': ('longitud_refuerzos_inf', 'metros_refuerzos_inf'),
+    'sup_metros_refuerzos': ('longitud_refuerzos_sup', 'metros_refuerzos_sup'),
+    'inf_cantidad_zunchos': ('cantidad_zunchos',),
+    'inf_peso_zunchos_kg': ('peso_zunchos',),
+    'inf_metros_zunchos': ('longitud_zunchos', 'metros_zunchos'),
+    'inf_cantidad_punzos': ('cantidad_punzonamientos',),
+    'inf_peso_punzos_kg': ('peso_punzonamientos',),
+    'inf_metros_punzos': ('longitud_punzonamientos', 'metros_punzonamientos'),
+    'inf_cantidad_separadores': ('cantidad_separadores',),
+    'inf_peso_separadores_kg': ('peso_separadores',),
+    'inf_metros_separadores': ('longitud_separadores', 'metros_separadores'),
+}
+SQLITE_ANCHO_COLUMNS = ('ancho_cm', 'canto_armado_cm', 'canto_armado', 'canto')
+SQLITE_COLOR_COLUMNS = tuple(f'pos_color_{i}' for i in range(1, 9))
+SQLITE_DEFAULT_ANCHO_CM = 17
+
+
+def _batched(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _first_value(row, columns):
+    # Igual que ``row.get(a) or row.get(b) or ...``.
+    value = None
+    for column in columns:
+        value = row.get(column)
+        if value:
+            break
+    return value
+
+
+def _sqlite_row_to_record(row):
+    ancho_cm = _first_value(row, SQLITE_ANCHO_COLUMNS)
+    if ancho_cm in [None, '']:
+        ancho_cm = SQLITE_DEFAULT_ANCHO_CM
+
+    # Concatenate color slots (pos_color_1..pos_color_8) into a
+    # single string of 8 chars, padding empty / None with 'x'.
+    color_chars = []
+    for column in SQLITE_COLOR_COLUMNS:
+        raw = row.get(column)
+        ch = '' if raw in [None, ''] else str(raw).strip().lower()
+        color_chars.append(ch[0] if ch else 'x')
+
+    record = {
+        'modulo': row['nombre_modulo'],
+        'ancho_cm': ancho_cm,
+        'codigos_color': ''.join(color_chars),
+    }
+    for field, columns in SQLITE_RESUMEN_COLUMNS.items():
+        record[field] = _first_value(row, columns)
+    return record
+
+
+def _sqlite_path_for(uploaded_file):
+    """
+    ``(ruta, es_temporal)`` de la base subida. Si Django ya la tiene en disco
+    (subidas grandes, ficheros de api.jobs) se lee de ahi sin copiarla.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.temporary_file_path(), False
+    name = getattr(getattr(uploaded_file, 'file', None), 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name, False
+    suffix = os.path.splitext(uploaded_file.name)[1] or '.db'
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        for chunk in uploaded_file.chunks():
+            temp_file.write(chunk)
+    return temp_file.name, True
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _iter_sqlite_technical_batches(uploaded_file, batch_size):
+    """
+    Lotes de registros de la tabla ``resumen``. La tabla y sus columnas se
+    comprueban antes de devolver el generador (un fichero invalido falla
+    antes de escribir nada) y solo se leen las columnas que se usan.
+    """
+    path, is_temp = _sqlite_path_for(uploaded_file)
+    connection = None
+
+    def cleanup():
+        if connection is not None:
+            connection.close()
+        if is_temp and os.path.exists(path):
+            os.unlink(path)
+
+    try:
+        connection = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+        available = {row[1] for row in connection.execute("PRAGMA table_info(resumen)")}
+        if not available:
+            raise ValidationError('La base SQLite no contiene la tabla "resumen".')
+        if 'nombre_modulo' not in available:
+            raise ValidationError('La tabla "resumen" no tiene la columna "nombre_modulo".')
+        wanted = dict.fromkeys((
+            'nombre_modulo', *SQLITE_ANCHO_COLUMNS, *SQLITE_COLOR_COLUMNS,
+            *(column for columns in SQLITE_RESUMEN_COLUMNS.values() for column in columns),
+        ))
+        columns = [column for column in wanted if column in available]
+        order_by = ' ORDER BY id' if 'id' in available else ''
+        cursor = connection.execute(
+            f"SELECT {', '.join(map(_quote_identifier, columns))} FROM resumen "
+            f"WHERE nombre_modulo IS NOT NULL AND nombre_modulo != ''{order_by}"
+        )
+    except sqlite3.Error as exc:
+        cleanup()
+        raise ValidationError(f'No se pudo leer la base SQLite: {str(exc)}')
+    except Exception:
+        cleanup()
+        raise
+
+    def batches():
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield [_sqlite_row_to_record(dict(zip(columns, row))) for row in rows]
+        except sqlite3.Error as exc:
+            raise ValidationError(f'No se pudo leer la base SQLite: {str(exc)}')
+        finally:
+            cleanup()
+
+    return batches()
+
+
+def iter_technical_record_batches(uploaded_file, batch_size=TECHNICAL_BATCH_SIZE):
+    """Registros crudos de un fichero de datos tecnicos (JSON, CSV o SQLite), por lotes."""
+    filename = uploaded_file.name.lower()
+
+    if filename.endswith('.db') or filename.endswith('.sqlite') or filename.endswith('.sqlite3'):
+        return _iter_sqlite_technical_batches(uploaded_file, batch_size)
+
+    content = uploaded_file.read()
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = content.decode('latin-1')
+
+    if filename.endswith('.json'):
+        return _batched(_flatten_json_technical_data(json.loads(text)), batch_size)
+
+    if filename.endswith('.csv'):
+        return _batched(csv.DictReader(io.StringIO(text)), batch_size)
+
+    raise ValidationError('Formato no soportado. Usa un archivo JSON, CSV o SQLite (.db).')
+
+
+# -- escritura de datos tecnicos ----------------------------------------------
+
+MODULO_NAME_PREFIXES = ('MODULO_', 'MODULO-', 'MOD_', 'MOD-')
+MODULO_ADDED_PREFIXES = ('MOD_', 'MODULO_')
+VALID_COLOR_CHARS = 'ygcvmox'
+
+_DIGITS_RE = re.compile(r'\d+')
+
+
+class ModuloNameResolver:
+    """
+    Nombres de modulo de los ficheros tecnicos -> modulos de un proyecto.
+
+    Se construye una vez por importacion (una consulta) y cada busqueda es un
+    acceso a diccionario. Primero se busca como siempre: nombre exacto sin
+    mayusculas, quitando un prefijo comun al nombre del fichero (``MOD_A01``
+    -> ``A01``) o anadiendolo (``A01`` -> ``MOD_A01`` / ``MODULO_A01``).
+
+    Solo si eso no encuentra nada se compara de forma mas amplia, por clave
+    natural: sin prefijo en ninguno de los dos lados y sin ceros a la
+    izquierda (``MOD-B02`` == ``modulo_b2``, ``A1`` == ``A01``). Si dos
+    modulos comparten esa clave (``A1`` y ``A01``) la busqueda es ambigua.
+    La planta, si se indica, limita los candidatos y se compara sin
+    mayusculas ni espacios en los extremos.
+    """
+
+    def __init__(self, modulos):
+        self.modulos = {}
+        self._by_name = {}
+        self._by_natural = {}
+        for modulo in modulos:
+            self.modulos[modulo.pk] = modulo
+            self._by_name.setdefault(self.plain_key(modulo.nombre), []).append(modulo)
+            self._by_natural.setdefault(self.natural_key(modulo.nombre), []).append(modulo)
+
+    @classmethod
+    def for_proyecto(cls, proyecto):
+        return cls(proyecto.modulos.select_related('planta').order_by('id'))
+
+    @staticmethod
+    def plain_key(nombre):
+        return str(nombre or '').strip().lower()
+
+    @staticmethod
+    def strip_prefix(nombre):
+        nombre = str(nombre or '').strip()
+        for prefix in MODULO_NAME_PREFIXES:
+            if nombre.upper().startswith(prefix):
+                return nombre[len(prefix):]
+        return nombre
+
+    @classmethod
+    def name_candidates(cls, nombre):
+        """Nombres exactos que se aceptan para ``nombre``: tal cual, sin y con prefijo."""
+        target = str(nombre or '').strip()
+        candidates = {target, cls.strip_prefix(target)}
+        for prefix in MODULO_ADDED_PREFIXES:
+            candidates.add(f'{prefix}{target}')
+        return {cls.plain_key(candidate) for candidate in candidates}
+
+    @classmethod
+    def natural_key(cls, nombre):
+        # Sin prefijo y con los numeros sin ceros a la izquierda: 'MOD_A01-02' -> 'a1-2'.
+        key = cls.plain_key(cls.strip_prefix(nombre))
+        return _DIGITS_RE.sub(lambda match: str(int(match.group())), key)
+
+    def resolve(self, modulo_nombre, planta_nombre=None):
+        """
+        Devuelve ``(modulo, error)``; ``(None, None)`` cuando el registro
+        tecnico no corresponde a ningun modulo del proyecto (no es un error:
+        se omite).
+        """
+        if not self.plain_key(modulo_nombre):
+            return None, None
+        planta = self.plain_key(planta_nombre) or None
+
+        def in_planta(modulo):
+            return planta is None or (modulo.planta is not None and self.plain_key(modulo.planta.nombre) == planta)
+
+        exact = {
+            modulo.pk: modulo
+            for candidate in self.name_candidates(modulo_nombre)
+            for modulo in self._by_name.get(candidate, ())
+            if in_planta(modulo)
+        }
+        matches = list(exact.values()) or [
+            modulo for modulo in self._by_natural.get(self.natural_key(modulo_nombre), ())
+            if in_planta(modulo)
+        ]
+        if len(matches) > 1:
+            return None, f'El modulo "{modulo_nombre}" es ambiguo; indica tambien la planta'
+        if matches:
+            return matches[0], None
+        return None, None
+
+
+def _apply_module_fields(modulo, fields):
+    """Aplica ancho/colores del registro a ``modulo`` (sin guardar); devuelve los campos cambiados."""
+    updated_fields = []
+
+    if 'ancho_cm' in fields and fields['ancho_cm'] not in [None, '']:
+        modulo.ancho_cm = Modulo._meta.get_field('ancho_cm').to_python(fields['ancho_cm'])
+        updated_fields.append('ancho_cm')
+
+    raw_color = fields.get('codigos_color')
+    if raw_color not in [None, '']:
+        normalized = str(raw_color).lower().strip()
+        # Pad to 8, replace any non-recognized char with 'x' (skip)
+        normalized = ''.join(
+            c if c in VALID_COLOR_CHARS else 'x' for c in normalized[:8]
+        ).ljust(8, 'x')
+        if normalized != modulo.codigos_color:
+            modulo.codigos_color = normalized
+            updated_fields.append('codigos_color')
+
+    return updated_fields
+
+
+DETALLE_IMPORT_FIELDS = tuple(TECHNICAL_FIELD_ALIASES)
+
+
+def _write_technical_batch(detalles, modulos, modulo_fields, batch_size):
+    """
+    Escribe un lote: ``detalles`` (``{(modulo_id, fase): campos}``) con un
+    solo ``bulk_create(update_conflicts=True)`` sobre (modulo, fase) y los
+    modulos cambiados con ``bulk_update``. Los detalles existentes conservan
+    los campos que el registro no trae, como la antigua actualizacion parcial.
+    """
+    existing = {
+        (detalle.modulo_id, detalle.fase): detalle
+        for detalle in DetalleModuloFase.objects.filter(
+            modulo_id__in={modulo_id for modulo_id, _ in detalles}
+        )
+    } if detalles else {}
+
+    objs = []
+    for (modulo_id, fase), fields in detalles.items():
+        detalle = existing.get((modulo_id, fase)) or DetalleModuloFase(modulo_id=modulo_id, fase=fase)
+        for field, value in fields.items():
+            setattr(detalle, field, value)
+        # bulk_create no pasa por save(): la dificultad se calcula aqui.
+        detalle.modulo = modulos[modulo_id]
+        detalle.dificultad_raw = detalle._calcular_dificultad_raw()
+        objs.append(detalle)
+
+    with transaction.atomic():
+        if modulo_fields:
+            # bulk_update no pasa por save(): updated_at se pone a mano.
+            fields = sorted(set().union(*modulo_fields.values()) | {'updated_at'})
+            now = timezone.now()
+            changed = [modulos[modulo_id] for modulo_id in modulo_fields]
+            for modulo in changed:
+                modulo.updated_at = now
+            Modulo.objects.bulk_update(changed, fields, batch_size=batch_size)
+        if objs:
+            DetalleModuloFase.objects.bulk_create(
+                objs,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['modulo', 'fase'],
+                update_fields=[*DETALLE_IMPORT_FIELDS, 'dificultad_raw', 'updated_at'],
+            )
+
+
+def import_technical_records(proyecto, batches, batch_size=None):
+    """
+    Aplica los registros tecnicos crudos de ``batches`` (ver
+    ``iter_technical_record_batches``) a los modulos de ``proyecto``.
+
+    Los modulos se cargan una vez en un ``ModuloNameResolver`` y cada lote se
+    escribe con un numero fijo de consultas. Devuelve las estadisticas de la
+    respuesta de ``import_technical_data`` (sin los grupos de bastidor).
+    """
+    from api.services import schedule_produccion_refresh
+
+    batch_size = batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)
+    stats = {
+        'processed': 0,
+        'created': 0,
+        'updated': 0,
+        'skipped': 0,
+        'errors': [],
+    }
+
+    resolver = ModuloNameResolver.for_proyecto(proyecto)
+    modulos = resolver.modulos
+    known = set(
+        DetalleModuloFase.objects.filter(modulo__proyecto=proyecto).values_list('modulo_id', 'fase')
+    )
+    color_changed = set()
+    touched = set()
+    normalized_count = 0
+
+    # Lote a lote: una base "resumen" grande no se carga entera en memoria.
+    for batch in batches:
+        detalles = {}
+        modulo_fields = {}
+        for record in _normalize_technical_records(batch):
+            normalized_count += 1
+            modulo, error = resolver.resolve(record['modulo_nombre'], record.get('planta_nombre'))
+            if error:
+                stats['errors'].append(error)
+                continue
+            if modulo is None:
+                # Registro tecnico sin contraparte en el proyecto: se omite
+                stats['skipped'] += 1
+                continue
+
+            try:
+                updated_fields = _apply_module_fields(modulo, record.get('module_fields', {}))
+            except DjangoValidationError as exc:
+                stats['errors'].append(f'Error importando {modulo.nombre}: {_validation_message(exc)}')
+                continue
+            if updated_fields:
+                modulo_fields.setdefault(modulo.pk, set()).update(updated_fields)
+                if 'codigos_color' in updated_fields:
+                    color_changed.add(modulo.pk)
+
+            if not record['fields'] or not record['fase']:
+                if updated_fields:
+                    stats['processed'] += 1
+                    stats['updated'] += 1
+                else:
+                    stats['skipped'] += 1
+                continue
+
+            key = (modulo.pk, record['fase'])
+            merged = {**detalles.get(key, {}), **record['fields']}
+            candidate = DetalleModuloFase(modulo_id=modulo.pk, fase=record['fase'], **merged)
+            try:
+                candidate.clean_fields(exclude=['modulo', 'dificultad_raw'])
+            except DjangoValidationError as exc:
+                stats['errors'].append(
+                    f'Error importando {modulo.nombre} {record["fase"]}: {_validation_message(exc)}'
+                )
+                continue
+            detalles[key] = {field: getattr(candidate, field) for field in merged}
+            touched.add(modulo.pk)
+            stats['processed'] += 1
+            if key in known:
+                stats['updated'] += 1
+            else:
+                known.add(key)
+                stats['created'] += 1
+
+        _write_technical_batch(detalles, modulos, modulo_fields, batch_size)
+
+    if not normalized_count:
+        stats['errors'].append('No se encontraron registros validos para importar')
+
+    if color_changed:
+        # Los colores cuentan en la dificultad SUPERIOR de detalles no tocados.
+        DetalleModuloFase.recalcular_dificultad(
+            DetalleModuloFase.objects.filter(modulo_id__in=color_changed, fase=Fase.SUPERIOR)
+        )
+    if touched:
+        Proyecto.recalcular_dificultad([proyecto.pk])
+        # Lo que hacia DetalleModuloFase.save() por cada modulo completado.
+        schedule_produccion_refresh(
+            proyecto.pk, {modulos[modulo_id].completado_at for modulo_id in touched},
+        )
+    return stats
+
+
+# -- estructura ---------------------------------------------------------------
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_FILE_WORKERS = 4
+
+
+def _validation_message(exc):
+    if hasattr(exc, 'message_dict'):
+        return '; '.join(f"{field}: {', '.join(msgs)}" for field, msgs in exc.message_dict.items())
+    return '; '.join(exc.messages)
+
+
+def _normalize_color(raw_color):
+    return (raw_color or 'xxxxxxxx').ljust(8, 'x')[:8]
+
+
+def _store_files(jobs, workers, on_done):
+    """
+    Ejecuta ``jobs`` (``{clave: callable}``) en un pool de hilos y devuelve
+    ``(resultados, errores)`` por clave.
+    """
+    results, errors = {}, {}
+    if not jobs:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import-files') as pool:
+        futures = {pool.submit(job): key for key, job in jobs.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as exc:
+                errors[key] = exc
+            on_done()
+    return results, errors
+
+
+def import_structure(proyecto, plantas_data, files, progress=None):
+    """
+    Crea las plantas, modulos, imagenes y detalles tecnicos de ``plantas_data``
+    (el JSON que envia el asistente de importacion) con los ficheros de
+    ``files`` (``request.FILES``).
+
+    Los elementos invalidos se omiten y se anotan en ``stats['errors']``; el
+    resto se escribe en una transaccion. ``progress(etapa, hechos, total)`` se
+    llama segun avanza la importacion.
+    """
+    from api.blobstore import store_upload
+    from api.derivatives import schedule_bulk_variants
+
+    batch_size = getattr(settings, 'IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)
+    workers = getattr(settings, 'IMPORT_FILE_WORKERS', IMPORT_FILE_WORKERS)
+    report = progress or (lambda stage, done, total: None)
+
+    stats = {
+        'plantas': 0, 'modulos': 0, 'imagenes': 0, 'imagenes_deduplicadas': 0, 'detalles_fase': 0,
+        'plano_cargado': False, 'planilla_cargada': False, 'errors': []
+    }
+    errors = stats['errors']
+
+    # 1. Validar y montar los objetos en memoria.
+    planta_names = set(proyecto.plantas.values_list('nombre', flat=True))
+    plantas, modulos, imagenes, detalles = [], [], [], {}
+    planta_files = {}
+    for planta_data in plantas_data:
+        nombre = planta_data.get('nombre', 'Sin nombre')
+        if nombre in planta_names:
+            errors.append(f"Error creating planta: ya existe la planta {nombre} en el proyecto")
+            continue
+        planta = Planta(nombre=nombre, proyecto=proyecto, orden=planta_data.get('orden', 0))
+        try:
+            planta.clean_fields(exclude=['proyecto', 'plano_imagen', 'fichero_corte'])
+        except DjangoValidationError as exc:
+            errors.append(f"Error creating planta: {_validation_message(exc)}")
+            continue
+        planta_names.add(nombre)
+        plantas.append(planta)
+
+        for field, key in (('plano_imagen', 'plano_filename'), ('fichero_corte', 'corte_filename')):
+            uploaded_file = files.get(planta_data.get(key) or '')
+            if uploaded_file:
+                planta_files[(len(plantas) - 1, field)] = uploaded_file
+
+        for modulo_data in planta_data.get('modulos', []):
+            modulo = Modulo(
+                nombre=modulo_data.get('nombre', 'Sin nombre'),
+                ancho_cm=_extract_module_fields(modulo_data).get('ancho_cm'),
+                planta=planta,
+                proyecto=proyecto,
+                estado='PENDIENTE',
+                codigos_color=_normalize_color(modulo_data.get('codigos_color')),
+            )
+            try:
+                modulo.clean_fields(exclude=['planta', 'proyecto', 'grupo_bastidor', 'cerrado_by'])
+            except DjangoValidationError as exc:
+                errors.append(f"Error creating modulo: {_validation_message(exc)}")
+                continue
+            modulos.append(modulo)
+
+            seen_slots = set()
+            for imagen_data in modulo_data.get('imagenes', []):
+                filename = imagen_data.get('filename')
+                if not files.get(filename or ''):
+                    errors.append(f"File not found: {filename}")
+                    continue
+                imagen = Imagen(
+                    modulo=modulo,
+                    fase=imagen_data.get('fase', 'INFERIOR'),
+                    orden=imagen_data.get('orden', 1),
+                    activo=True,
+                )
+                try:
+                    imagen.clean_fields(exclude=['modulo', 'uploaded_by', 'url', 'archivo'])
+                    if imagen.fase not in Fase.values:
+                        raise DjangoValidationError({'fase': [f"Fase no valida: {imagen.fase}"]})
+                    if (imagen.fase, imagen.orden) in seen_slots:
+                        raise DjangoValidationError(
+                            {'orden': [f"Orden repetido para {modulo.nombre} {imagen.fase}: {imagen.orden}"]}
+                        )
+                except DjangoValidationError as exc:
+                    errors.append(f"Error creating imagen: {_validation_message(exc)}")
+                    continue
+                seen_slots.add((imagen.fase, imagen.orden))
+                imagenes.append((imagen, filename))
+
+            for detalle_data in modulo_data.get('detalles_fase', []):
+                fase = _normalize_phase(detalle_data.get('fase'))
+                if not fase:
+                    errors.append(f"Detalle tecnico sin fase valida para modulo {modulo.nombre}")
+                    continue
+                detail_fields = _extract_detail_fields(detalle_data)
+                if not detail_fields:
+                    continue
+                # Varias filas de la misma fase se combinan (la ultima gana).
+                merged = {**detalles.get((id(modulo), fase), (None, {}))[1], **detail_fields}
+                detalle = DetalleModuloFase(modulo=modulo, fase=fase, **merged)
+                try:
+                    detalle.clean_fields(exclude=['modulo'])
+                except DjangoValidationError as exc:
+                    errors.append(f"Error creating detalle tecnico: {_validation_message(exc)}")
+                    continue
+                detalles[(id(modulo), fase)] = (detalle, merged)
+                stats['detalles_fase'] += 1
+
+    # 2. Ficheros: cada nombre se guarda una vez, en paralelo y fuera de la transaccion.
+    uploads = {filename: files[filename] for _, filename in imagenes}
+    jobs = {('imagen', name): (lambda upload=upload: store_upload(upload)) for name, upload in uploads.items()}
+    labels = {('imagen', name): upload.name for name, upload in uploads.items()}
+    for (index, field), uploaded_file in planta_files.items():
+        def save_planta_file(planta=plantas[index], field=field, uploaded_file=uploaded_file):
+            getattr(planta, field).save(uploaded_file.name, uploaded_file, save=False)
+        jobs[('planta', index, field)] = save_planta_file
+        labels[('planta', index, field)] = uploaded_file.name
+
+    done = 0
+
+    def file_done():
+        nonlocal done
+        done += 1
+        report('ficheros', done, len(jobs))
+
+    stored, file_errors = _store_files(jobs, workers, file_done)
+    for key, exc in file_errors.items():
+        errors.append(f"Error saving file {labels[key]}: {exc}")
+    for key in stored:
+        if key[0] == 'planta':
+            stats['plano_cargado' if key[2] == 'plano_imagen' else 'planilla_cargada'] = True
+
+    used = set()
+    valid_imagenes = []
+    for imagen, filename in imagenes:
+        blob = stored.get(('imagen', filename))
+        if blob is None:
+            continue
+        if filename in used or not blob.created:
+            stats['imagenes_deduplicadas'] += 1
+        used.add(filename)
+        imagen.url = blob.url
+        imagen.checksum = blob.checksum
+        imagen.nombre_archivo = os.path.basename(uploads[filename].name)[:255]
+        valid_imagenes.append(imagen)
+
+    # 3. Escritura por lotes. bulk_create no pasa por save() ni por las
+    #    senales: la dificultad y los derivados se calculan aqui.
+    detalle_objs = [detalle for detalle, _ in detalles.values()]
+    for detalle in detalle_objs:
+        detalle.dificultad_raw = detalle._calcular_dificultad_raw()
+
+    with transaction.atomic():
+        for stage, model, objs in (
+            ('plantas', Planta, plantas),
+            ('modulos', Modulo, modulos),
+            ('imagenes', Imagen, valid_imagenes),
+            ('detalles', DetalleModuloFase, detalle_objs),
+        ):
+            for start in range(0, len(objs), batch_size):
+                model.objects.bulk_create(objs[start:start + batch_size])
+                report(stage, min(start + batch_size, len(objs)), len(objs))
+        if detalle_objs:
+            Proyecto.recalcular_dificultad([proyecto.pk])
+        schedule_bulk_variants(valid_imagenes)
+
+    stats['plantas'] = len(plantas)
+    stats['modulos'] = len(modulos)
+    stats['imagenes'] = len(valid_imagenes)
+    logger.info(
+        "[IMPORT] Proyecto %s: %s plantas, %s modulos, %s imagenes, %s detalles",
+        proyecto.pk, stats['plantas'], stats['modulos'], stats['imagenes'], len(detalle_objs),
+    )
+    return stats
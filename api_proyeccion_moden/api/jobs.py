@@ -0,0 +1,240 @@
+"""
+Trabajos en segundo plano sobre la base de datos (tabla ``api_job``).
+
+Las vistas pesadas (importaciones, planificar, ZIP de fotos) aceptan
+``?async=1``: guardan los parametros y los ficheros subidos, crean un ``Job``
+y responden 202 al momento. ``manage.py run_jobs`` (proceso ``worker`` del
+Procfile) los reclama con ``SELECT ... FOR UPDATE SKIP LOCKED`` -varios
+workers no se pisan- y deja en el Job el progreso y la respuesta que habria
+dado el endpoint. El cliente consulta ``/api/jobs/<id>/``.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from api.models import Job, JobEstado
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+HEARTBEAT_SECONDS = 30
+PROGRESS_MIN_INTERVAL = 1.0
+JOB_MAX_ATTEMPTS = 3
+
+
+def job_handler(tipo):
+    """Registra ``func(job, files, progress) -> (status_code, payload)`` para ``tipo``."""
+    def register(func):
+        JOB_HANDLERS[tipo] = func
+        return func
+    return register
+
+
+# Nombre fijo en disco: el de descarga sale de nombres de proyecto/planta/
+# modulo (pueden llevar '/' o '..') y solo va en Content-Disposition.
+RESULT_FILENAME = 'result.zip'
+
+
+def job_dir(job_id, *parts):
+    return os.path.join(settings.JOB_FILES_ROOT, str(job_id), *parts)
+
+
+def _stage_upload(upload, target):
+    if isinstance(upload, TemporaryUploadedFile):
+        # Ya esta en disco: moverlo en lugar de copiarlo (Django tolera que
+        # el temporal haya desaparecido al cerrarlo).
+        shutil.move(upload.temporary_file_path(), target)
+        return
+    with open(target, 'wb') as fh:
+        for chunk in upload.chunks():
+            fh.write(chunk)
+
+
+def enqueue_job(tipo, usuario, params, files=None):
+    """
+    Crea un Job pendiente. ``files`` (``{clave: UploadedFile}``, p.ej.
+    ``request.FILES``) se copian al directorio del trabajo para el worker.
+    """
+    if tipo not in JOB_HANDLERS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    job = Job.objects.create(tipo=tipo, usuario=usuario, params=params)
+    if files:
+        input_dir = job_dir(job.pk, 'input')
+        os.makedirs(input_dir, exist_ok=True)
+        staged = {}
+        for index, (key, upload) in enumerate(files.items()):
+            _stage_upload(upload, os.path.join(input_dir, str(index)))
+            staged[key] = {'path': str(index), 'name': upload.name}
+        job.params = {**params, 'files': staged}
+        job.save(update_fields=['params'])
+    return job
+
+
+def claim_next_job():
+    """Marca como en curso el Job pendiente mas antiguo y lo devuelve (o None)."""
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(estado=JobEstado.PENDIENTE)
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        now = timezone.now()
+        job.estado = JobEstado.EN_CURSO
+        job.started_at = job.heartbeat_at = now
+        job.attempts += 1
+        job.save(update_fields=['estado', 'started_at', 'heartbeat_at', 'attempts'])
+    return job
+
+
+def requeue_stale_jobs(stale_seconds):
+    """Devuelve a la cola los trabajos cuyo worker dejo de dar senales."""
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    stale = Job.objects.filter(estado=JobEstado.EN_CURSO, heartbeat_at__lt=cutoff)
+    max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', JOB_MAX_ATTEMPTS)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        estado=JobEstado.ERROR, error='El worker dejo de responder', finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(estado=JobEstado.PENDIENTE)
+    return requeued, failed
+
+
+def purge_finished_jobs(days):
+    """Borra los trabajos terminados hace mas de ``days`` dias y sus ficheros."""
+    cutoff = timezone.now() - timedelta(days=days)
+    old = Job.objects.filter(
+        estado__in=[JobEstado.COMPLETADO, JobEstado.ERROR], finished_at__lt=cutoff,
+    )
+    ids = list(old.values_list('pk', flat=True))
+    for job_id in ids:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    Job.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _heartbeat(job_id, stop):
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            Job.objects.filter(pk=job_id).update(heartbeat_at=timezone.now())
+    finally:
+        close_old_connections()
+
+
+def run_job(job):
+    """Ejecuta un Job ya reclamado y guarda su resultado."""
+    handler = JOB_HANDLERS.get(job.tipo)
+    last_report = 0.0
+
+    def progress(stage, done, total):
+        nonlocal last_report
+        now = time.monotonic()
+        if done < total and now - last_report < PROGRESS_MIN_INTERVAL:
+            return
+        last_report = now
+        Job.objects.filter(pk=job.pk).update(
+            progress={'stage': stage, 'done': done, 'total': total},
+            heartbeat_at=timezone.now(),
+        )
+
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job.pk, stop), daemon=True)
+    beat.start()
+    updates = {}
+    try:
+        if handler is None:
+            raise ValueError(f"Tipo de trabajo desconocido: {job.tipo}")
+        with ExitStack() as stack:
+            files = {
+                key: stack.enter_context(File(open(job_dir(job.pk, 'input', info['path']), 'rb'), name=info['name']))
+                for key, info in job.params.get('files', {}).items()
+            }
+            status_code, payload = handler(job, files, progress)
+        updates = {
+            'estado': JobEstado.COMPLETADO if status_code < 400 else JobEstado.ERROR,
+            'status_code': status_code,
+            'resultado': payload,
+        }
+    except APIException as exc:
+        # Lo mismo que habria respondido el endpoint (400, 403, 404...).
+        updates = {'estado': JobEstado.ERROR, 'status_code': exc.status_code, 'resultado': exc.detail}
+    except Exception as exc:
+        logger.exception("[JOBS] Fallo el trabajo %s (%s)", job.pk, job.tipo)
+        updates = {'estado': JobEstado.ERROR, 'status_code': 500, 'error': str(exc) or exc.__class__.__name__}
+    finally:
+        stop.set()
+        beat.join()
+        shutil.rmtree(job_dir(job.pk, 'input'), ignore_errors=True)
+
+    Job.objects.filter(pk=job.pk).update(finished_at=timezone.now(), heartbeat_at=timezone.now(), **updates)
+    job.refresh_from_db()
+    return job
+
+
+# -- tipos de trabajo ----------------------------------------------------------
+
+@job_handler('import_structure')
+def _import_structure(job, files, progress):
+    from api.importers import import_structure
+    from api.models import Proyecto
+
+    proyecto = Proyecto.objects.get(pk=job.params['proyecto'])
+    stats = import_structure(proyecto, job.params.get('plantas', []), files, progress=progress)
+    return 200, {'status': 'ok', 'proyecto_id': proyecto.id, 'stats': stats}
+
+
+@job_handler('import_technical_data')
+def _import_technical_data(job, files, progress):
+    from api.models import Proyecto
+    from api.views import ProyectoViewSet
+
+    proyecto = Proyecto.objects.get(pk=job.params['proyecto'])
+    payload = ProyectoViewSet()._run_import_technical_data(
+        proyecto, files.get('technical_file'), job.params.get('records'),
+    )
+    return 200, payload
+
+
+@job_handler('planificar')
+def _planificar(job, files, progress):
+    from api.models import GrupoMesas, Proyecto
+    from api.views import GrupoMesasViewSet
+
+    grupo = GrupoMesas.objects.get(pk=job.params['grupo'])
+    proyecto_id = job.params.get('proyecto')
+    proyecto = Proyecto.objects.get(pk=proyecto_id) if proyecto_id else None
+    return GrupoMesasViewSet()._run_planificar(grupo, job.usuario, proyecto, job.params.get('plan_id'))
+
+
+@job_handler('download_zip')
+def _download_zip(job, files, progress):
+    from api.zipstream import ZipStream
+
+    archive = ZipStream([tuple(entry) for entry in job.params['entries']])
+    result_dir = job_dir(job.pk, 'result')
+    os.makedirs(result_dir, exist_ok=True)
+    filename = job.params['filename']
+    written = 0
+    with open(os.path.join(result_dir, RESULT_FILENAME), 'wb') as fh:
+        for chunk in archive.iter_range():
+            fh.write(chunk)
+            written += len(chunk)
+            progress('zip', written, archive.size)
+    return 200, {
+        'filename': filename,
+        'size': archive.size,
+        'download_url': f'/api/jobs/{job.pk}/download/',
+    }
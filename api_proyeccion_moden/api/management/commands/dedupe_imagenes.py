@@ -0,0 +1,105 @@
+"""
+Pasa los planos antiguos (``/media/imagenes/<proyecto>/<planta>/<modulo>/``)
+al almacen por contenido de api.blobstore y rellena ``Imagen.checksum``.
+
+Los ficheros con el mismo contenido quedan en uno solo; el original se borra
+cuando ya ninguna Imagen lo referencia. Con ``--gc`` se eliminan ademas los
+ficheros del almacen (y sus derivados) que no usa ninguna Imagen y que llevan
+mas de ``--grace-hours`` sin tocarse: los recientes pueden ser de una
+importacion en curso cuya Imagen aun no se ha confirmado.
+
+Usage:
+    python manage.py dedupe_imagenes [--proyecto ID] [--gc] [--grace-hours H] [--dry-run]
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.blobstore import CAS_DIR, checksum_from_path, store_path
+from api.derivatives import original_path_for_variant
+from api.models import Imagen, Proyecto
+
+GC_GRACE_HOURS = 24
+
+
+class Command(BaseCommand):
+    help = "Mueve los planos al almacen por contenido y elimina duplicados."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proyecto', type=int, default=None,
+                            help='Id del proyecto (por defecto, todos).')
+        parser.add_argument('--gc', action='store_true',
+                            help='Borrar los ficheros del almacen sin Imagen que los use.')
+        parser.add_argument('--grace-hours', type=float, default=GC_GRACE_HOURS,
+                            help='Con --gc, no borrar ficheros modificados hace menos de H horas.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Solo informar, sin mover ni borrar nada.')
+
+    def handle(self, *args, **options):
+        queryset = Imagen.objects.exclude(url__startswith=settings.MEDIA_URL + CAS_DIR + '/')
+        proyecto_id = options['proyecto']
+        if proyecto_id is not None:
+            if not Proyecto.objects.filter(pk=proyecto_id).exists():
+                raise CommandError(f"No existe el proyecto {proyecto_id}.")
+            queryset = queryset.filter(modulo__proyecto_id=proyecto_id)
+        dry_run = options['dry_run']
+
+        moved = deduplicated = freed = 0
+        for imagen in queryset.filter(url__startswith=settings.MEDIA_URL).order_by('pk').iterator():
+            old_url = imagen.url.split('?', 1)[0]
+            source = os.path.join(settings.MEDIA_ROOT, old_url[len(settings.MEDIA_URL):])
+            if not os.path.isfile(source):
+                continue
+            moved += 1
+            if dry_run:
+                continue
+            blob = store_path(source)
+            deduplicated += 0 if blob.created else 1
+            # variantes se vacia: api.signals las regenera para la nueva url.
+            imagen.url = blob.url
+            imagen.checksum = blob.checksum
+            imagen.nombre_archivo = imagen.nombre_archivo or os.path.basename(source)[:255]
+            imagen.variantes = {}
+            imagen.save(update_fields=['url', 'checksum', 'nombre_archivo', 'variantes'])
+            if not Imagen.objects.filter(url=old_url).exists():
+                freed += os.path.getsize(source)
+                os.remove(source)
+
+        removed = self._collect_garbage(dry_run, options['grace_hours']) if options['gc'] else 0
+
+        verb = "Se moverian" if dry_run else "Movidas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb}: {moved} imagenes (ya en el almacen: {deduplicated}), "
+            f"liberados {freed} bytes, ficheros del almacen borrados: {removed}"
+        ))
+
+    def _collect_garbage(self, dry_run, grace_hours):
+        cas_root = os.path.join(settings.MEDIA_ROOT, CAS_DIR)
+        # Se fija antes de leer las Imagen: un fichero mas nuevo que esto
+        # puede ser de una transaccion que aun no vemos.
+        cutoff = time.time() - grace_hours * 3600
+        prefix = settings.MEDIA_URL + CAS_DIR + '/'
+        in_use = set(
+            Imagen.objects.filter(url__startswith=prefix).values_list('url', flat=True)
+        )
+        removed = 0
+        for dirpath, _dirnames, filenames in os.walk(cas_root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                relative = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                original = original_path_for_variant(relative) or relative
+                if checksum_from_path(original) is None:
+                    continue  # temporales de una subida en curso, etc.
+                if settings.MEDIA_URL + original in in_use:
+                    continue
+                try:
+                    if os.path.getmtime(full_path) > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                if not dry_run:
+                    os.remove(full_path)
+        return removed
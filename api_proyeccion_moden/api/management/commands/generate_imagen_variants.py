@@ -0,0 +1,47 @@
+"""
+Genera los derivados a resolucion de proyector y las miniaturas de las
+imagenes existentes (``Imagen.variantes``).
+
+Las imagenes nuevas ya los generan en segundo plano al crearse; esto sirve
+para el historico o tras cambiar ``IMAGEN_VARIANT_SIZES`` / ``_FORMATS``.
+
+Usage:
+    python manage.py generate_imagen_variants [--proyecto ID] [--force]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.derivatives import update_variants
+from api.models import Imagen, Proyecto
+
+
+class Command(BaseCommand):
+    help = "Genera los derivados (1080/2160/miniatura) de las imagenes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proyecto', type=int, default=None,
+                            help='Id del proyecto (por defecto, todos).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerar aunque los ficheros esten al dia.')
+
+    def handle(self, *args, **options):
+        queryset = Imagen.objects.all()
+        proyecto_id = options['proyecto']
+        if proyecto_id is not None:
+            if not Proyecto.objects.filter(pk=proyecto_id).exists():
+                raise CommandError(f"No existe el proyecto {proyecto_id}.")
+            queryset = queryset.filter(modulo__proyecto_id=proyecto_id)
+
+        done = failed = 0
+        seen_urls = set()
+        for imagen_id, url in queryset.order_by('pk').values_list('pk', 'url').iterator():
+            # update_variants guarda el resultado en todas las Imagen del fichero.
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            if update_variants(imagen_id, force=options['force']) is None:
+                failed += 1
+            else:
+                done += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Imagenes procesadas: {done} (errores: {failed})"))
@@ -0,0 +1,32 @@
+"""
+Reconstruye el rollup diario de produccion (``ProduccionDiaria``) que lee
+``/api/stats/production/`` a partir de los modulos completados.
+
+El rollup se mantiene solo al completar modulos; este comando hace falta
+tras desplegarlo por primera vez, tras cargas masivas con ``update()`` o si
+cambia la forma de atribuir fases a mesas.
+
+Usage:
+    python manage.py rebuild_produccion_diaria [--proyecto ID]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Proyecto
+from api.services import rebuild_produccion_diaria
+
+
+class Command(BaseCommand):
+    help = "Reconstruye ProduccionDiaria desde Modulo.completado_at y sus detalles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proyecto', type=int, default=None,
+                            help='Id del proyecto a reconstruir (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        proyecto_id = options['proyecto']
+        if proyecto_id is not None and not Proyecto.objects.filter(pk=proyecto_id).exists():
+            raise CommandError(f"No existe el proyecto {proyecto_id}.")
+
+        written = rebuild_produccion_diaria(proyecto_id)
+        self.stdout.write(self.style.SUCCESS(f"Filas de produccion diaria: {written}"))
@@ -0,0 +1,42 @@
+"""
+Recalcula ``DetalleModuloFase.dificultad_raw`` y el agregado por proyecto
+(``Proyecto.dificultad_raw_total`` / ``dificultad_detalles``).
+
+Solo hace falta si se cambia la formula de dificultad o si se han escrito
+detalles con ``QuerySet.update()``; save(), las importaciones y los cambios
+de ``codigos_color`` ya mantienen ambos valores al dia.
+
+Usage:
+    python manage.py recompute_dificultad [--proyecto ID]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import DetalleModuloFase, Proyecto
+
+
+class Command(BaseCommand):
+    help = "Recalcula la dificultad persistida de los detalles y su media por proyecto."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proyecto', type=int, default=None,
+                            help='Id del proyecto a recalcular (por defecto, todos).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Filas por lote de bulk_update (default 500).')
+
+    def handle(self, *args, **options):
+        queryset = DetalleModuloFase.objects.all()
+        proyecto_id = options['proyecto']
+        if proyecto_id is not None:
+            if not Proyecto.objects.filter(pk=proyecto_id).exists():
+                raise CommandError(f"No existe el proyecto {proyecto_id}.")
+            queryset = queryset.filter(modulo__proyecto_id=proyecto_id)
+
+        changed = DetalleModuloFase.recalcular_dificultad(queryset, batch_size=options['batch_size'])
+        # Proyectos sin detalles: dejar el agregado a cero.
+        proyectos = Proyecto.objects.all()
+        if proyecto_id is not None:
+            proyectos = proyectos.filter(pk=proyecto_id)
+        Proyecto.recalcular_dificultad(proyectos.values('pk'))
+
+        self.stdout.write(self.style.SUCCESS(f"Detalles actualizados: {changed}"))
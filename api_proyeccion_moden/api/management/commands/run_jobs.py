@@ -0,0 +1,65 @@
+"""
+Worker de trabajos en segundo plano (api.jobs).
+
+Reclama los trabajos pendientes uno a uno (``SKIP LOCKED``: se pueden
+arrancar varios workers), devuelve a la cola los de workers caidos y borra
+los terminados hace mas de ``--keep-days``.
+
+Usage:
+    python manage.py run_jobs [--once] [--poll 2] [--stale 600] [--keep-days 7]
+"""
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.jobs import claim_next_job, purge_finished_jobs, requeue_stale_jobs, run_job
+
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = "Ejecuta los trabajos en segundo plano (importaciones, planificacion, ZIP)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Vaciar la cola y terminar (cron, tests).')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Segundos entre consultas con la cola vacia (default 2).')
+        parser.add_argument('--stale', type=int, default=600,
+                            help='Segundos sin latido para dar por caido un worker (default 600).')
+        parser.add_argument('--keep-days', type=int, default=7,
+                            help='Dias que se conservan los trabajos terminados (default 7).')
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        if not options['once']:
+            # Terminar el trabajo en curso antes de salir (deploys).
+            signal.signal(signal.SIGTERM, self._stop)
+            signal.signal(signal.SIGINT, self._stop)
+
+        last_purge = 0.0
+        processed = 0
+        while not self._stopping:
+            close_old_connections()
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                purge_finished_jobs(options['keep_days'])
+                last_purge = time.monotonic()
+            requeue_stale_jobs(options['stale'])
+
+            job = claim_next_job()
+            if job is not None:
+                job = run_job(job)
+                processed += 1
+                self.stdout.write(f"[JOBS] {job.tipo} #{job.pk}: {job.estado}")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+
+        if options['once']:
+            self.stdout.write(self.style.SUCCESS(f"Trabajos procesados: {processed}"))
+
+    def _stop(self, signum, frame):
+        self._stopping = True
@@ -0,0 +1,149 @@
+"""
+Entrega de ``/media/`` (planos y fotos de fabricacion).
+
+Sustituye a ``django.views.static.serve``:
+
+- ETag fuerte: el SHA-256 para los ficheros del almacen por contenido
+  (``cas/``, ver api.blobstore) o ``Imagen.checksum`` cuando la URL lleva
+  ``?v=<checksum>``; si no, tamano+mtime del fichero.
+- Esos ficheros van con ``Cache-Control: immutable`` de un ano: el player no
+  vuelve a pedir un plano que ya tiene.
+- ``If-None-Match`` / ``If-Modified-Since`` -> 304 y ``Range`` -> 206.
+- Con ``MEDIA_SENDFILE = 'x-accel'`` (nginx) o ``'x-sendfile'`` (Apache,
+  lighttpd) el worker solo pone cabeceras y el servidor web envia el fichero
+  (y resuelve los rangos). Es lo recomendado en produccion.
+- Sin el, el worker lo envia por bloques de ``CHUNK_SIZE``: bajo WSGI con
+  ``FileResponse`` (``wsgi.file_wrapper``) y bajo ASGI con un iterador async
+  (api.streaming), nunca el fichero entero en memoria.
+"""
+import mimetypes
+import os
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+from api.ranges import RangeNotSatisfiable, etag_matches, if_range_matches, parse_byte_range
+from api.streaming import CHUNK_SIZE, aiter_blocks, is_asgi_request, iter_file
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+
+def versioned_media_url(url, checksum):
+    """``url`` con ``?v=<checksum>`` si es un fichero de MEDIA_URL con checksum."""
+    if not url or not checksum or '?' in url or not url.startswith(settings.MEDIA_URL):
+        return url
+    return f"{url}?v={checksum}"
+
+
+def _checksum_for(path, version):
+    """
+    Checksum del contenido de ``path`` si se conoce: el de su ruta en el
+    almacen por contenido, o ``version`` si es el de la Imagen de esa ruta o
+    de su original (una consulta).
+    """
+    from api.blobstore import checksum_from_path
+    from api.derivatives import original_path_for_variant
+    from api.models import Imagen
+
+    # Los derivados (api.derivatives) comparten la version de su original.
+    original = original_path_for_variant(path)
+    content_checksum = checksum_from_path(path) or checksum_from_path(original)
+    if content_checksum:
+        return content_checksum
+    if not version:
+        return None
+    urls = [settings.MEDIA_URL + path]
+    if original is not None:
+        urls.append(settings.MEDIA_URL + original)
+    if Imagen.objects.filter(url__in=urls, checksum=version).exists():
+        return version
+    return None
+
+
+def _sendfile_response(path, full_path):
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode == 'x-accel':
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+        return response
+    return None
+
+
+@require_safe
+def serve_media(request, path):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except Exception:
+        raise Http404('Ruta no valida')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('No existe')
+    if not os.path.isfile(full_path):
+        raise Http404('No existe')
+
+    checksum = _checksum_for(path, request.GET.get('v'))
+    etag = f'"{checksum}"' if checksum else f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    cache_control = IMMUTABLE_CACHE_CONTROL if checksum else REVALIDATE_CACHE_CONTROL
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    def finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    if_none_match = request.headers.get('If-None-Match')
+    if (if_none_match and etag_matches(request, etag)) or (
+        not if_none_match
+        and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime)
+    ):
+        return finish(HttpResponseNotModified())
+
+    response = _sendfile_response(path, full_path)
+    if response is not None:
+        # El servidor web pone el cuerpo, Content-Length y los rangos.
+        response['Content-Type'] = content_type
+        return finish(response)
+
+    byte_range = None
+    if if_range_matches(request, etag):
+        try:
+            byte_range = parse_byte_range(request.headers.get('Range'), stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return finish(response)
+
+    if byte_range is None and not is_asgi_request(request):
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range or (0, stat.st_size - 1)
+        length = end - start + 1
+        content = iter_file(full_path, start, length)
+        if is_asgi_request(request):
+            content = aiter_blocks(content)
+        response = StreamingHttpResponse(
+            content, content_type=content_type, status=200 if byte_range is None else 206,
+        )
+        response['Content-Length'] = str(length)
+        if byte_range is not None:
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return finish(response)
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_dificultad(apps, schema_editor):
+    from api.models import calcular_dificultad_raw
+
+    DetalleModuloFase = apps.get_model('api', 'DetalleModuloFase')
+    Proyecto = apps.get_model('api', 'Proyecto')
+
+    batch = []
+    detalles = DetalleModuloFase.objects.select_related('modulo').order_by('pk')
+    for detalle in detalles.iterator(chunk_size=500):
+        detalle.dificultad_raw = calcular_dificultad_raw(detalle, detalle.modulo.codigos_color)
+        batch.append(detalle)
+        if len(batch) >= 500:
+            DetalleModuloFase.objects.bulk_update(batch, ['dificultad_raw'])
+            batch = []
+    DetalleModuloFase.objects.bulk_update(batch, ['dificultad_raw'])
+
+    totals = (
+        DetalleModuloFase.objects.values('modulo__proyecto_id')
+        .annotate(total=Sum('dificultad_raw'), n=Count('id'))
+    )
+    for row in totals:
+        Proyecto.objects.filter(pk=row['modulo__proyecto_id']).update(
+            dificultad_raw_total=row['total'] or 0,
+            dificultad_detalles=row['n'],
+        )
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0036_grupobastidor_asignado_a'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detallemodulofase',
+            name='dificultad_raw',
+            field=models.DecimalField(blank=True, decimal_places=4, editable=False, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='proyecto',
+            name='dificultad_raw_total',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='proyecto',
+            name='dificultad_detalles',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_dificultad, noop),
+    ]
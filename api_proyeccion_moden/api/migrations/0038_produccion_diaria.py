@@ -0,0 +1,41 @@
+# Generated by Django 5.2.10 on 2026-10-17 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_dificultad_raw'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProduccionDiaria',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField()),
+                ('fase', models.CharField(blank=True, default='', max_length=20)),
+                ('modulos_completados', models.PositiveIntegerField(default=0)),
+                ('fases_completadas', models.PositiveIntegerField(default=0)),
+                ('peso_malla_inicial_kg', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('peso_malla_final_kg', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('desperdicio_kg', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cantidad_cortes', models.PositiveIntegerField(default=0)),
+                ('cantidad_refuerzos', models.PositiveIntegerField(default=0)),
+                ('cantidad_zunchos', models.PositiveIntegerField(default=0)),
+                ('cantidad_separadores', models.PositiveIntegerField(default=0)),
+                ('cantidad_punzos', models.PositiveIntegerField(default=0)),
+                ('dificultad_raw', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('mesa', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='produccion_diaria', to='api.mesa')),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='produccion_diaria', to='api.proyecto')),
+            ],
+            options={
+                'db_table': 'api_produccion_diaria',
+                'ordering': ['fecha', 'proyecto', 'mesa', 'fase'],
+                'indexes': [models.Index(fields=['fecha', 'proyecto'], name='api_producc_fecha_0e698e_idx'), models.Index(fields=['proyecto', 'fecha'], name='api_producc_proyect_8f02eb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_produccion_diaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagen',
+            name='variantes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
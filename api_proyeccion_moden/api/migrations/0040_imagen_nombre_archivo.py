@@ -0,0 +1,36 @@
+import posixpath
+
+from django.db import migrations, models
+
+
+def backfill_nombre_archivo(apps, schema_editor):
+    Imagen = apps.get_model('api', 'Imagen')
+
+    batch = []
+    for imagen in Imagen.objects.exclude(url__isnull=True).exclude(url='').only('id', 'url').iterator(chunk_size=500):
+        imagen.nombre_archivo = posixpath.basename(imagen.url.split('?', 1)[0])[:255]
+        batch.append(imagen)
+        if len(batch) >= 500:
+            Imagen.objects.bulk_update(batch, ['nombre_archivo'])
+            batch = []
+    Imagen.objects.bulk_update(batch, ['nombre_archivo'])
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_imagen_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagen',
+            name='nombre_archivo',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_nombre_archivo, noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mesa',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
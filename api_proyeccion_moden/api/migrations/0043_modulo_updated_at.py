@@ -0,0 +1,20 @@
+# Generated by Django 5.2.10 on 2026-10-17 18:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_mesa_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modulo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,6 +1,7 @@
 from decimal import Decimal, InvalidOperation
 
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 from django.contrib.auth.models import User
 
 
@@ -32,10 +33,55 @@ class MesaRol(models.TextChoices):
     SUPERIORES = 'SUPERIORES', 'Superiores'
 
 
+# =============================================================================
+# DELETE HOOKS
+# =============================================================================
+class DeleteHooksQuerySet(models.QuerySet):
+    """
+    ``delete()`` entre ``model._before_delete(queryset)`` y
+    ``model._after_delete(state)``: los efectos del borrado se aplican una vez
+    por operacion y no por cada fila de la cascada, como con senales
+    pre/post_delete (que ademas desactivan el fast-delete de Django).
+    """
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            state = self.model._before_delete(self)
+            result = super().delete()
+            self.model._after_delete(state)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class DeleteHooksMixin:
+    """
+    Los mismos hooks para ``instance.delete()``. El modelo declara
+    ``objects = DeleteHooksQuerySet.as_manager()``.
+    """
+
+    @classmethod
+    def _before_delete(cls, queryset):
+        return None
+
+    @classmethod
+    def _after_delete(cls, state):
+        pass
+
+    def delete(self, *args, **kwargs):
+        cls = type(self)
+        with transaction.atomic():
+            state = cls._before_delete(cls._base_manager.filter(pk=self.pk))
+            result = super().delete(*args, **kwargs)
+            cls._after_delete(state)
+        return result
+
+
 # =============================================================================
 # CORE MODELS
 # =============================================================================
-class Proyecto(models.Model):
+class Proyecto(DeleteHooksMixin, models.Model):
     id = models.AutoField(primary_key=True)
     nombre = models.CharField(max_length=200)
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='proyectos')
@@ -50,9 +96,43 @@ class Proyecto(models.Model):
         help_text='Indica si ya se importo el fichero de datos tecnicos y se calcularon los grupos.'
     )
 
+    # Agregado de DetalleModuloFase.dificultad_raw: la media por proyecto/usuario
+    # (escala "100 = media de la ferralla") se lee de aqui sin recorrer los detalles.
+    dificultad_raw_total = models.DecimalField(max_digits=16, decimal_places=4, default=0, editable=False)
+    dificultad_detalles = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = DeleteHooksQuerySet.as_manager()
+
     def __str__(self):
         return self.nombre
 
+    @classmethod
+    def _before_delete(cls, queryset):
+        # Los items de sus modulos se van en cascada: un UPDATE para todas las mesas.
+        Mesa.bump_version_for_modulos(Modulo.objects.filter(proyecto__in=queryset).values('pk'))
+
+    @classmethod
+    def recalcular_dificultad(cls, proyecto_ids):
+        """Refresca el agregado de dificultad de los proyectos indicados en un UPDATE."""
+        from django.db.models import Count, OuterRef, Subquery, Sum, Value
+        from django.db.models.functions import Coalesce
+
+        detalles = (
+            DetalleModuloFase.objects.filter(modulo__proyecto=OuterRef('pk'))
+            .order_by().values('modulo__proyecto')
+        )
+        return cls.objects.filter(pk__in=proyecto_ids).update(
+            dificultad_raw_total=Coalesce(
+                Subquery(detalles.annotate(total=Sum('dificultad_raw')).values('total')),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=16, decimal_places=4),
+            ),
+            dificultad_detalles=Coalesce(
+                Subquery(detalles.annotate(n=Count('id')).values('n')),
+                Value(0),
+            ),
+        )
+
     class Meta:
         db_table = 'api_proyecto'
 
@@ -98,7 +178,7 @@ class GrupoBastidor(models.Model):
 
 
 
-class Planta(models.Model):
+class Planta(DeleteHooksMixin, models.Model):
     """
     Planta/Nivel dentro de un proyecto.
     Jerarquía: Proyecto -> Planta -> Modulo
@@ -112,9 +192,27 @@ class Planta(models.Model):
     plano_imagen = models.ImageField(upload_to='planos/', blank=True, null=True)
     fichero_corte = models.FileField(upload_to='cortes/', blank=True, null=True)
 
+    objects = DeleteHooksQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.proyecto.nombre} - {self.nombre}"
 
+    @classmethod
+    def _before_delete(cls, queryset):
+        Mesa.bump_version_for_modulos(Modulo.objects.filter(planta__in=queryset).values('pk'))
+        return (
+            set(queryset.values_list('proyecto_id', flat=True)),
+            Modulo._completados(Modulo.objects.filter(planta__in=queryset)),
+        )
+
+    @classmethod
+    def _after_delete(cls, state):
+        # Sus modulos y detalles se van en cascada: un UPDATE para todos.
+        proyecto_ids, completados = state
+        if proyecto_ids:
+            Proyecto.recalcular_dificultad(proyecto_ids)
+        Modulo._schedule_produccion(completados)
+
     class Meta:
         db_table = 'api_planta'
         ordering = ['orden', 'nombre']
@@ -126,7 +224,7 @@ class Planta(models.Model):
         ]
 
 
-class Modulo(models.Model):
+class Modulo(DeleteHooksMixin, models.Model):
     id = models.AutoField(primary_key=True)
     nombre = models.CharField(max_length=200)
     ancho_cm = models.DecimalField(
@@ -183,6 +281,11 @@ class Modulo(models.Model):
         blank=True,
         help_text='Up to 8 chars: y=yellow, g=green, c=cyan, v=violet, m=magenta, o=orange, x=skip'
     )
+    # Lo usa la huella del planificador (Max por proyecto): los UPDATE
+    # masivos sobre modulos tambien lo actualizan.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DeleteHooksQuerySet.as_manager()
 
     def __str__(self):
         planta_nombre = self.planta.nombre if self.planta else "Sin planta"
@@ -211,6 +314,18 @@ class Modulo(models.Model):
             'estado', 'inferior_hecho', 'superior_hecho', 'completado_at'
         ])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Para saber en save() si cambio el color (afecta a la dificultad SUPERIOR).
+        if 'codigos_color' in instance.__dict__:
+            instance._codigos_color_db = instance.codigos_color
+        if 'completado_at' in instance.__dict__:
+            instance._completado_at_db = instance.completado_at
+        if 'nombre' in instance.__dict__:
+            instance._nombre_db = instance.nombre
+        return instance
+
     def save(self, *args, **kwargs):
         from django.utils import timezone
         # Sync booleans if estado is changed manually (e.g. from Admin)
@@ -227,13 +342,138 @@ class Modulo(models.Model):
         elif self.estado == ModuloEstado.EN_PROGRESO and self.completado_at is not None:
             self.completado_at = None
 
+        update_fields = kwargs.get('update_fields')
+        color_changed = (
+            self.pk is not None
+            and (update_fields is None or 'codigos_color' in update_fields)
+            and getattr(self, '_codigos_color_db', self.codigos_color) != self.codigos_color
+        )
+
+        nombre_changed = (
+            self.pk is not None
+            and (update_fields is None or 'nombre' in update_fields)
+            and getattr(self, '_nombre_db', self.nombre) != self.nombre
+        )
+        tracks_completado = update_fields is None or 'completado_at' in update_fields
+        completado_before = getattr(self, '_completado_at_db', None)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+
         super().save(*args, **kwargs)
 
+        if update_fields is None or 'codigos_color' in update_fields:
+            self._codigos_color_db = self.codigos_color
+        if tracks_completado and completado_before != self.completado_at:
+            from api.services import schedule_produccion_refresh
+            schedule_produccion_refresh(self.proyecto_id, [completado_before, self.completado_at])
+        if tracks_completado:
+            self._completado_at_db = self.completado_at
+        if nombre_changed:
+            # El nombre sale en el bundle de las mesas que lo tienen en cola.
+            Mesa.bump_version_for_modulos([self.pk])
+        if update_fields is None or 'nombre' in update_fields:
+            self._nombre_db = self.nombre
+        if color_changed:
+            DetalleModuloFase.recalcular_dificultad(
+                DetalleModuloFase.objects.filter(modulo=self, fase=Fase.SUPERIOR)
+            )
+
+    @staticmethod
+    def _completados(queryset):
+        """{proyecto_id: [completado_at, ...]} de los modulos de ``queryset``."""
+        completados = {}
+        for proyecto_id, completado_at in queryset.values_list('proyecto_id', 'completado_at'):
+            completados.setdefault(proyecto_id, []).append(completado_at)
+        return completados
+
+    @staticmethod
+    def _schedule_produccion(completados):
+        from api.services import schedule_produccion_refresh
+        for proyecto_id, values in completados.items():
+            schedule_produccion_refresh(proyecto_id, values)
+
+    @classmethod
+    def _before_delete(cls, queryset):
+        # Sus items se borran en cascada sin MesaQueueItem.delete().
+        Mesa.bump_version_for_modulos(queryset.values('pk'))
+        return cls._completados(queryset)
+
+    @classmethod
+    def _after_delete(cls, completados):
+        # Sus detalles se borran en cascada (fast-delete): un UPDATE por proyecto.
+        if completados:
+            Proyecto.recalcular_dificultad(completados)
+        cls._schedule_produccion(completados)
+
     class Meta:
         db_table = 'api_modulo'
 
 
-class DetalleModuloFase(models.Model):
+DIFICULTAD_FIELDS = (
+    'cantidad_cortes',
+    'cantidad_refuerzos', 'metros_refuerzos',
+    'cantidad_separadores', 'metros_separadores',
+    'cantidad_zunchos', 'metros_zunchos',
+    'cantidad_punzos', 'metros_punzos',
+    'peso_malla_final_kg', 'peso_refuerzos_kg', 'peso_zunchos_kg',
+    'peso_separadores_kg', 'peso_punzos_kg',
+)
+
+
+def calcular_dificultad_raw(detalle, codigos_color=''):
+    """
+    Dificultad sin normalizar de un DetalleModuloFase (ver dificultad_calculada).
+    Solo lee atributos, asi que sirve tambien para modelos historicos en migraciones.
+    """
+    def _num(value):
+        if value is None or value == '':
+            return Decimal('0')
+        try:
+            return Decimal(value)
+        except (TypeError, InvalidOperation):
+            return Decimal('0')
+
+    cortes = _num(detalle.cantidad_cortes)
+    is_sup = detalle.fase == Fase.SUPERIOR
+
+    # Soldaduras por elemento
+    def _welds(count, meters, multiplier):
+        return (count * Decimal('2') + meters) * multiplier
+
+    welds = Decimal('0')
+    welds += _welds(_num(detalle.cantidad_refuerzos), _num(detalle.metros_refuerzos), Decimal('1'))
+    if not is_sup:
+        # Separadores: la DB actual aún no trae longitud; asumir 2m por unidad
+        sep_count = _num(detalle.cantidad_separadores)
+        sep_meters = _num(detalle.metros_separadores)
+        if sep_meters <= 0 and sep_count > 0:
+            sep_meters = sep_count * Decimal('2')
+        welds += _welds(sep_count, sep_meters, Decimal('3'))
+        welds += _welds(_num(detalle.cantidad_zunchos), _num(detalle.metros_zunchos), Decimal('4'))
+        welds += _welds(_num(detalle.cantidad_punzos), _num(detalle.metros_punzos), Decimal('4'))
+
+    time_units = cortes * Decimal('1') + welds * Decimal('2')
+
+    # Color ribbons: only SUPERIOR, count non-'x' chars in modulo code.
+    if is_sup and codigos_color:
+        ribbons = sum(1 for c in codigos_color if c and c.lower() != 'x')
+        time_units += Decimal(ribbons) * Decimal('1.5')
+
+    # Weight component (normalized /100 as modules are heavy).
+    peso = Decimal('0')
+    for value in (
+        detalle.peso_malla_final_kg,
+        detalle.peso_refuerzos_kg,
+        detalle.peso_zunchos_kg,
+        detalle.peso_separadores_kg,
+        detalle.peso_punzos_kg,
+    ):
+        peso += _num(value)
+
+    return (time_units + peso / Decimal('100')).quantize(Decimal('0.0001'))
+
+
+class DetalleModuloFase(DeleteHooksMixin, models.Model):
     """
     Datos tecnicos y metricas importadas para cada modulo y fase.
     La fase INFERIOR representa la fabricacion inferior + montaje.
@@ -272,10 +512,15 @@ class DetalleModuloFase(models.Model):
     metros_punzos = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
 
     dificultad_fabricacion = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    # Cache persistida de dificultad_calculada; se refresca en save() y en
+    # recalcular_dificultad() (importaciones, cambios de codigos_color).
+    dificultad_raw = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True, editable=False)
     observaciones = models.TextField(blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = DeleteHooksQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.modulo.nombre} - {self.fase}"
 
@@ -316,50 +561,67 @@ class DetalleModuloFase(models.Model):
         only apply on SUPERIOR phase and come from modulo.codigos_color
         (any char != 'x' counts as one ribbon). Weight is normalized /100.
         """
-        def _num(value):
-            if value is None or value == '':
-                return Decimal('0')
-            try:
-                return Decimal(value)
-            except (TypeError, InvalidOperation):
-                return Decimal('0')
-
-        cortes = _num(self.cantidad_cortes)
-        is_sup = self.fase == Fase.SUPERIOR
-
-        # Soldaduras por elemento
-        def _welds(count, meters, multiplier):
-            return (count * Decimal('2') + meters) * multiplier
-
-        welds = Decimal('0')
-        welds += _welds(_num(self.cantidad_refuerzos), _num(self.metros_refuerzos), Decimal('1'))
-        if not is_sup:
-            # Separadores: la DB actual aún no trae longitud; asumir 2m por unidad
-            sep_count = _num(self.cantidad_separadores)
-            sep_meters = _num(self.metros_separadores)
-            if sep_meters <= 0 and sep_count > 0:
-                sep_meters = sep_count * Decimal('2')
-            welds += _welds(sep_count, sep_meters, Decimal('3'))
-            welds += _welds(_num(self.cantidad_zunchos), _num(self.metros_zunchos), Decimal('4'))
-            welds += _welds(_num(self.cantidad_punzos), _num(self.metros_punzos), Decimal('4'))
-
-        time_units = cortes * Decimal('1') + welds * Decimal('2')
-
-        # Color ribbons: only SUPERIOR, count non-'x' chars in modulo code.
-        if is_sup and self.modulo and self.modulo.codigos_color:
-            ribbons = sum(1 for c in self.modulo.codigos_color if c and c.lower() != 'x')
-            time_units += Decimal(ribbons) * Decimal('1.5')
-
-        # Weight component (normalized /100 as modules are heavy).
-        weight_component = Decimal('0')
-        total_weight = self.peso_total_kg
-        if total_weight is not None:
-            try:
-                weight_component = Decimal(total_weight) / Decimal('100')
-            except (TypeError, InvalidOperation):
-                weight_component = Decimal('0')
-
-        return float(time_units + weight_component)
+        return float(self._calcular_dificultad_raw())
+
+    def _calcular_dificultad_raw(self):
+        codigos_color = self.modulo.codigos_color if self.fase == Fase.SUPERIOR and self.modulo_id else ''
+        return calcular_dificultad_raw(self, codigos_color)
+
+    def save(self, *args, **kwargs):
+        self.dificultad_raw = self._calcular_dificultad_raw()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'dificultad_raw'}
+        super().save(*args, **kwargs)
+        Proyecto.recalcular_dificultad(
+            Modulo.objects.filter(pk=self.modulo_id).values('proyecto_id')
+        )
+        from api.services import schedule_modulo_produccion_refresh
+        schedule_modulo_produccion_refresh(self.modulo_id)
+
+    @classmethod
+    def _before_delete(cls, queryset):
+        return list(queryset.values_list('modulo__proyecto_id', 'modulo_id').distinct())
+
+    @classmethod
+    def _after_delete(cls, rows):
+        if not rows:
+            return
+        Proyecto.recalcular_dificultad({proyecto_id for proyecto_id, _ in rows})
+        from api.services import schedule_modulo_produccion_refresh
+        for modulo_id in {modulo_id for _, modulo_id in rows}:
+            schedule_modulo_produccion_refresh(modulo_id)
+
+    @classmethod
+    def recalcular_dificultad(cls, queryset=None, batch_size=500):
+        """
+        Recalcula dificultad_raw de ``queryset`` (todos si None) con
+        bulk_update por lotes y refresca el agregado de sus proyectos.
+        Devuelve el numero de detalles cuyo valor cambio.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        rows = queryset.select_related('modulo').only(
+            *DIFICULTAD_FIELDS, 'dificultad_raw', 'fase',
+            'modulo__codigos_color', 'modulo__proyecto',
+        ).order_by('pk')
+
+        from django.utils import timezone
+
+        changed = []
+        proyecto_ids = set()
+        now = timezone.now()
+        for detalle in rows.iterator(chunk_size=batch_size):
+            proyecto_ids.add(detalle.modulo.proyecto_id)
+            raw = detalle._calcular_dificultad_raw()
+            if detalle.dificultad_raw != raw:
+                detalle.dificultad_raw = raw
+                detalle.updated_at = now
+                changed.append(detalle)
+        cls.objects.bulk_update(changed, ['dificultad_raw', 'updated_at'], batch_size=batch_size)
+        if proyecto_ids:
+            Proyecto.recalcular_dificultad(proyecto_ids)
+        return len(changed)
 
     class Meta:
         db_table = 'api_detalle_modulo_fase'
@@ -386,7 +648,7 @@ class ImagenStatus(models.TextChoices):
     ARCHIVED = 'ARCHIVED', 'Archivado'
 
 
-class Imagen(models.Model):
+class Imagen(DeleteHooksMixin, models.Model):
     id = models.AutoField(primary_key=True)
     url = models.CharField(max_length=500, blank=True, null=True)
     archivo = models.FileField(upload_to='imagenes/', blank=True, null=True)
@@ -409,10 +671,22 @@ class Imagen(models.Model):
     )
     activo = models.BooleanField(default=True)
     checksum = models.CharField(max_length=64, blank=True, null=True)
+    # Nombre del fichero subido; la url apunta al almacen por contenido
+    # (api.blobstore) y ya no lo lleva.
+    nombre_archivo = models.CharField(max_length=255, blank=True, default='')
+    # Derivados a resolucion de proyector y miniatura: {tamano: {formato: url}}.
+    # Los rellena api.derivatives tras crear la imagen.
+    variantes = models.JSONField(default=dict, blank=True)
+
+    objects = DeleteHooksQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.fase} - {self.orden} - {self.url}"
 
+    @classmethod
+    def _before_delete(cls, queryset):
+        Mesa.bump_version_for_modulos(queryset.values('modulo_id'))
+
     class Meta:
         db_table = 'api_imagen'
         constraints = [
@@ -622,10 +896,44 @@ class Mesa(models.Model):
     current_image_index = models.IntegerField(default=0)
     calibration_json = models.JSONField(null=True, blank=True)
     last_error = models.TextField(null=True, blank=True)
+    # Sube con cada cambio de la mesa, de su cola activa o de las imagenes
+    # de esa cola: es el ETag de /api/device/bundle/.
+    version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.nombre
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # En el mismo UPDATE y con F(): un save() con la fila vieja en memoria
+        # no puede devolver la version a un valor ya servido.
+        self.version = models.F('version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            # Campo diferido: se relee de la BD si alguien lo consulta.
+            self.__dict__.pop('version', None)
+
+    @classmethod
+    def bump_version(cls, mesa_ids):
+        """Invalida el bundle del player de ``mesa_ids`` (ids o subconsulta de ids)."""
+        return cls.objects.filter(pk__in=mesa_ids).update(version=models.F('version') + 1)
+
+    @classmethod
+    def bump_version_for_modulos(cls, modulo_ids):
+        """``bump_version`` de las mesas con items activos de ``modulo_ids``."""
+        return cls.bump_version(
+            MesaQueueItem.objects.filter(
+                modulo_id__in=modulo_ids,
+                status__in=[MesaQueueStatus.EN_COLA, MesaQueueStatus.MOSTRANDO],
+            ).values('mesa_id')
+        )
+
     class Meta:
         db_table = 'api_mesa'
         constraints = [
@@ -839,6 +1147,22 @@ class MesaQueueItem(models.Model):
                     f"Imagen {self.imagen_id} es fase {self.imagen.fase}, no {self.fase}"
                 )
         super().save(*args, **kwargs)
+        # La mesa de antes (si se movio) y la de ahora cambian de cola.
+        Mesa.bump_version({getattr(self, '_mesa_id_db', self.mesa_id), self.mesa_id})
+        self._mesa_id_db = self.mesa_id
+
+    def delete(self, *args, **kwargs):
+        mesa_id = self.mesa_id
+        result = super().delete(*args, **kwargs)
+        Mesa.bump_version([mesa_id])
+        return result
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'mesa_id' in instance.__dict__:
+            instance._mesa_id_db = instance.mesa_id
+        return instance
 
     def marcar_hecho(self, user=None):
         """Mark this item as done and update module phase status."""
@@ -891,3 +1215,104 @@ class MesaQueueItem(models.Model):
             models.Index(fields=['mesa', 'plan_group_index']),
         ]
 
+
+
+# =============================================================================
+# STATS
+# =============================================================================
+class ProduccionDiaria(models.Model):
+    """
+    Rollup diario de produccion para /api/stats/production/.
+
+    Una fila por (fecha, proyecto, mesa, fase) con las sumas de los detalles
+    de los modulos completados ese dia (fecha local de ``completado_at``).
+    ``mesa`` null = fases sin mesa atribuible; ``fase`` vacia = fila que solo
+    cuenta ``modulos_completados`` del dia (un modulo puede no tener detalles).
+    La ferralla es ``proyecto.usuario``.
+
+    Lo mantiene ``api.services.refresh_produccion_diaria`` cuando cambia
+    ``Modulo.completado_at`` o un detalle de un modulo completado; se
+    reconstruye entero con ``manage.py rebuild_produccion_diaria``.
+    """
+    id = models.AutoField(primary_key=True)
+    fecha = models.DateField()
+    proyecto = models.ForeignKey(Proyecto, on_delete=models.CASCADE, related_name='produccion_diaria')
+    mesa = models.ForeignKey(
+        Mesa,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='produccion_diaria'
+    )
+    fase = models.CharField(max_length=20, blank=True, default='')
+
+    modulos_completados = models.PositiveIntegerField(default=0)
+    fases_completadas = models.PositiveIntegerField(default=0)
+    peso_malla_inicial_kg = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    peso_malla_final_kg = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    desperdicio_kg = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cantidad_cortes = models.PositiveIntegerField(default=0)
+    cantidad_refuerzos = models.PositiveIntegerField(default=0)
+    cantidad_zunchos = models.PositiveIntegerField(default=0)
+    cantidad_separadores = models.PositiveIntegerField(default=0)
+    cantidad_punzos = models.PositiveIntegerField(default=0)
+    # Sin normalizar: la escala (100 = media de la ferralla) se aplica al leer.
+    dificultad_raw = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.fecha} - {self.proyecto_id} - {self.mesa_id or 'sin mesa'} - {self.fase or 'modulos'}"
+
+    class Meta:
+        db_table = 'api_produccion_diaria'
+        ordering = ['fecha', 'proyecto', 'mesa', 'fase']
+        indexes = [
+            models.Index(fields=['fecha', 'proyecto']),
+            models.Index(fields=['proyecto', 'fecha']),
+        ]
+
+
+class JobEstado(models.TextChoices):
+    PENDIENTE = 'PENDIENTE', 'Pendiente'
+    EN_CURSO = 'EN_CURSO', 'En curso'
+    COMPLETADO = 'COMPLETADO', 'Completado'
+    ERROR = 'ERROR', 'Error'
+
+
+class Job(models.Model):
+    """
+    Trabajo en segundo plano (importaciones, planificacion, ZIP de fotos).
+
+    Lo crea la vista con ``?async=1`` y lo ejecuta ``manage.py run_jobs``
+    (ver api.jobs). ``resultado`` y ``status_code`` son la respuesta que
+    habria dado el endpoint sincrono.
+    """
+    tipo = models.CharField(max_length=40)
+    estado = models.CharField(
+        max_length=20,
+        choices=JobEstado.choices,
+        default=JobEstado.PENDIENTE
+    )
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    params = models.JSONField(default=dict, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    resultado = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Lo actualiza el worker al informar del progreso; si deja de avanzar,
+    # run_jobs devuelve el trabajo a la cola (worker caido).
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.estado})"
+
+    class Meta:
+        db_table = 'api_job'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['estado', 'created_at']),
+        ]
@@ -0,0 +1,63 @@
+"""
+Utilidades HTTP Range (RFC 9110) para respuestas de ficheros grandes:
+descargas ZIP en streaming y medios.
+
+Solo se atiende un rango por peticion; ``bytes=a-b,c-d`` se sirve completo
+(200), que es lo que permite la RFC y lo que necesitan navegadores y
+gestores de descarga para reanudar.
+"""
+import re
+
+_RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
+
+
+class RangeNotSatisfiable(Exception):
+    """El rango pedido no solapa con el recurso (responder 416)."""
+
+
+def parse_byte_range(header, size):
+    """
+    Devuelve ``(start, end)`` inclusivo para una cabecera ``Range``, o None si
+    no hay rango util (cabecera ausente, mal formada o multi-rango).
+    Lanza ``RangeNotSatisfiable`` si el rango cae fuera del recurso.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Sufijo: los ultimos N bytes.
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or (last and end < start):
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request, etag):
+    """
+    ``If-Range`` ausente o igual al ETag actual: se puede servir el rango.
+    Si no coincide el cliente tiene una version vieja y debe recibir 200.
+    """
+    if_range = request.headers.get('If-Range')
+    return not if_range or if_range.strip() == etag
+
+
+def etag_matches(request, etag):
+    """True si ``If-None-Match`` incluye ``etag`` (responder 304)."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    weak = etag[2:] if etag.startswith('W/') else etag
+    return '*' in candidates or any(
+        (value[2:] if value.startswith('W/') else value) == weak for value in candidates
+    )
@@ -1,12 +1,21 @@
 from django.contrib.auth.models import User
+from django.db.models import Count
 from rest_framework import serializers
 
 from api.models import (
     Proyecto, Planta, Modulo, Imagen, Mesa,
     ModuloQueue, ModuloQueueItem, MesaQueueItem, UserProfile, MesaQueueStatus,
     FotoFabricacion, GrupoMesas, GrupoMesasProyecto,
-    DetalleModuloFase, GrupoBastidor
+    DetalleModuloFase, GrupoBastidor, Job
 )
+from api.media import versioned_media_url
+
+
+class ImagenMediaUrlField(serializers.ReadOnlyField):
+    """URL del fichero de una Imagen con ``?v=<checksum>`` (cache inmutable, ver api.media)."""
+
+    def to_representation(self, imagen):
+        return versioned_media_url(imagen.url, imagen.checksum)
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -121,10 +130,16 @@ class ProyectoSerializer(serializers.HyperlinkedModelSerializer):
         }
 
     def get_grupos_count(self, obj):
-        return getattr(obj, '_grupos_count', None) or obj.grupos_bastidor.count()
+        cached = getattr(obj, '_grupos_count', None)
+        if cached is not None:
+            return cached
+        return obj.grupos_bastidor.count()
 
     def get_modulos_count(self, obj):
-        return getattr(obj, '_modulos_count', None) or obj.modulos.count()
+        cached = getattr(obj, '_modulos_count', None)
+        if cached is not None:
+            return cached
+        return obj.modulos.count()
 
     def get_modulos_completados(self, obj):
         cached = getattr(obj, '_modulos_completados', None)
@@ -133,18 +148,14 @@ class ProyectoSerializer(serializers.HyperlinkedModelSerializer):
         return obj.modulos.filter(estado__in=['COMPLETADO', 'CERRADO']).count()
 
     def get_modulos_completados_hoy(self, obj):
+        cached = getattr(obj, '_modulos_completados_hoy', None)
+        if cached is not None:
+            return cached
         from django.utils import timezone
-        today = timezone.localdate()
-        current_tz = timezone.get_current_timezone()
-        from datetime import timedelta, datetime
-        start = timezone.make_aware(datetime.combine(today, datetime.min.time()), current_tz)
-        end = timezone.make_aware(datetime.combine(today + timedelta(days=1), datetime.min.time()), current_tz)
-        return obj.modulos.filter(
-            completado_at__isnull=False,
-            completado_at__gte=start,
-            completado_at__lt=end,
-        ).count()
 
+        from api.services import local_day_range
+        start, end = local_day_range(timezone.localdate())
+        return obj.modulos.filter(completado_at__gte=start, completado_at__lt=end).count()
 
     def create(self, validated_data):
         num_plantas = validated_data.pop('num_plantas', 0)
@@ -220,7 +231,11 @@ class GrupoBastidorSerializer(serializers.ModelSerializer):
         read_only_fields = ["created_at", "proyecto", "indice"]
 
     def get_modulos(self, obj):
-        modulos = obj.modulos.all().order_by('nombre')
+        if 'modulos' in getattr(obj, '_prefetched_objects_cache', {}):
+            # GrupoBastidorViewSet ya los trae ordenados y con _fotos_count.
+            modulos = obj.modulos.all()
+        else:
+            modulos = obj.modulos.annotate(_fotos_count=Count('fotos_fabricacion')).order_by('nombre')
         return [
             {
                 "id": m.id,
@@ -230,7 +245,7 @@ class GrupoBastidorSerializer(serializers.ModelSerializer):
                 "inferior_hecho": m.inferior_hecho,
                 "superior_hecho": m.superior_hecho,
                 "cerrado": m.cerrado,
-                "fotos_count": m.fotos_fabricacion.count(),
+                "fotos_count": m._fotos_count,
             }
             for m in modulos
         ]
@@ -267,8 +282,18 @@ class ImagenSerializer(serializers.HyperlinkedModelSerializer):
         model = Imagen
         fields = [
             "id", "url", "src", "nombre", "modulo",
-            "fase", "orden", "version", "activo", "checksum"
+            "fase", "orden", "version", "activo", "checksum", "nombre_archivo", "variantes"
         ]
+        read_only_fields = ["checksum", "variantes"]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['url'] = data['src'] = versioned_media_url(instance.url, instance.checksum)
+        data['variantes'] = {
+            size: {fmt: versioned_media_url(url, instance.checksum) for fmt, url in formats.items()}
+            for size, formats in (instance.variantes or {}).items()
+        }
+        return data
 
     def get_nombre(self, obj):
         # Format: INF-001-MOD-A1
@@ -314,6 +339,8 @@ class MesaSerializer(serializers.HyperlinkedModelSerializer):
     grupo = serializers.PrimaryKeyRelatedField(queryset=GrupoMesas.objects.all(), allow_null=True, required=False)
     imagen = ImagenSerializer(source='imagen_actual', read_only=True)
     is_linked = serializers.SerializerMethodField()
+    last_seen = serializers.SerializerMethodField()
+    online = serializers.SerializerMethodField()
     
     class Meta:
         model = Mesa
@@ -321,7 +348,7 @@ class MesaSerializer(serializers.HyperlinkedModelSerializer):
             "id", "url", "nombre", "usuario",
             "grupo", "rol",
             "imagen_actual", "ultima_actualizacion", "imagen",
-            "locked", "blackout", "last_seen", "is_linked",
+            "locked", "blackout", "last_seen", "online", "is_linked",
             "mapper_enabled", "current_image_index", "calibration_json"
         ]
 
@@ -329,6 +356,15 @@ class MesaSerializer(serializers.HyperlinkedModelSerializer):
         """Returns True if a device is linked to this Mesa."""
         return bool(obj.device_token_hash)
 
+    def get_last_seen(self, obj):
+        """last_seen including heartbeats still buffered in memory."""
+        from api.device import mesa_last_seen
+        return serializers.DateTimeField().to_representation(mesa_last_seen(obj))
+
+    def get_online(self, obj):
+        from api.device import is_mesa_online
+        return is_mesa_online(obj)
+
 
 # =============================================================================
 # QUEUE SERIALIZERS
@@ -399,7 +435,7 @@ class ModuloQueueItemSerializer(serializers.ModelSerializer):
 
 class MesaQueueItemSerializer(serializers.ModelSerializer):
     modulo_nombre = serializers.CharField(source='modulo.nombre', read_only=True)
-    imagen_url = serializers.CharField(source='imagen.url', read_only=True)
+    imagen_url = ImagenMediaUrlField(source='imagen')
     mesa_nombre = serializers.CharField(source='mesa.nombre', read_only=True)
     modulo_planta_id = serializers.SerializerMethodField()
     modulo_proyecto_id = serializers.SerializerMethodField()
@@ -543,7 +579,7 @@ class DeviceHeartbeatSerializer(serializers.Serializer):
     last_error = serializers.CharField(required=False, allow_blank=True)
 
 class MesaStateSerializer(serializers.ModelSerializer):
-    image_url = serializers.CharField(source='imagen_actual.url', read_only=True)
+    image_url = ImagenMediaUrlField(source='imagen_actual')
     
     class Meta:
         model = Mesa
@@ -553,3 +589,13 @@ class MesaStateSerializer(serializers.ModelSerializer):
             'mapper_enabled', 'current_image_index', 'calibration_json',
             'blackout', 'locked', 'last_seen'
         ]
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "id", "tipo", "estado", "progress", "resultado", "status_code", "error",
+            "attempts", "created_at", "started_at", "finished_at",
+        ]
+        read_only_fields = fields
@@ -0,0 +1,370 @@
+"""
+Operaciones de dominio compartidas por varias vistas.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.events import publish_mesa_event
+from api.models import (
+    Fase, GrupoMesas, GrupoMesasProyecto, Mesa, MesaQueueItem, MesaQueueStatus,
+    Modulo, ModuloEstado, ProduccionDiaria,
+)
+
+
+class QueueAdvance(NamedTuple):
+    item: Optional[MesaQueueItem]
+    next_item: Optional[MesaQueueItem]
+    promoted: bool
+
+
+def _modulo_fase_done_updates(fase, now):
+    """
+    Mismo resultado que ``marcar_hecho()`` + ``Modulo.actualizar_estado()``
+    pero como expresiones de un unico UPDATE.
+    """
+    if fase == Fase.INFERIOR:
+        flag, other = 'inferior_hecho', 'superior_hecho'
+    else:
+        flag, other = 'superior_hecho', 'inferior_hecho'
+    finished = Q(cerrado=True) | Q(**{other: True})
+    return {
+        flag: True,
+        'estado': Case(
+            When(cerrado=True, then=Value(ModuloEstado.CERRADO)),
+            When(**{other: True}, then=Value(ModuloEstado.COMPLETADO)),
+            default=Value(ModuloEstado.EN_PROGRESO),
+        ),
+        'completado_at': Case(
+            When(finished, then=Coalesce('completado_at', Value(now))),
+            default=Value(None),
+            output_field=DateTimeField(),
+        ),
+        'updated_at': Value(now),
+    }
+
+
+def advance_mesa_queue(mesa_id, item_id=None, user=None, delete=False):
+    """
+    Cierra (HECHO) o borra un item de la cola de una mesa y, si era el que
+    estaba MOSTRANDO, promociona el siguiente EN_COLA.
+
+    - ``item_id=None``: actua sobre el item MOSTRANDO de la mesa (player).
+    - ``delete=True``: borra el item en lugar de marcarlo HECHO.
+
+    Todo ocurre en una transaccion con la mesa bloqueada (select_for_update)
+    y con un numero fijo de sentencias (maximo 7), sin ``save()`` por fila.
+    Devuelve ``QueueAdvance``; ``item`` es None si no habia nada que cerrar.
+    """
+    if user is not None and not user.is_authenticated:
+        user = None
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Serializa los avances concurrentes de la misma mesa (botonera + dashboard).
+        list(Mesa.objects.select_for_update().filter(pk=mesa_id).values_list('pk', flat=True))
+
+        items = MesaQueueItem.objects.filter(mesa_id=mesa_id)
+        if item_id is None:
+            items = items.filter(status=MesaQueueStatus.MOSTRANDO)
+        else:
+            items = items.filter(pk=item_id)
+        item = items.order_by('position').first()
+        if item is None:
+            return QueueAdvance(None, None, False)
+
+        was_showing = item.status == MesaQueueStatus.MOSTRANDO
+
+        if delete:
+            MesaQueueItem.objects.filter(pk=item.pk).delete()
+        else:
+            MesaQueueItem.objects.filter(pk=item.pk).update(
+                status=MesaQueueStatus.HECHO, done_at=now, done_by=user
+            )
+            item.status = MesaQueueStatus.HECHO
+            item.done_at = now
+            item.done_by = user
+            Modulo.objects.filter(pk=item.modulo_id).update(
+                **_modulo_fase_done_updates(item.fase, now)
+            )
+            # El rollup diario se refresca tras el commit, fuera de la transaccion.
+            schedule_modulo_produccion_refresh(item.modulo_id)
+
+        if not was_showing:
+            # Sale de la cola pendiente: el bundle del player cambia igual.
+            Mesa.bump_version([mesa_id])
+            return QueueAdvance(item, None, False)
+
+        next_item = (
+            MesaQueueItem.objects
+            .select_related('modulo', 'imagen', 'mesa', 'modulo__planta', 'modulo__planta__proyecto')
+            .filter(mesa_id=mesa_id, status=MesaQueueStatus.EN_COLA)
+            .order_by('position')
+            .first()
+        )
+        if next_item is not None:
+            MesaQueueItem.objects.filter(pk=next_item.pk).update(status=MesaQueueStatus.MOSTRANDO)
+            next_item.status = MesaQueueStatus.MOSTRANDO
+
+        Mesa.objects.filter(pk=mesa_id).update(
+            imagen_actual=next_item.imagen_id if next_item else None,
+            current_image_index=0,
+            version=F('version') + 1,
+        )
+        # update() no dispara post_save: avisar a los streams a mano.
+        publish_mesa_event(mesa_id)
+
+    return QueueAdvance(item, next_item, True)
+
+
+# ---------------------------------------------------------------------------
+# Rollup diario de produccion (ProduccionDiaria)
+# ---------------------------------------------------------------------------
+
+PRODUCCION_DECIMAL_FIELDS = ('peso_malla_inicial_kg', 'peso_malla_final_kg', 'desperdicio_kg')
+PRODUCCION_COUNT_FIELDS = (
+    'cantidad_cortes', 'cantidad_refuerzos', 'cantidad_zunchos',
+    'cantidad_separadores', 'cantidad_punzos',
+)
+
+
+def produccion_fecha(completado_at):
+    """Dia (hora local) al que se imputa un modulo completado."""
+    return timezone.localtime(completado_at).date()
+
+
+def local_day_range(fecha):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(fecha, time.min), tz)
+    end = timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def _rol_for_fase(fase, modulo):
+    # INFERIOR phases split between INF1 and INF2 based on the
+    # bastidor group parity (odd -> INF1, even -> INF2). Matches
+    # how the planner already distributes bastidores.
+    if fase == Fase.SUPERIOR:
+        return ['SUPERIORES']
+    gb = modulo.grupo_bastidor
+    if gb is not None and gb.indice % 2 == 0:
+        return ['INFERIOR_2', 'INFERIOR_1']
+    return ['INFERIOR_1', 'INFERIOR_2']
+
+
+def _attribute_mesas(modulos):
+    """
+    (modulo_id, fase) -> mesa_id (o None) para las fases de ``modulos``.
+
+    Primero el MesaQueueItem HECHO de esa fase; si la fase nunca paso por una
+    cola (datos sembrados, cierre desde admin, proyecto ya fuera de la cola)
+    se usa la mesa con el rol adecuado del grupo operativo del modulo: el de
+    la cola del proyecto, el que tiene reservado su bastidor o el primer
+    grupo de la ferralla.
+    """
+    modulo_ids = [m.id for m in modulos]
+    mesa_by_modulo_fase = {}
+    grupo_by_modulo = {}
+    for modulo_id, fase, mesa_id, grupo_id in (
+        MesaQueueItem.objects
+        .filter(modulo_id__in=modulo_ids, status=MesaQueueStatus.HECHO)
+        .values_list('modulo_id', 'fase', 'mesa_id', 'mesa__grupo_id')
+    ):
+        mesa_by_modulo_fase[(modulo_id, fase)] = mesa_id
+        if grupo_id:
+            grupo_by_modulo.setdefault(modulo_id, grupo_id)
+
+    proyecto_ids = {m.proyecto_id for m in modulos}
+    proyecto_to_grupo = {}
+    for proyecto_id, grupo_id in (
+        GrupoMesasProyecto.objects.filter(proyecto_id__in=proyecto_ids)
+        .order_by('proyecto_id', 'orden', 'id')
+        .values_list('proyecto_id', 'grupo_mesas_id')
+    ):
+        proyecto_to_grupo.setdefault(proyecto_id, grupo_id)
+
+    usuarios = {m.proyecto.usuario_id for m in modulos if m.proyecto.usuario_id}
+    usuario_to_first_grupo = {}
+    for grupo in GrupoMesas.objects.filter(usuario_id__in=usuarios).order_by('usuario_id', 'nombre'):
+        usuario_to_first_grupo.setdefault(grupo.usuario_id, grupo.id)
+
+    for m in modulos:
+        if m.id in grupo_by_modulo:
+            continue
+        grupo_id = proyecto_to_grupo.get(m.proyecto_id)
+        if grupo_id is None and m.grupo_bastidor is not None:
+            grupo_id = m.grupo_bastidor.asignado_a_id
+        if grupo_id is None and m.proyecto.usuario_id:
+            grupo_id = usuario_to_first_grupo.get(m.proyecto.usuario_id)
+        if grupo_id is not None:
+            grupo_by_modulo[m.id] = grupo_id
+
+    mesa_by_grupo_rol = {}
+    for mesa_id, grupo_id, rol in Mesa.objects.filter(
+        grupo_id__in=set(grupo_by_modulo.values())
+    ).values_list('id', 'grupo_id', 'rol'):
+        mesa_by_grupo_rol.setdefault(grupo_id, {}).setdefault(rol, mesa_id)
+
+    result = {}
+    for m in modulos:
+        group_roles = mesa_by_grupo_rol.get(grupo_by_modulo.get(m.id), {})
+        for detalle in m.detalles_fase.all():
+            key = (m.id, detalle.fase)
+            if key in mesa_by_modulo_fase:
+                result[key] = mesa_by_modulo_fase[key]
+                continue
+            result[key] = next(
+                (group_roles[rol] for rol in _rol_for_fase(detalle.fase, m) if rol in group_roles),
+                None,
+            )
+    return result
+
+
+def _build_produccion_rows(modulos):
+    """Filas ProduccionDiaria (sin guardar) para una lista de modulos completados."""
+    mesa_by_modulo_fase = _attribute_mesas(modulos)
+    rows = {}
+
+    def row_for(fecha, proyecto_id, mesa_id, fase):
+        key = (fecha, proyecto_id, mesa_id, fase)
+        if key not in rows:
+            rows[key] = ProduccionDiaria(fecha=fecha, proyecto_id=proyecto_id, mesa_id=mesa_id, fase=fase)
+        return rows[key]
+
+    for m in modulos:
+        fecha = produccion_fecha(m.completado_at)
+        row_for(fecha, m.proyecto_id, None, '').modulos_completados += 1
+        for detalle in m.detalles_fase.all():
+            row = row_for(fecha, m.proyecto_id, mesa_by_modulo_fase.get((m.id, detalle.fase)), detalle.fase)
+            row.fases_completadas += 1
+            for field in PRODUCCION_DECIMAL_FIELDS:
+                value = getattr(detalle, field)
+                if value is not None:
+                    setattr(row, field, getattr(row, field) + Decimal(value))
+            for field in PRODUCCION_COUNT_FIELDS:
+                setattr(row, field, getattr(row, field) + (getattr(detalle, field) or 0))
+            raw = detalle.dificultad_raw
+            if raw is None:
+                raw = Decimal(str(detalle.dificultad_calculada))
+            row.dificultad_raw += raw
+    return list(rows.values())
+
+
+def _completed_modulos():
+    return (
+        Modulo.objects
+        .select_related('proyecto', 'grupo_bastidor')
+        .prefetch_related('detalles_fase')
+        .filter(completado_at__isnull=False)
+    )
+
+
+def refresh_produccion_diaria(proyecto_id, fechas):
+    """
+    Recalcula las filas ProduccionDiaria de un proyecto para los dias dados
+    (borra y reinserta solo esos dias). Devuelve el numero de filas escritas.
+    """
+    fechas = set(fechas)
+    if not fechas:
+        return 0
+    day_filter = Q()
+    for fecha in fechas:
+        start, end = local_day_range(fecha)
+        day_filter |= Q(completado_at__gte=start, completado_at__lt=end)
+    modulos = list(_completed_modulos().filter(day_filter, proyecto_id=proyecto_id))
+    rows = _build_produccion_rows(modulos)
+    with transaction.atomic():
+        ProduccionDiaria.objects.filter(proyecto_id=proyecto_id, fecha__in=fechas).delete()
+        ProduccionDiaria.objects.bulk_create(rows)
+    return len(rows)
+
+
+def _on_commit_batch(name, items, flush):
+    """
+    Acumula ``items`` en un set por transaccion y llama ``flush(set)`` una
+    sola vez al confirmarla (en el acto si no hay transaccion): un borrado o
+    una importacion de N filas encola un unico callback, no N.
+    """
+    connection = transaction.get_connection()
+    pending = connection.__dict__.setdefault('_api_on_commit_batches', {})
+    entry = pending.get(name)
+    # Si la transaccion se revirtio Django ya descarto el callback: lote nuevo.
+    if entry is not None and any(hook[1] is entry[1] for hook in connection.run_on_commit):
+        entry[0].update(items)
+        return
+    batch = set(items)
+
+    def run():
+        if pending.get(name, (None,))[0] is batch:
+            del pending[name]
+        flush(batch)
+
+    pending[name] = (batch, run)
+    transaction.on_commit(run)
+
+
+def _refresh_produccion_pairs(pairs):
+    by_proyecto = {}
+    for proyecto_id, fecha in pairs:
+        by_proyecto.setdefault(proyecto_id, set()).add(fecha)
+    for proyecto_id, fechas in by_proyecto.items():
+        refresh_produccion_diaria(proyecto_id, fechas)
+
+
+def schedule_produccion_refresh(proyecto_id, completados):
+    """
+    Refresca el rollup de los dias de ``completados`` (datetimes o dates)
+    cuando confirme la transaccion actual. Los dias se acumulan por
+    transaccion y cada (proyecto, dia) se recalcula una sola vez.
+    """
+    fechas = {
+        produccion_fecha(value) if isinstance(value, datetime) else value
+        for value in completados if value is not None
+    }
+    if proyecto_id is None or not fechas:
+        return
+    _on_commit_batch(
+        'produccion', {(proyecto_id, fecha) for fecha in fechas}, _refresh_produccion_pairs,
+    )
+
+
+def _refresh_produccion_for_modulos(modulo_ids):
+    rows = Modulo.objects.filter(pk__in=modulo_ids, completado_at__isnull=False).values_list(
+        'proyecto_id', 'completado_at',
+    )
+    _refresh_produccion_pairs({(proyecto_id, produccion_fecha(value)) for proyecto_id, value in rows})
+
+
+def schedule_modulo_produccion_refresh(modulo_id):
+    """
+    Como ``schedule_produccion_refresh`` pero para el dia en que se completo
+    ``modulo_id``; la consulta (una para todos los modulos de la transaccion)
+    se hace tras el commit y solo cuenta los completados.
+    """
+    _on_commit_batch('produccion_modulos', [modulo_id], _refresh_produccion_for_modulos)
+
+
+def rebuild_produccion_diaria(proyecto_id=None):
+    """Reconstruye el rollup entero (o el de un proyecto) desde los modulos completados."""
+    proyectos = Modulo.objects.filter(completado_at__isnull=False)
+    if proyecto_id is not None:
+        proyectos = proyectos.filter(proyecto_id=proyecto_id)
+    proyecto_ids = sorted(set(proyectos.values_list('proyecto_id', flat=True)))
+
+    written = 0
+    with transaction.atomic():
+        stale = ProduccionDiaria.objects.all()
+        if proyecto_id is not None:
+            stale = stale.filter(proyecto_id=proyecto_id)
+        stale.delete()
+        # Un proyecto cada vez para acotar la memoria en historicos grandes.
+        for pid in proyecto_ids:
+            rows = _build_produccion_rows(list(_completed_modulos().filter(proyecto_id=pid)))
+            ProduccionDiaria.objects.bulk_create(rows, batch_size=500)
+            written += len(rows)
+    return written
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.derivatives import schedule_variants
+from api.device import device_token_cache
+from api.events import publish_mesa_event
+from api.models import Imagen, Mesa
+
+
+def _forget_device_token(mesa):
+    # Inmediato (no on_commit): un token reasignado o revocado no debe
+    # seguir autenticando mientras la transaccion termina.
+    device_token_cache.invalidate_mesa(mesa.pk)
+    if 'device_token_hash' in mesa.__dict__ and mesa.device_token_hash:
+        device_token_cache.invalidate_hash(mesa.device_token_hash)
+
+
+@receiver(post_save, sender=Mesa)
+def mesa_saved(sender, instance, **kwargs):
+    _forget_device_token(instance)
+    publish_mesa_event(instance.pk)
+
+
+@receiver(post_delete, sender=Mesa)
+def mesa_deleted(sender, instance, **kwargs):
+    _forget_device_token(instance)
+    publish_mesa_event(instance.pk)
+
+
+@receiver(post_save, sender=Imagen)
+def imagen_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'url' in update_fields):
+        schedule_variants(instance.pk)
+    Mesa.bump_version_for_modulos([instance.modulo_id])
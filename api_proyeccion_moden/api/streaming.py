@@ -0,0 +1,76 @@
+"""
+Cuerpos en streaming que funcionan igual bajo WSGI y ASGI.
+
+Bajo ASGI, ``StreamingHttpResponse`` con un iterador sincrono se consume
+con ``sync_to_async(list)``: el archivo entero acaba en memoria antes del
+primer byte. ``streaming_body`` entrega en ese caso un iterador async que
+pide cada bloque con su propia llamada a ``sync_to_async``, asi la memoria
+es la de un bloque y el primer byte sale en cuanto se lee.
+"""
+import mimetypes
+import os
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+CHUNK_SIZE = 256 * 1024
+
+_DONE = object()
+
+
+def is_asgi_request(request):
+    # Las vistas DRF reciben un Request que envuelve al HttpRequest.
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def aiter_blocks(iterable):
+    """Iterador async sobre ``iterable`` (sincrono): un bloque por hilo y vuelta."""
+    iterator = iter(iterable)
+    # Lecturas de fichero sin ORM: no hace falta el hilo de la peticion.
+    next_block = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            block = await next_block(iterator, _DONE)
+            if block is _DONE:
+                return
+            yield block
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=False)()
+
+
+def streaming_body(request, iterable):
+    """Contenido para ``StreamingHttpResponse``: ``iterable`` o su version async bajo ASGI."""
+    if is_asgi_request(request):
+        return aiter_blocks(iterable)
+    return iterable
+
+
+def iter_file(path, start=0, length=None):
+    """Bloques de ``CHUNK_SIZE`` de ``path`` desde ``start`` (hasta el final o ``length`` bytes)."""
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = fh.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def file_download(request, path, filename):
+    """Descarga de ``path`` como adjunto: ``FileResponse`` bajo WSGI, por bloques async bajo ASGI."""
+    if not is_asgi_request(request):
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+    content_type, _ = mimetypes.guess_type(filename)
+    response = StreamingHttpResponse(
+        aiter_blocks(iter_file(path)), content_type=content_type or 'application/octet-stream',
+    )
+    response['Content-Length'] = str(os.path.getsize(path))
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
@@ -1,23 +1,54 @@
+import asyncio
 import hashlib
+import io
+import threading
 import json
 import os
 import sqlite3
 import tempfile
 from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase
 
 from api.models import (
     Imagen, Mesa, MesaQueueItem, Modulo, Planta, Proyecto,
-    DetalleModuloFase, GrupoMesas
+    DetalleModuloFase, FotoFabricacion, GrupoMesas, GrupoMesasProyecto, ProduccionDiaria
 )
 
 
+async def _asgi_request(app, method, path, headers=(), body=b""):
+    """Llama a una aplicacion ASGI como lo haria uvicorn; devuelve los mensajes enviados."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 50000),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
 @override_settings(
     REST_FRAMEWORK={
         "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
@@ -42,6 +73,10 @@ class PermissionAndDeviceAuthTests(APITestCase):
         self.mesa_a.device_token_hash = hashlib.sha256(raw_device_token.encode()).hexdigest()
         self.mesa_a.save(update_fields=["device_token_hash"])
 
+    def tearDown(self):
+        from api.device import heartbeat_buffer
+        heartbeat_buffer.clear()
+
     def test_projects_requires_authentication(self):
         response = self.client.get("/api/proyectos/")
         self.assertEqual(response.status_code, 401)
@@ -61,6 +96,44 @@ class PermissionAndDeviceAuthTests(APITestCase):
         self.assertEqual(response.data["count"], 2)
         self.assertEqual(len(response.data["results"]), 2)
 
+    def test_listado_de_proyectos_con_consultas_constantes(self):
+        from api.models import GrupoBastidor, UserProfile
+
+        UserProfile.objects.create(user=self.user_a, capacidad_diaria_modulos=20)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.admin_token.key}")
+
+        def add_projects(count):
+            for i in range(count):
+                proyecto = Proyecto.objects.create(nombre=f"Proyecto X{Proyecto.objects.count()}", usuario=self.user_a)
+                planta = Planta.objects.create(nombre="P1", proyecto=proyecto, orden=1)
+                GrupoBastidor.objects.create(proyecto=proyecto, indice=1)
+                GrupoBastidor.objects.create(proyecto=proyecto, indice=2)
+                Modulo.objects.create(nombre="M-01", proyecto=proyecto, planta=planta)
+                Modulo.objects.create(nombre="M-02", proyecto=proyecto, planta=planta, estado="COMPLETADO")
+                ayer = Modulo.objects.create(nombre="M-03", proyecto=proyecto, planta=planta, estado="COMPLETADO")
+                Modulo.objects.filter(pk=ayer.pk).update(completado_at=timezone.now() - timedelta(days=1))
+
+        add_projects(2)
+        # Token + COUNT de la paginacion + la pagina.
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/proyectos/")
+        self.assertEqual(response.data["count"], 4)
+
+        add_projects(6)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/proyectos/")
+        self.assertEqual(response.data["count"], 10)
+
+        results = {row["id"]: row for row in response.data["results"]}
+        row = results[Proyecto.objects.get(nombre="Proyecto X2").pk]
+        self.assertEqual(
+            (row["grupos_count"], row["modulos_count"], row["modulos_completados"], row["modulos_completados_hoy"]),
+            (2, 3, 2, 1),
+        )
+        self.assertEqual(row["capacidad_diaria_usuario"], 20)
+        vacio = results[self.project_b.pk]
+        self.assertEqual((vacio["grupos_count"], vacio["modulos_count"], vacio["capacidad_diaria_usuario"]), (0, 0, 12))
+
     def test_device_heartbeat_requires_valid_device_token(self):
         response = self.client.post("/api/device/heartbeat/", {}, format="json")
         self.assertEqual(response.status_code, 401)
@@ -73,6 +146,32 @@ class PermissionAndDeviceAuthTests(APITestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+    def test_heartbeat_is_buffered_and_flushed_in_one_update(self):
+        from api.device import heartbeat_buffer
+
+        with mock.patch.object(heartbeat_buffer, "flush_interval", 3600):
+            response = self.client.post(
+                "/api/device/heartbeat/",
+                {},
+                format="json",
+                HTTP_AUTHORIZATION=f"Bearer {self.device_token}",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.mesa_a.refresh_from_db()
+        self.assertIsNone(self.mesa_a.last_seen)
+
+        self.mesa_a.grupo = GrupoMesas.objects.create(nombre="Grupo A", usuario=self.user_a)
+        self.mesa_a.save(update_fields=["grupo"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.user_a_token.key}")
+        response = self.client.get(f"/api/mesas/{self.mesa_a.id}/")
+        self.assertTrue(response.data["online"])
+        self.assertIsNotNone(response.data["last_seen"])
+
+        with self.assertNumQueries(1):
+            heartbeat_buffer.flush()
+        self.mesa_a.refresh_from_db()
+        self.assertIsNotNone(self.mesa_a.last_seen)
+
     def test_pair_rejects_expired_mesa_code(self):
         self.mesa_a.pairing_code = "ABC123"
         self.mesa_a.pairing_code_expires_at = timezone.now() - timedelta(minutes=1)
@@ -87,6 +186,156 @@ class PermissionAndDeviceAuthTests(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data["detail"], "Pairing code expired")
 
+    def test_device_stream_is_pushed_on_mesa_save(self):
+        response = self.client.get(f"/api/device/stream/?token={self.device_token}")
+        self.assertEqual(response.status_code, 200)
+        stream = iter(response.streaming_content)
+        try:
+            initial = json.loads(next(stream).decode()[len("data: "):])
+            self.assertEqual(initial["data"]["current_image_index"], 0)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.mesa_a.current_image_index = 3
+                self.mesa_a.save(update_fields=["current_image_index", "ultima_actualizacion"])
+
+            # El evento ya esta publicado: el siguiente chunk llega sin esperar al keep-alive.
+            update = json.loads(next(stream).decode()[len("data: "):])
+            self.assertEqual(update["data"]["current_image_index"], 3)
+        finally:
+            response.close()
+
+    async def test_device_state_and_current_item_served_over_asgi(self):
+        headers = {"Authorization": f"Bearer {self.device_token}"}
+
+        response = await self.async_client.get("/api/device/state/")
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get("/api/device/state/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.mesa_a.id)
+
+        response = await self.async_client.get("/api/device/current_item/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json())
+
+    async def test_api_sincrona_no_bloquea_los_endpoints_async_del_player(self):
+        from django.core.signals import request_finished, request_started
+        from django.db import close_old_connections
+
+        from proyeccion_moden import asgi
+        from proyeccion_moden.wsgi_bridge import WsgiBridge
+
+        self.assertTrue(asgi.is_async_view("/api/device/heartbeat/"))
+        self.assertFalse(asgi.is_async_view("/api/proyectos/"))
+
+        release = threading.Event()
+        entered = threading.Semaphore(0)
+
+        def slow_wsgi_app(environ, start_response):
+            # Una importacion/planificar larga: ocupa su hilo hasta que acabe.
+            entered.release()
+            release.wait(10)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"done"]
+
+        # Igual que el cliente de test: el handler real cerraria la conexion del test.
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with mock.patch.object(asgi, "sync_api", WsgiBridge(slow_wsgi_app, threads=2)):
+                slow = [
+                    asyncio.ensure_future(_asgi_request(asgi.application, "GET", "/api/proyectos/"))
+                    for _ in range(2)
+                ]
+                for _ in range(2):
+                    while not entered.acquire(blocking=False):
+                        await asyncio.sleep(0.01)
+
+                headers = [("Authorization", f"Bearer {self.device_token}"), ("Content-Type", "application/json")]
+                for _ in range(5):
+                    sent = await asyncio.wait_for(
+                        _asgi_request(asgi.application, "POST", "/api/device/heartbeat/", headers, b"{}"),
+                        timeout=5,
+                    )
+                    self.assertEqual(sent[0]["status"], 200)
+                self.assertFalse(any(task.done() for task in slow))
+
+                release.set()
+                for sent in await asyncio.gather(*slow):
+                    self.assertEqual(sent[0]["status"], 200)
+                    self.assertEqual(b"".join(m.get("body", b"") for m in sent[1:]), b"done")
+        finally:
+            release.set()
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    async def test_puente_wsgi_envia_el_streaming_trozo_a_trozo(self):
+        from proyeccion_moden.wsgi_bridge import WsgiBridge
+
+        second_chunk = threading.Event()
+
+        def streaming_app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "application/zip")])
+            yield b"first"
+            second_chunk.wait(5)
+            yield b"second"
+
+        first_sent = asyncio.Event()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+            if message.get("body") == b"first":
+                first_sent.set()
+
+        pending = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            await asyncio.Event().wait()
+
+        scope = {"type": "http", "method": "GET", "path": "/api/jobs/1/download/", "headers": []}
+        task = asyncio.ensure_future(WsgiBridge(streaming_app, threads=1)(scope, receive, send))
+        await asyncio.wait_for(first_sent.wait(), timeout=5)
+        self.assertFalse(task.done())
+        second_chunk.set()
+        await task
+        self.assertEqual([m.get("body") for m in sent[1:]], [b"first", b"second", b""])
+
+    def test_device_token_is_cached_until_unbind(self):
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {self.device_token}"}
+        self.assertEqual(self.client.get("/api/device/current_item/", **auth).status_code, 200)
+
+        # Token ya cacheado: solo queda la consulta del item MOSTRANDO.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get("/api/device/current_item/", **auth).status_code, 200)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.user_a_token.key}")
+        response = self.client.post("/api/device/unbind/", {"mesa_id": self.mesa_a.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        self.client.credentials()
+        self.assertEqual(self.client.get("/api/device/current_item/", **auth).status_code, 401)
+
+    def test_acciones_de_dispositivo_no_cargan_campos_diferidos_uno_a_uno(self):
+        from api.device import CALIBRATION_FIELDS, authenticate_device, load_mesa_fields
+
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {self.device_token}"}
+        self.assertEqual(self.client.get("/api/device/current_item/", **auth).status_code, 200)
+
+        # Snapshot de la cache: los campos de calibracion llegan en una consulta.
+        request = mock.Mock(headers={"Authorization": f"Bearer {self.device_token}"})
+        with self.assertNumQueries(1):
+            mesa = load_mesa_fields(authenticate_device(request), CALIBRATION_FIELDS)
+            self.assertEqual((mesa.mapper_enabled, mesa.current_image_index), (False, 0))
+            self.assertIsNone(mesa.calibration_json)
+
+        # Lectura del flag + UPDATE, sin consultas por atributo.
+        with self.assertNumQueries(2):
+            response = self.client.post("/api/device/toggle_mapper/", **auth)
+        self.assertEqual(response.data["mapper_enabled"], True)
+
 
 @override_settings(
     REST_FRAMEWORK={
@@ -162,6 +411,89 @@ class MesaQueueItemBehaviorTests(APITestCase):
         self.assertEqual(delete_response.status_code, 204)
         self.assertFalse(MesaQueueItem.objects.filter(id=item_id).exists())
 
+    def test_advance_queue_marks_done_and_promotes_next_in_constant_queries(self):
+        from api.services import advance_mesa_queue
+
+        first = self._create_item(self.mesa_a.id, self.modulo_a.id, position=0)
+        second = self._create_item(self.mesa_a.id, self.modulo_b.id, position=1)
+        Modulo.objects.filter(id=self.modulo_a.id).update(superior_hecho=True, estado="EN_PROGRESO")
+
+        # 7 sentencias + SAVEPOINT/RELEASE del atomic() dentro del test.
+        with self.assertNumQueries(9):
+            result = advance_mesa_queue(self.mesa_a.id, user=self.user)
+
+        self.assertEqual(result.item.id, first.data["id"])
+        self.assertEqual(result.next_item.id, second.data["id"])
+        self.assertEqual(MesaQueueItem.objects.get(id=first.data["id"]).status, "HECHO")
+        self.assertEqual(MesaQueueItem.objects.get(id=second.data["id"]).status, "MOSTRANDO")
+        self.modulo_a.refresh_from_db()
+        self.assertTrue(self.modulo_a.inferior_hecho)
+        self.assertEqual(self.modulo_a.estado, "COMPLETADO")
+        self.assertIsNotNone(self.modulo_a.completado_at)
+
+    def test_device_mark_done_returns_new_current_item(self):
+        raw_device_token = "queue-device-token"
+        self.mesa_a.device_token_hash = hashlib.sha256(raw_device_token.encode()).hexdigest()
+        self.mesa_a.save(update_fields=["device_token_hash"])
+        self._create_item(self.mesa_a.id, self.modulo_a.id, position=0)
+        second = self._create_item(self.mesa_a.id, self.modulo_b.id, position=1)
+
+        self.client.credentials()
+        response = self.client.post(
+            "/api/device/mark_done/", {}, format="json",
+            HTTP_AUTHORIZATION=f"Bearer {raw_device_token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["current_item"]["id"], second.data["id"])
+        self.assertEqual(response.data["current_item"]["images"], [])
+        self.modulo_a.refresh_from_db()
+        self.assertEqual(self.modulo_a.estado, "EN_PROGRESO")
+
+    def test_device_bundle_uses_mesa_version_as_etag(self):
+        from api.services import advance_mesa_queue
+
+        raw_device_token = "bundle-device-token"
+        self.mesa_a.device_token_hash = hashlib.sha256(raw_device_token.encode()).hexdigest()
+        self.mesa_a.save(update_fields=["device_token_hash"])
+        first = self._create_item(self.mesa_a.id, self.modulo_a.id, position=0)
+        second = self._create_item(self.mesa_a.id, self.modulo_b.id, position=1)
+        self._create_item(self.mesa_a.id, self.modulo_c.id, position=2)
+        Imagen.objects.create(modulo=self.modulo_b, fase="INFERIOR", orden=2, url="/media/b2.png")
+        Imagen.objects.create(modulo=self.modulo_b, fase="INFERIOR", orden=1, url="/media/b1.png")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {raw_device_token}")
+
+        response = self.client.get("/api/device/bundle/?next=1")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        data = response.json()
+        self.assertEqual(data["current"]["id"], first.data["id"])
+        self.assertEqual([item["id"] for item in data["next"]], [second.data["id"]])
+        self.assertEqual(
+            [image["orden"] for image in data["next"][0]["images"]], [1, 2]
+        )
+        self.assertEqual(data["mesa"]["nombre"], "Mesa A")
+        # Misma forma (MesaQueueItemSerializer + images) que current_item.
+        self.assertEqual(data["current"], self.client.get("/api/device/current_item/").json())
+
+        # Token en cache + la version: sin tocar la cola ni serializar.
+        with self.assertNumQueries(1):
+            not_modified = self.client.get("/api/device/bundle/?next=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], etag)
+
+        self.modulo_b.nombre = "M-B2"
+        self.modulo_b.save()
+        renamed = self.client.get("/api/device/bundle/?next=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.json()["next"][0]["modulo_nombre"], "M-B2")
+
+        etag = renamed["ETag"]
+        advance_mesa_queue(self.mesa_a.id, user=self.user)
+        advanced = self.client.get("/api/device/bundle/?next=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(advanced.status_code, 200)
+        self.assertNotEqual(advanced["ETag"], etag)
+        self.assertEqual(advanced.json()["current"]["id"], second.data["id"])
+
     def test_queue_can_be_reordered(self):
         first = self._create_item(self.mesa_a.id, self.modulo_a.id, position=0)
         second = self._create_item(self.mesa_a.id, self.modulo_b.id, position=1)
@@ -381,6 +713,548 @@ class PlanningFoundationTests(APITestCase):
         self.assertEqual(str(self.modulo.ancho_cm), "18.00")
         self.assertEqual(DetalleModuloFase.objects.filter(modulo=self.modulo).count(), 2)
 
+    def test_dificultad_se_persiste_y_la_escala_sale_del_agregado(self):
+        from api.views import _compute_dificultad_scale
+
+        inferior = DetalleModuloFase.objects.create(
+            modulo=self.modulo, fase="INFERIOR", cantidad_cortes=10,
+        )
+        superior = DetalleModuloFase.objects.create(
+            modulo=self.modulo, fase="SUPERIOR", cantidad_cortes=20,
+        )
+        self.assertEqual(inferior.dificultad_raw, inferior._calcular_dificultad_raw())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.dificultad_detalles, 2)
+        self.assertEqual(float(self.project.dificultad_raw_total), 30.0)
+
+        with self.assertNumQueries(1):
+            self.assertAlmostEqual(_compute_dificultad_scale(self.user), 100.0 / 15.0)
+
+        # Las cintas de color solo cuentan en SUPERIOR: cambiar el codigo la recalcula.
+        self.modulo.codigos_color = "yyxxxxxx"
+        self.modulo.save(update_fields=["codigos_color"])
+        superior.refresh_from_db()
+        self.assertEqual(float(superior.dificultad_raw), 23.0)
+        self.project.refresh_from_db()
+        self.assertEqual(float(self.project.dificultad_raw_total), 33.0)
+
+        inferior.delete()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.dificultad_detalles, 1)
+        self.assertEqual(float(self.project.dificultad_raw_total), 23.0)
+
+    def test_borrado_en_cascada_no_crece_con_los_modulos(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        mesa = Mesa.objects.create(nombre="Mesa Cascada", usuario=self.user)
+
+        def proyecto_con_modulos(n):
+            proyecto = Proyecto.objects.create(nombre=f"Cascada {n}", usuario=self.user)
+            planta = Planta.objects.create(nombre="P1", proyecto=proyecto)
+            for index in range(n):
+                modulo = Modulo.objects.create(nombre=f"C-{index}", proyecto=proyecto, planta=planta)
+                for fase in ("INFERIOR", "SUPERIOR"):
+                    DetalleModuloFase.objects.create(modulo=modulo, fase=fase, cantidad_cortes=1)
+                Imagen.objects.create(modulo=modulo, url=f"/media/c{index}.jpg", fase="INFERIOR")
+                MesaQueueItem.objects.create(mesa=mesa, modulo=modulo, fase="INFERIOR", status="EN_COLA")
+            return proyecto
+
+        queries, bumps = {}, {}
+        for n in (3, 30):
+            proyecto = proyecto_con_modulos(n)
+            version = Mesa.objects.get(pk=mesa.pk).version
+            with CaptureQueriesContext(connection) as ctx:
+                proyecto.delete()
+            queries[n] = len(ctx.captured_queries)
+            bumps[n] = Mesa.objects.get(pk=mesa.pk).version - version
+            self.assertFalse(any("dificultad_raw_total" in q["sql"] for q in ctx.captured_queries))
+        self.assertEqual(queries[3], queries[30])
+        self.assertEqual(bumps, {3: 1, 30: 1})
+
+        # Borrar modulos sueltos (tambien en bloque) deja el agregado al dia.
+        proyecto = proyecto_con_modulos(3)
+        with CaptureQueriesContext(connection) as ctx:
+            Modulo.objects.filter(proyecto=proyecto, nombre__in=["C-0", "C-1"]).delete()
+        self.assertEqual(sum("dificultad_raw_total" in q["sql"] for q in ctx.captured_queries), 1)
+        proyecto.refresh_from_db()
+        self.assertEqual(proyecto.dificultad_detalles, 2)
+        self.assertEqual(float(proyecto.dificultad_raw_total), 2.0)
+
+    def test_estadisticas_de_produccion_leen_el_rollup_diario(self):
+        grupo = GrupoMesas.objects.create(nombre="Grupo Stats", usuario=self.user)
+        mesa_sup = Mesa.objects.create(nombre="SUP", usuario=self.user, grupo=grupo, rol="SUPERIORES")
+        DetalleModuloFase.objects.create(
+            modulo=self.modulo, fase="INFERIOR", cantidad_cortes=4, peso_malla_final_kg="10.00",
+        )
+        DetalleModuloFase.objects.create(modulo=self.modulo, fase="SUPERIOR", cantidad_cortes=6)
+        MesaQueueItem.objects.create(mesa=mesa_sup, modulo=self.modulo, fase="SUPERIOR", status="HECHO")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.modulo.estado = "COMPLETADO"
+            self.modulo.save()
+        self.assertEqual(ProduccionDiaria.objects.filter(proyecto=self.project).count(), 3)
+
+        today = timezone.localdate().isoformat()
+        with self.assertNumQueries(6):
+            response = self.client.get(f"/api/stats/production/?from=2020-01-01&to={today}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["totals"]["modulos_completados"], 1)
+        self.assertEqual(response.data["totals"]["fases_completadas"], 2)
+        self.assertEqual(response.data["totals"]["cantidad_cortes"], 10)
+        self.assertEqual(response.data["totals"]["peso_malla_final_kg"], 10.0)
+        self.assertEqual(response.data["por_dia"][0]["fecha"], today)
+        por_mesa = {row["mesa_nombre"]: row for row in response.data["por_mesa"]}
+        self.assertEqual(por_mesa["SUP"]["cantidad_cortes"], 6)
+        self.assertEqual(por_mesa["Sin mesa asignada (INFERIOR)"]["cantidad_cortes"], 4)
+
+        # Reabrir el modulo lo saca del rollup; el comando lo reconstruye igual.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.modulo.estado = "EN_PROGRESO"
+            self.modulo.save()
+        self.assertFalse(ProduccionDiaria.objects.filter(proyecto=self.project).exists())
+        Modulo.objects.filter(pk=self.modulo.pk).update(completado_at=timezone.now())
+        call_command("rebuild_produccion_diaria", stdout=io.StringIO())
+        self.assertEqual(ProduccionDiaria.objects.filter(proyecto=self.project).count(), 3)
+
+    def test_borrar_modulos_completados_refresca_el_rollup_una_vez(self):
+        otro = Modulo.objects.create(nombre="M-02", proyecto=self.project, planta=self.planta)
+        with self.captureOnCommitCallbacks(execute=True):
+            for modulo in (self.modulo, otro):
+                DetalleModuloFase.objects.create(modulo=modulo, fase="INFERIOR", cantidad_cortes=4)
+                modulo.estado = "COMPLETADO"
+                modulo.save()
+        self.assertTrue(ProduccionDiaria.objects.filter(proyecto=self.project).exists())
+
+        # Un solo refresco por transaccion, no uno por modulo borrado.
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.planta.delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(ProduccionDiaria.objects.filter(proyecto=self.project).exists())
+
+    def test_descarga_zip_de_fotos_en_streaming_con_rangos(self):
+        import shutil
+        import zipfile
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, "fotos"))
+        contents = {}
+        for index in range(3):
+            data = os.urandom(50_000 + index)
+            name = f"foto_{index}.jpg"
+            with open(os.path.join(media_root, "fotos", name), "wb") as fh:
+                fh.write(data)
+            contents[name] = data
+            FotoFabricacion.objects.create(
+                modulo=self.modulo, fase="INFERIOR", paso=index, url=f"/media/fotos/{name}",
+            )
+
+        url = f"/api/fotos/download_zip/?modulo={self.modulo.id}"
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            body = b"".join(response.streaming_content)
+            self.assertEqual(int(response["Content-Length"]), len(body))
+            with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                self.assertEqual({name: archive.read(name) for name in archive.namelist()}, contents)
+                self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+
+            partial = self.client.get(url, HTTP_RANGE="bytes=1000-", HTTP_IF_RANGE=response["ETag"])
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(partial["Content-Range"], f"bytes 1000-{len(body) - 1}/{len(body)}")
+            self.assertEqual(b"".join(partial.streaming_content), body[1000:])
+
+            stale = self.client.get(url, HTTP_RANGE="bytes=1000-", HTTP_IF_RANGE='"otro"')
+            self.assertEqual(stale.status_code, 200)
+
+    async def test_descarga_zip_bajo_asgi_entrega_el_primer_bloque_sin_leer_el_archivo(self):
+        import shutil
+
+        from api.zipstream import ZipStream
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, "fotos"))
+        for index in range(3):
+            with open(os.path.join(media_root, "fotos", f"foto_{index}.jpg"), "wb") as fh:
+                fh.write(os.urandom(300_000))
+            await FotoFabricacion.objects.acreate(
+                modulo=self.modulo, fase="INFERIOR", paso=index, url=f"/media/fotos/foto_{index}.jpg",
+            )
+
+        reads = []
+        original_read = ZipStream._read
+
+        def counting_read(archive, entry, start, length):
+            reads.append(length)
+            return original_read(archive, entry, start, length)
+
+        url = f"/api/fotos/download_zip/?modulo={self.modulo.id}"
+        with override_settings(MEDIA_ROOT=media_root), mock.patch.object(ZipStream, "_read", counting_read):
+            response = await self.async_client.get(url, headers={"Authorization": f"Token {self.token.key}"})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            received = []
+            async for chunk in response.streaming_content:
+                if not received:
+                    # Solo la cabecera local de la primera entrada; nada leido del disco.
+                    self.assertEqual(reads, [])
+                received.append(chunk)
+        self.assertEqual(sum(map(len, received)), int(response["Content-Length"]))
+        self.assertGreater(len(received), 3)
+
+    def test_media_sirve_etag_rangos_y_cache_inmutable_para_urls_versionadas(self):
+        import shutil
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, "imagenes"))
+        data = os.urandom(10_000)
+        with open(os.path.join(media_root, "imagenes", "plano.png"), "wb") as fh:
+            fh.write(data)
+        checksum = hashlib.sha256(data).hexdigest()
+        imagen = Imagen.objects.create(
+            modulo=self.modulo, url="/media/imagenes/plano.png", checksum=checksum,
+        )
+
+        with override_settings(MEDIA_ROOT=media_root):
+            listed = self.client.get(f"/api/imagenes/{imagen.id}/")
+            versioned_url = listed.data["url"]
+            self.assertEqual(versioned_url, f"/media/imagenes/plano.png?v={checksum}")
+
+            response = self.client.get(versioned_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), data)
+            self.assertEqual(response["ETag"], f'"{checksum}"')
+            self.assertIn("immutable", response["Cache-Control"])
+
+            plain = self.client.get("/media/imagenes/plano.png")
+            self.assertIn("must-revalidate", plain["Cache-Control"])
+            self.assertEqual(
+                self.client.get("/media/imagenes/plano.png", HTTP_IF_NONE_MATCH=plain["ETag"]).status_code, 304,
+            )
+
+            partial = self.client.get(versioned_url, HTTP_RANGE="bytes=-100")
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(b"".join(partial.streaming_content), data[-100:])
+            self.assertEqual(self.client.get(versioned_url, HTTP_RANGE="bytes=20000-").status_code, 416)
+
+            with override_settings(MEDIA_SENDFILE="x-accel"):
+                accel = self.client.get(versioned_url)
+            self.assertEqual(accel["X-Accel-Redirect"], "/protected-media/imagenes/plano.png")
+
+            self.assertEqual(self.client.get("/media/../settings.py").status_code, 404)
+
+    async def test_media_bajo_asgi_se_envia_por_bloques(self):
+        import shutil
+
+        from api.media import CHUNK_SIZE
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, "imagenes"))
+        data = os.urandom(3 * CHUNK_SIZE + 10)
+        with open(os.path.join(media_root, "imagenes", "plano_4k.png"), "wb") as fh:
+            fh.write(data)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            response = await self.async_client.get("/media/imagenes/plano_4k.png")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            self.assertEqual(int(response["Content-Length"]), len(data))
+            chunks = [chunk async for chunk in response.streaming_content]
+            self.assertEqual(max(map(len, chunks)), CHUNK_SIZE)
+            self.assertEqual(b"".join(chunks), data)
+
+            partial = await self.async_client.get("/media/imagenes/plano_4k.png", headers={"Range": "bytes=10-19"})
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(b"".join([chunk async for chunk in partial.streaming_content]), data[10:20])
+
+    def test_imagen_genera_derivados_a_resolucion_de_proyector(self):
+        import shutil
+
+        from PIL import Image
+
+        from api.derivatives import update_variants
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, "imagenes"))
+        Image.new("RGBA", (4000, 2000), (255, 0, 0, 128)).save(os.path.join(media_root, "imagenes", "plano.png"))
+        imagen = Imagen.objects.create(modulo=self.modulo, url="/media/imagenes/plano.png", checksum="abc123")
+
+        with override_settings(MEDIA_ROOT=media_root, IMAGEN_VARIANT_FORMATS=("webp", "jpg")):
+            variantes = update_variants(imagen.id)
+            self.assertEqual(set(variantes), {"1080", "2160", "thumb"})
+            with Image.open(os.path.join(media_root, "imagenes", "plano.png.1080.webp")) as img:
+                self.assertEqual(img.size, (1920, 960))
+            with Image.open(os.path.join(media_root, "imagenes", "plano.png.thumb.jpg")) as img:
+                self.assertEqual(img.size, (320, 160))
+
+            data = self.client.get(f"/api/imagenes/{imagen.id}/").data
+            variant_url = data["variantes"]["1080"]["webp"]
+            self.assertEqual(variant_url, "/media/imagenes/plano.png.1080.webp?v=abc123")
+            # Los derivados comparten la version (y la cache inmutable) del original.
+            self.assertIn("immutable", self.client.get(variant_url)["Cache-Control"])
+
+    def test_import_structure_guarda_planos_una_vez_por_contenido(self):
+        import json
+        import shutil
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        data = os.urandom(5_000)
+        checksum = hashlib.sha256(data).hexdigest()
+        def plantas(nombre, modulos):
+            return json.dumps([{
+                "nombre": nombre,
+                "modulos": [
+                    {"nombre": modulos[0], "imagenes": [{"filename": "a_foto.png", "fase": "INFERIOR", "orden": 1}]},
+                    {"nombre": modulos[1], "imagenes": [{"filename": "b.png", "fase": "INFERIOR", "orden": 1}]},
+                ],
+            }])
+
+        with override_settings(MEDIA_ROOT=media_root):
+            for planta, modulos in (("P2", ("M-10", "M-11")), ("P3", ("M-20", "M-21"))):
+                response = self.client.post(
+                    f"/api/proyectos/{self.project.id}/import-structure/",
+                    {
+                        "plantas": plantas(planta, modulos),
+                        "a_foto.png": SimpleUploadedFile("a_foto.png", data, content_type="image/png"),
+                        "b.png": SimpleUploadedFile("b.png", data, content_type="image/png"),
+                    },
+                )
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["stats"]["imagenes_deduplicadas"], 2)
+
+            imagenes = Imagen.objects.filter(modulo__proyecto=self.project)
+            self.assertEqual(imagenes.count(), 4)
+            self.assertEqual(set(imagenes.values_list("checksum", flat=True)), {checksum})
+            self.assertEqual(
+                set(imagenes.values_list("url", flat=True)), {f"/media/cas/{checksum[:2]}/{checksum}.png"},
+            )
+            self.assertIn("a_foto.png", set(imagenes.values_list("nombre_archivo", flat=True)))
+            stored = [name for _, _, names in os.walk(os.path.join(media_root, "cas")) for name in names]
+            self.assertEqual(stored, [f"{checksum}.png"])
+
+            served = self.client.get(f"/media/cas/{checksum[:2]}/{checksum}.png")
+            self.assertEqual(served["ETag"], f'"{checksum}"')
+            self.assertIn("immutable", served["Cache-Control"])
+
+    def test_dedupe_gc_respeta_los_ficheros_recientes_sin_imagen(self):
+        import shutil
+        import time
+
+        from api.blobstore import store_chunks
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root):
+            usado = store_chunks([b"usado"], "usado.png")
+            viejo = store_chunks([b"viejo"], "viejo.png")
+            # Recien escrito por una importacion que aun no ha confirmado su Imagen.
+            reciente = store_chunks([b"reciente"], "reciente.png")
+            Imagen.objects.create(modulo=self.modulo, url=usado.url, fase="INFERIOR", orden=1)
+            hace_dos_dias = time.time() - 48 * 3600
+            for blob in (usado, viejo):
+                os.utime(os.path.join(media_root, blob.path), (hace_dos_dias, hace_dos_dias))
+
+            call_command("dedupe_imagenes", "--gc", stdout=io.StringIO())
+
+            self.assertTrue(os.path.exists(os.path.join(media_root, usado.path)))
+            self.assertTrue(os.path.exists(os.path.join(media_root, reciente.path)))
+            self.assertFalse(os.path.exists(os.path.join(media_root, viejo.path)))
+
+    def test_import_structure_escribe_por_lotes_con_consultas_constantes(self):
+        import shutil
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from api.importers import import_structure
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        def build(planta, n_modulos):
+            files, modulos = {}, []
+            for i in range(n_modulos):
+                filename = f"{planta}_{i}.png"
+                files[filename] = SimpleUploadedFile(filename, os.urandom(256), content_type="image/png")
+                modulos.append({
+                    "nombre": f"{planta}-M{i}",
+                    "ancho_cm": "17",
+                    "imagenes": [{"filename": filename, "fase": "INFERIOR", "orden": 1}],
+                    "detalles_fase": [
+                        {"fase": "INF", "espesor_cm": "14", "cantidad_cortes": "3"},
+                        {"fase": "SUP", "cantidad_refuerzos": "2"},
+                    ],
+                })
+            return [{"nombre": planta, "modulos": modulos}], files
+
+        queries = []
+        with override_settings(MEDIA_ROOT=media_root):
+            for planta, n_modulos in (("P2", 2), ("P3", 12)):
+                plantas, files = build(planta, n_modulos)
+                steps = []
+                with CaptureQueriesContext(connection) as ctx:
+                    stats = import_structure(
+                        self.project, plantas, files, progress=lambda *args: steps.append(args),
+                    )
+                queries.append(len(ctx.captured_queries))
+                self.assertEqual(stats["errors"], [])
+                self.assertEqual((stats["modulos"], stats["imagenes"]), (n_modulos, n_modulos))
+                self.assertEqual(stats["detalles_fase"], 2 * n_modulos)
+                self.assertIn(("ficheros", n_modulos, n_modulos), steps)
+                self.assertIn(("detalles", 2 * n_modulos, 2 * n_modulos), steps)
+
+        self.assertEqual(queries[0], queries[1])
+        modulo = Modulo.objects.get(nombre="P3-M7")
+        self.assertEqual(modulo.planta.nombre, "P3")
+        detalle = modulo.detalles_fase.get(fase="INFERIOR")
+        self.assertEqual(detalle.cantidad_cortes, 3)
+        self.assertEqual(detalle.dificultad_raw, detalle._calcular_dificultad_raw())
+        self.project.refresh_from_db()
+        self.assertEqual(
+            self.project.dificultad_detalles,
+            DetalleModuloFase.objects.filter(modulo__proyecto=self.project).count(),
+        )
+
+    def test_import_technical_data_async_lo_ejecuta_el_worker_de_trabajos(self):
+        import shutil
+
+        job_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_root, ignore_errors=True)
+        technical_file = SimpleUploadedFile(
+            "detalles.csv",
+            b"planta,modulo,inf_espesor_cm,inf_cantidad_cortes\nP1,M-01,14,6\n",
+            content_type="text/csv",
+        )
+
+        with override_settings(JOB_FILES_ROOT=job_root):
+            response = self.client.post(
+                f"/api/proyectos/{self.project.id}/import-technical-data/?async=1",
+                {"technical_file": technical_file},
+            )
+            self.assertEqual(response.status_code, 202)
+            job_id = response.data["job_id"]
+            self.assertEqual(response["Location"], f"/api/jobs/{job_id}/")
+            self.assertEqual(response.data["job"]["estado"], "PENDIENTE")
+            self.assertFalse(DetalleModuloFase.objects.filter(modulo=self.modulo).exists())
+
+            call_command("run_jobs", "--once", stdout=io.StringIO())
+
+            job = self.client.get(f"/api/jobs/{job_id}/").data
+            self.assertEqual(job["estado"], "COMPLETADO")
+            self.assertEqual(job["status_code"], 200)
+            self.assertEqual(job["resultado"]["stats"]["created"], 1)
+            self.assertEqual(os.listdir(job_root), [str(job_id)])
+            self.assertFalse(os.path.exists(os.path.join(job_root, str(job_id), "input")))
+
+        detalle = DetalleModuloFase.objects.get(modulo=self.modulo, fase="INFERIOR")
+        self.assertEqual(detalle.cantidad_cortes, 6)
+
+        other = User.objects.create_user(username="otro_jobs", password="x")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f"/api/jobs/{job_id}/").status_code, 404)
+
+    def test_descarga_zip_async_con_barra_en_el_nombre_del_proyecto(self):
+        import shutil
+        import zipfile
+
+        media_root, job_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, job_root, ignore_errors=True)
+        self.project.nombre = "Obra 3/../4"
+        self.project.save(update_fields=["nombre"])
+        os.makedirs(os.path.join(media_root, "fotos"))
+        data = os.urandom(1_000)
+        with open(os.path.join(media_root, "fotos", "foto.jpg"), "wb") as fh:
+            fh.write(data)
+        FotoFabricacion.objects.create(modulo=self.modulo, fase="INFERIOR", paso=0, url="/media/fotos/foto.jpg")
+
+        with override_settings(MEDIA_ROOT=media_root, JOB_FILES_ROOT=job_root):
+            response = self.client.get(f"/api/fotos/download_zip/?proyecto={self.project.id}&async=1")
+            self.assertEqual(response.status_code, 202)
+            job_id = response.data["job_id"]
+            call_command("run_jobs", "--once", stdout=io.StringIO())
+
+            job = self.client.get(f"/api/jobs/{job_id}/").data
+            self.assertEqual(job["estado"], "COMPLETADO")
+            # El fichero queda dentro del directorio del trabajo, con nombre fijo.
+            self.assertEqual(os.listdir(os.path.join(job_root, str(job_id), "result")), ["result.zip"])
+            download = self.client.get(f"/api/jobs/{job_id}/download/")
+            self.assertEqual(download.status_code, 200)
+            self.assertEqual(download["Content-Disposition"], 'attachment; filename="Obra 3-..-4.zip"')
+            with zipfile.ZipFile(io.BytesIO(b"".join(download.streaming_content))) as archive:
+                self.assertEqual(archive.read("P1/M-01/foto.jpg"), data)
+
+    async def test_descarga_del_resultado_de_un_trabajo_bajo_asgi_va_por_bloques(self):
+        import shutil
+
+        from api.jobs import RESULT_FILENAME, job_dir
+        from api.models import Job, JobEstado
+
+        job_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_root, ignore_errors=True)
+        job = await Job.objects.acreate(
+            tipo="download_zip", usuario=self.user, params={}, estado=JobEstado.COMPLETADO,
+            resultado={"filename": "M-01.zip"},
+        )
+        data = os.urandom(600_000)
+        with override_settings(JOB_FILES_ROOT=job_root):
+            os.makedirs(job_dir(job.pk, "result"))
+            with open(job_dir(job.pk, "result", RESULT_FILENAME), "wb") as fh:
+                fh.write(data)
+            response = await self.async_client.get(
+                f"/api/jobs/{job.pk}/download/", headers={"Authorization": f"Token {self.token.key}"},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            self.assertEqual(response["Content-Disposition"], 'attachment; filename="M-01.zip"')
+            self.assertEqual(int(response["Content-Length"]), len(data))
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), data)
+
+    def test_grupos_bastidor_overview_con_consultas_constantes(self):
+        from api.models import GrupoBastidor
+
+        def add_grupos(count):
+            for _ in range(count):
+                grupo = GrupoBastidor.objects.create(proyecto=self.project, indice=GrupoBastidor.objects.count() + 1)
+                for nombre in ("B", "A"):
+                    modulo = Modulo.objects.create(
+                        nombre=f"{nombre}-{grupo.indice}", proyecto=self.project, planta=self.planta,
+                        grupo_bastidor=grupo,
+                    )
+                    for paso in range(2 if nombre == "A" else 0):
+                        FotoFabricacion.objects.create(
+                            modulo=modulo, fase="INFERIOR", paso=paso, url=f"/media/fotos/{modulo.pk}_{paso}.jpg",
+                        )
+
+        urls = ["/api/grupos-bastidor/", "/api/grupos-bastidor/overview/"]
+        add_grupos(2)
+        for url in urls:
+            # Token + grupos + modulos (con el numero de fotos).
+            with self.assertNumQueries(3):
+                self.client.get(url, {"proyecto": self.project.pk})
+        add_grupos(8)
+        responses = []
+        for url in urls:
+            with self.assertNumQueries(3):
+                responses.append(self.client.get(url, {"proyecto": self.project.pk}))
+
+        listado, overview = (response.json() for response in responses)
+        self.assertEqual(len(overview), 10)
+        self.assertEqual(overview, listado)
+        self.assertEqual(
+            [(m["nombre"], m["fotos_count"]) for m in overview[0]["modulos"]],
+            [("A-1", 2), ("B-1", 0)],
+        )
+
     def test_import_technical_data_from_csv_prefixed_columns(self):
         csv_content = (
             "planta,modulo,inf_espesor_cm,inf_cantidad_cortes,sup_espesor_cm,sup_cantidad_refuerzos\n"
@@ -498,6 +1372,173 @@ class PlanningFoundationTests(APITestCase):
             if temp_path and os.path.exists(temp_path):
                 os.unlink(temp_path)
 
+    def test_import_technical_data_upsert_por_lotes_con_consultas_constantes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from api.importers import import_technical_records
+
+        for i in range(2, 14):
+            Modulo.objects.create(nombre=f"M-{i:02d}", proyecto=self.project, planta=self.planta)
+
+        def records(numbers):
+            return [
+                {
+                    "modulo": f"MOD_M-{i:02d}",
+                    "planta": "p1",
+                    "codigos_color": "yg",
+                    "inf_espesor_cm": "14",
+                    "inf_cantidad_cortes": "3",
+                    "sup_cantidad_refuerzos": "2",
+                }
+                for i in numbers
+            ]
+
+        queries = []
+        for numbers in (range(2, 4), range(4, 14)):
+            with CaptureQueriesContext(connection) as ctx:
+                stats = import_technical_records(self.project, [records(numbers)])
+            queries.append(len(ctx.captured_queries))
+            self.assertEqual(stats["errors"], [])
+            self.assertEqual((stats["processed"], stats["created"]), (2 * len(numbers), 2 * len(numbers)))
+        self.assertEqual(queries[0], queries[1])
+
+        modulo = Modulo.objects.get(nombre="M-09")
+        self.assertEqual(modulo.codigos_color, "ygxxxxxx")
+        superior = modulo.detalles_fase.get(fase="SUPERIOR")
+        self.assertEqual(superior.cantidad_refuerzos, 2)
+        self.assertEqual(superior.dificultad_raw, superior._calcular_dificultad_raw())
+
+        # Un detalle existente solo cambia en los campos que trae el registro.
+        DetalleModuloFase.objects.create(modulo=self.modulo, fase="INFERIOR", espesor_cm="12.00", cantidad_cortes=5)
+        stats = import_technical_records(self.project, [
+            [{"modulo": "m-01", "fase": "inf", "cantidad_refuerzos": "4"}],
+            [{"modulo": "M-01", "fase": "inf", "cantidad_cortes": "6"}, {"modulo": "Z-99", "fase": "inf", "cortes": "1"}],
+        ])
+        self.assertEqual((stats["processed"], stats["created"], stats["updated"], stats["skipped"]), (2, 0, 2, 1))
+        detalle = self.modulo.detalles_fase.get(fase="INFERIOR")
+        self.assertEqual(
+            (detalle.espesor_cm, detalle.cantidad_cortes, detalle.cantidad_refuerzos),
+            (Decimal("12.00"), 6, 4),
+        )
+        self.project.refresh_from_db()
+        self.assertEqual(
+            self.project.dificultad_detalles,
+            DetalleModuloFase.objects.filter(modulo__proyecto=self.project).count(),
+        )
+
+    def test_resolver_de_nombres_de_modulo_busca_en_memoria(self):
+        from api.importers import ModuloNameResolver
+
+        planta_2 = Planta.objects.create(nombre="P2", proyecto=self.project, orden=2)
+        a01_p1 = Modulo.objects.create(nombre="A01", proyecto=self.project, planta=self.planta)
+        a01_p2 = Modulo.objects.create(nombre="A01", proyecto=self.project, planta=planta_2)
+        b02 = Modulo.objects.create(nombre="MOD-B02", proyecto=self.project, planta=self.planta)
+        c3 = Modulo.objects.create(nombre="C-3", proyecto=self.project, planta=planta_2)
+
+        with self.assertNumQueries(1):
+            resolver = ModuloNameResolver.for_proyecto(self.project)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve("MOD_A01", "p2"), (a01_p2, None))
+            self.assertEqual(resolver.resolve(" a01 ", "P1"), (a01_p1, None))
+            self.assertEqual(resolver.resolve("modulo_b02"), (b02, None))
+            self.assertEqual(resolver.resolve("C-03"), (c3, None))
+            self.assertEqual(resolver.resolve("C-03", "P1"), (None, None))
+            self.assertEqual(resolver.resolve("Z-99"), (None, None))
+            modulo, error = resolver.resolve("A01")
+        self.assertIsNone(modulo)
+        self.assertIn("ambiguo", error)
+
+    def test_resolver_prefiere_el_nombre_exacto_y_avisa_de_colisiones_por_clave_natural(self):
+        from api.importers import ModuloNameResolver
+
+        baja = Planta.objects.create(nombre=" Planta Baja ", proyecto=self.project, orden=2)
+        a1 = Modulo.objects.create(nombre="A1", proyecto=self.project, planta=self.planta)
+        a01 = Modulo.objects.create(nombre="A01", proyecto=self.project, planta=self.planta)
+        mod_b7 = Modulo.objects.create(nombre="MOD_B7", proyecto=self.project, planta=baja)
+
+        resolver = ModuloNameResolver.for_proyecto(self.project)
+        # Coincidencia exacta (como antes del resolver): no se mira la clave natural.
+        self.assertEqual(resolver.resolve("A1"), (a1, None))
+        self.assertEqual(resolver.resolve("a01"), (a01, None))
+        self.assertEqual(resolver.resolve("MOD_A1"), (a1, None))
+        self.assertEqual(resolver.resolve("B7", "planta baja"), (mod_b7, None))
+        # Solo por clave natural, y dos modulos la comparten: ambiguo.
+        modulo, error = resolver.resolve("A001")
+        self.assertIsNone(modulo)
+        self.assertIn("ambiguo", error)
+        self.assertEqual(resolver.resolve("MODULO-B07", " PLANTA BAJA"), (mod_b7, None))
+
+    def test_normalizacion_tecnica_resuelve_las_cabeceras_una_vez_por_fichero(self):
+        import csv
+
+        from api import importers
+
+        headers = ["Módulo", "Planta", "INF Espesor (cm)", "inf_cortes", "Sup Refuerzos", "Colores"]
+        headers += [f"columna_extra_{i}" for i in range(40)]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=headers)
+        writer.writeheader()
+        for i in range(300):
+            writer.writerow({
+                "Módulo": f"M-{i:03d}", "Planta": "P1", "INF Espesor (cm)": "14.456",
+                "inf_cortes": str(i % 5), "Sup Refuerzos": " " if i % 2 else "2", "Colores": "yg",
+            })
+
+        importers._record_plan.cache_clear()
+        records = importers._normalize_technical_records(csv.DictReader(io.StringIO(buffer.getvalue())))
+        self.assertEqual(importers._record_plan.cache_info().misses, 1)
+
+        self.assertEqual(len(records), 450)
+        self.assertEqual(records[0], {
+            "modulo_nombre": "M-000",
+            "planta_nombre": "P1",
+            "fase": "INFERIOR",
+            "fields": {"espesor_cm": Decimal("14.46"), "cantidad_cortes": "0"},
+            "module_fields": {"codigos_color": "yg"},
+        })
+        self.assertEqual(records[1]["fase"], "SUPERIOR")
+        self.assertEqual(records[1]["fields"], {"cantidad_refuerzos": "2"})
+        # Celda vacia: la fila impar solo da registro INFERIOR.
+        self.assertEqual((records[2]["modulo_nombre"], records[2]["fase"]), ("M-001", "INFERIOR"))
+        self.assertEqual(records[3]["modulo_nombre"], "M-002")
+
+    def test_lector_sqlite_lee_por_lotes_solo_las_columnas_mapeadas(self):
+        from django.core.files import File
+
+        from api.importers import iter_technical_record_batches
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        db_path = os.path.join(temp_dir.name, "resumen.db")
+        connection = sqlite3.connect(db_path)
+        connection.execute(
+            "CREATE TABLE resumen (id INTEGER PRIMARY KEY, nombre_modulo TEXT, "
+            "cantidad_refuerzos_inf INTEGER, pos_color_1 TEXT, geometria BLOB)"
+        )
+        connection.executemany(
+            "INSERT INTO resumen VALUES (?, ?, ?, ?, ?)",
+            [(i, f"M-{i:02d}" if i != 3 else "", i, "Y", b"\0" * 1000) for i in range(1, 7)],
+        )
+        connection.commit()
+        connection.close()
+
+        with open(db_path, "rb") as fh, mock.patch("tempfile.NamedTemporaryFile") as named_temp:
+            batches = list(iter_technical_record_batches(File(fh, name="resumen.db"), batch_size=2))
+        # El fichero ya esta en disco: se lee de ahi, sin copia temporal.
+        named_temp.assert_not_called()
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        records = [record for batch in batches for record in batch]
+        self.assertEqual([r["modulo"] for r in records], ["M-01", "M-02", "M-04", "M-05", "M-06"])
+        self.assertNotIn("geometria", records[0])
+        self.assertEqual(records[0]["inf_cantidad_refuerzos"], 1)
+        self.assertEqual(records[0]["codigos_color"], "yxxxxxxx")
+        self.assertEqual(records[0]["ancho_cm"], 17)
+
+        with self.assertRaises(ValidationError):
+            iter_technical_record_batches(SimpleUploadedFile("otra.db", b"no es sqlite"))
+
     def test_planificar_grupo_crea_colas_automaticas(self):
         self.project.bastidor_longitud_cm = 20
         self.project.save(update_fields=["bastidor_longitud_cm"])
@@ -550,6 +1591,183 @@ class PlanningFoundationTests(APITestCase):
         self.assertEqual(inf_2_queue, ["M-04", "M-03"])
         self.assertEqual(sup_queue, ["M-04", "M-02", "M-03", "M-01"])
 
+    def test_planificar_inserta_las_colas_en_bloque(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for index in range(2, 13):
+            Modulo.objects.create(nombre=f"M-{index:02d}", proyecto=self.project, planta=self.planta)
+
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Bulk", "usuario": self.user.id},
+            format="json",
+        )
+        self.assertEqual(grupo_response.status_code, 201)
+
+        with CaptureQueriesContext(connection) as ctx:
+            plan_response = self.client.post(
+                f"/api/grupos-mesas/{grupo_response.data['id']}/planificar/",
+                {"proyecto_id": self.project.id},
+                format="json",
+            )
+        self.assertEqual(plan_response.status_code, 200)
+
+        inserts = [
+            q["sql"] for q in ctx.captured_queries
+            if q["sql"].startswith('INSERT INTO "api_mesa_queue_item"')
+        ]
+        # Un INSERT por mesa (INFERIOR_1, INFERIOR_2, SUPERIORES), no uno por fila.
+        self.assertLessEqual(len(inserts), 3)
+        self.assertEqual(MesaQueueItem.objects.filter(mesa__grupo_id=grupo_response.data["id"]).count(), 24)
+
+    def test_replanificar_y_encolar_solo_escriben_el_delta(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for index in range(2, 7):
+            Modulo.objects.create(nombre=f"M-{index:02d}", proyecto=self.project, planta=self.planta)
+        otro = Proyecto.objects.create(nombre="Proyecto Dos", usuario=self.user)
+        otra_planta = Planta.objects.create(nombre="P1", proyecto=otro, orden=1)
+        for index in range(1, 4):
+            Modulo.objects.create(nombre=f"N-{index:02d}", proyecto=otro, planta=otra_planta)
+
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Delta", "usuario": self.user.id},
+            format="json",
+        )
+        grupo_id = grupo_response.data["id"]
+        plan_url = f"/api/grupos-mesas/{grupo_id}/planificar/"
+        self.assertEqual(self.client.post(plan_url, {"proyecto_id": self.project.id}, format="json").status_code, 200)
+        before = set(
+            MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id)
+            .values_list("id", "mesa_id", "position", "status")
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.post(plan_url, {}, format="json").status_code, 200)
+        writes = [
+            q["sql"] for q in ctx.captured_queries
+            if q["sql"].startswith(("INSERT", "UPDATE", "DELETE")) and "api_mesa_queue_item" in q["sql"]
+        ]
+        self.assertEqual(writes, [])
+
+        response = self.client.post(f"/api/grupos-mesas/{grupo_id}/cola/add/", {"proyecto": otro.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        after = set(
+            MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id, modulo__proyecto=self.project)
+            .values_list("id", "mesa_id", "position", "status")
+        )
+        self.assertEqual(after, before)
+        self.assertEqual(MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id, modulo__proyecto=otro).count(), 6)
+
+    def test_planificar_dry_run_no_escribe_y_commit_aplica_el_plan_cacheado(self):
+        Modulo.objects.create(nombre="M-02", proyecto=self.project, planta=self.planta)
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Preview", "usuario": self.user.id},
+            format="json",
+        )
+        grupo_id = grupo_response.data["id"]
+        plan_url = f"/api/grupos-mesas/{grupo_id}/planificar/"
+
+        preview = self.client.post(f"{plan_url}?dry_run=1", {"proyecto_id": self.project.id}, format="json")
+        self.assertEqual(preview.status_code, 200)
+        self.assertEqual(preview.data["status"], "preview")
+        self.assertTrue(preview.data["plan_id"])
+        self.assertFalse(MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id).exists())
+        self.assertFalse(GrupoMesasProyecto.objects.filter(grupo_mesas_id=grupo_id).exists())
+
+        with mock.patch(
+            "api.views.GrupoMesasViewSet._compute_cola_plan",
+            side_effect=AssertionError("el plan cacheado no debe recalcularse"),
+        ):
+            response = self.client.post(
+                plan_url,
+                {"proyecto_id": self.project.id, "plan_id": preview.data["plan_id"]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["plan_id"], preview.data["plan_id"])
+        self.assertEqual(response.data["plans"], preview.data["plans"])
+        self.assertEqual(MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id).count(), 4)
+
+    def test_planificar_no_reencola_una_fase_terminada_tras_calcular_el_plan(self):
+        from api.views import GrupoMesasViewSet
+
+        otro = Modulo.objects.create(nombre="M-02", proyecto=self.project, planta=self.planta)
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Carrera", "usuario": self.user.id},
+            format="json",
+        )
+        grupo_id = grupo_response.data["id"]
+        get_cola_plan = GrupoMesasViewSet._get_cola_plan
+
+        def plan_y_terminar(viewset, *args, **kwargs):
+            result = get_cola_plan(viewset, *args, **kwargs)
+            # Un operario termina la fase mientras el plan ya esta calculado.
+            Modulo.objects.filter(pk=self.modulo.pk).update(inferior_hecho=True, estado="EN_PROGRESO")
+            return result
+
+        with mock.patch.object(GrupoMesasViewSet, "_get_cola_plan", plan_y_terminar):
+            response = self.client.post(
+                f"/api/grupos-mesas/{grupo_id}/planificar/", {"proyecto_id": self.project.id}, format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        items = MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id)
+        self.assertFalse(items.filter(modulo=self.modulo, fase="INFERIOR").exists())
+        self.assertEqual(
+            set(items.values_list("modulo_id", "fase")),
+            {(self.modulo.id, "SUPERIOR"), (otro.id, "INFERIOR"), (otro.id, "SUPERIOR")},
+        )
+        for mesa_id in set(items.values_list("mesa_id", flat=True)):
+            cola = list(items.filter(mesa_id=mesa_id).order_by("position").values_list("position", "status"))
+            self.assertEqual(cola[0], (0, "MOSTRANDO"))
+
+    def test_planificar_con_plan_id_obsoleto_devuelve_409(self):
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Stale", "usuario": self.user.id},
+            format="json",
+        )
+        grupo_id = grupo_response.data["id"]
+        plan_url = f"/api/grupos-mesas/{grupo_id}/planificar/"
+        preview = self.client.post(f"{plan_url}?dry_run=1", {"proyecto_id": self.project.id}, format="json")
+
+        Modulo.objects.create(nombre="M-02", proyecto=self.project, planta=self.planta)
+        response = self.client.post(
+            plan_url,
+            {"proyecto_id": self.project.id, "plan_id": preview.data["plan_id"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertNotEqual(response.data["plan_id"], preview.data["plan_id"])
+        self.assertFalse(MesaQueueItem.objects.filter(mesa__grupo_id=grupo_id).exists())
+        # El 409 no deja el proyecto en la cola del grupo.
+        self.assertFalse(GrupoMesasProyecto.objects.filter(grupo_mesas_id=grupo_id).exists())
+
+    def test_plan_id_cambia_al_editar_un_modulo_existente(self):
+        grupo_response = self.client.post(
+            "/api/grupos-mesas/",
+            {"nombre": "Grupo Huella", "usuario": self.user.id},
+            format="json",
+        )
+        plan_url = f"/api/grupos-mesas/{grupo_response.data['id']}/planificar/"
+        payload = {"proyecto_id": self.project.id}
+        first = self.client.post(f"{plan_url}?dry_run=1", payload, format="json").data["plan_id"]
+        self.assertEqual(self.client.post(f"{plan_url}?dry_run=1", payload, format="json").data["plan_id"], first)
+
+        self.modulo.ancho_cm = 120
+        self.modulo.save(update_fields=["ancho_cm"])
+        second = self.client.post(f"{plan_url}?dry_run=1", payload, format="json").data["plan_id"]
+        self.assertNotEqual(second, first)
+
+        DetalleModuloFase.objects.create(modulo=self.modulo, fase="INFERIOR", cantidad_cortes=3)
+        third = self.client.post(f"{plan_url}?dry_run=1", payload, format="json").data["plan_id"]
+        self.assertNotEqual(third, second)
+
     def test_planificar_grupo_usa_ancho_del_modulo_para_agrupacion(self):
         self.project.bastidor_longitud_cm = 20
         self.project.save(update_fields=["bastidor_longitud_cm"])
@@ -3,15 +3,12 @@ import io
 import json
 import os
 import re
-import sqlite3
-import tempfile
-import unicodedata
 
 from django.contrib.auth.models import User
 from decimal import Decimal, InvalidOperation
 
 from django.db import IntegrityError, transaction
-from django.db.models import Count, Q
+from django.db.models import Count, Max, Prefetch, Q, Sum
 from rest_framework import permissions, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
@@ -23,412 +20,46 @@ from api.serializers import (
     ImagenSerializer, MesaSerializer,
     ModuloQueueSerializer, ModuloQueueItemSerializer, MesaQueueItemSerializer,
     FotoFabricacionSerializer, GrupoMesasSerializer, DetalleModuloFaseSerializer,
-    GrupoBastidorSerializer
+    GrupoBastidorSerializer, JobSerializer
 )
 from api.models import (
     Modulo, Proyecto, Planta, Imagen, Mesa,
     ModuloQueue, ModuloQueueItem, MesaQueueItem,
     FotoFabricacion, GrupoMesas, GrupoMesasProyecto,
     DetalleModuloFase, MesaQueueStatus,
-    GrupoBastidor
+    GrupoBastidor, ProduccionDiaria, Job, JobEstado
+)
+from api.device import device_token_cache
+from api.importers import (
+    _flatten_json_technical_data, import_technical_records, iter_technical_record_batches,
 )
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 
-from rest_framework import renderers
-
-
-TECHNICAL_FIELD_ALIASES = {
-    'espesor_cm': ['espesor_cm', 'espesor', 'canto', 'thickness_cm', 'thickness'],
-    'peso_malla_inicial_kg': ['peso_malla_inicial_kg', 'peso_malla_inicial', 'malla_inicial_kg', 'peso_mallazo_inicial_kg'],
-    'peso_malla_final_kg': ['peso_malla_final_kg', 'peso_malla_final', 'malla_final_kg', 'peso_mallazo_final_kg'],
-    'desperdicio_kg': ['desperdicio_kg', 'desperdicio', 'peso_desperdicio_kg'],
-    'cantidad_cortes': ['cantidad_cortes', 'cortes', 'numero_cortes'],
-    'cantidad_refuerzos': ['cantidad_refuerzos', 'refuerzos', 'numero_refuerzos'],
-    'peso_refuerzos_kg': ['peso_refuerzos_kg', 'peso_refuerzos'],
-    'metros_refuerzos': ['metros_refuerzos', 'refuerzos_metros', 'refuerzos_metros_lineales', 'm_refuerzos', 'metros_refuerzo'],
-    'cantidad_zunchos': ['cantidad_zunchos', 'zunchos', 'numero_zunchos'],
-    'peso_zunchos_kg': ['peso_zunchos_kg', 'peso_zunchos'],
-    'metros_zunchos': ['metros_zunchos', 'zunchos_metros', 'zunchos_metros_lineales', 'm_zunchos', 'metros_zuncho'],
-    'cantidad_separadores': ['cantidad_separadores', 'separadores', 'numero_separadores'],
-    'peso_separadores_kg': ['peso_separadores_kg', 'peso_separadores'],
-    'metros_separadores': ['metros_separadores', 'separadores_metros', 'separadores_metros_lineales', 'm_separadores', 'metros_separador'],
-    'cantidad_punzos': ['cantidad_punzos', 'punzos', 'numero_punzos'],
-    'peso_punzos_kg': ['peso_punzos_kg', 'peso_punzos'],
-    'metros_punzos': ['metros_punzos', 'punzos_metros', 'punzos_metros_lineales', 'm_punzos', 'metros_punzo'],
-    'dificultad_fabricacion': ['dificultad_fabricacion', 'dificultad', 'complejidad'],
-    'observaciones': ['observaciones', 'observacion', 'notas', 'comentarios'],
-}
-MODULE_FIELD_ALIASES = {
-    'ancho_cm': [
-        'ancho_cm', 'ancho', 'ancho_modulo_cm', 'ancho_modulo',
-        'module_width_cm', 'module_width', 'width_cm', 'width',
-        'canto_armado_cm', 'canto_armado', 'canto',
-    ],
-    'codigos_color': [
-        'codigos_color', 'codigo_color', 'colores', 'color_codes', 'colors',
-    ],
-}
 
-MODULE_NAME_ALIASES = ['modulo', 'modulo_nombre', 'nombre_modulo', 'module', 'module_name']
-PLANTA_NAME_ALIASES = ['planta', 'planta_nombre', 'nombre_planta', 'nivel', 'floor']
-FASE_ALIASES = ['fase', 'phase', 'subfase', 'fase_nombre']
-PHASE_PREFIXES = {
-    'inf': 'INFERIOR',
-    'inferior': 'INFERIOR',
-    'sup': 'SUPERIOR',
-    'superior': 'SUPERIOR',
-}
 ACTIVE_QUEUE_STATUSES = ['EN_COLA', 'MOSTRANDO']
+# Mesas que participan en la planificacion automatica y la fase que trabaja cada una.
+PLAN_ROLES = [('INFERIOR_1', 'INFERIOR'), ('INFERIOR_2', 'INFERIOR'), ('SUPERIORES', 'SUPERIOR')]
+PLAN_SEQUENCE_KEYS = {
+    'INFERIOR_1': 'inferior_1_sequence',
+    'INFERIOR_2': 'inferior_2_sequence',
+    'SUPERIORES': 'superior_sequence',
+}
 
 
 def _is_admin(user):
     return bool(user and (user.is_staff or user.is_superuser))
 
 
-class ServerSentEventRenderer(renderers.BaseRenderer):
-    media_type = 'text/event-stream'
-    format = 'txt'
-    def render(self, data, accepted_media_type=None, renderer_context=None):
-        return data
-
-
-def _canonicalize_key(value):
-    if value is None:
-        return ''
-    normalized = unicodedata.normalize('NFKD', str(value))
-    ascii_only = normalized.encode('ascii', 'ignore').decode('ascii')
-    ascii_only = ascii_only.strip().lower()
-    ascii_only = re.sub(r'[^a-z0-9]+', '_', ascii_only)
-    return ascii_only.strip('_')
-
-
-def _clean_cell(value):
-    if value is None:
-        return None
-    if isinstance(value, str):
-        value = value.strip()
-        if value == '':
-            return None
-    return value
-
-
-def _row_to_canonical_dict(row):
-    return {
-        _canonicalize_key(key): _clean_cell(value)
-        for key, value in row.items()
-    }
-
+def _wants_async(request):
+    return str(request.query_params.get('async', '')).lower() in ('1', 'true', 'yes')
 
-def _extract_value(row, aliases):
-    for alias in aliases:
-        value = row.get(_canonicalize_key(alias))
-        if value is not None:
-            return value
-    return None
 
-
-def _normalize_phase(value):
-    if value is None:
-        return None
-    canonical = _canonicalize_key(value)
-    return PHASE_PREFIXES.get(canonical)
-
-
-DECIMAL_FIELDS_2_PLACES = {
-    'espesor_cm',
-    'peso_malla_inicial_kg',
-    'peso_malla_final_kg',
-    'desperdicio_kg',
-    'peso_refuerzos_kg',
-    'peso_zunchos_kg',
-    'peso_separadores_kg',
-    'peso_punzos_kg',
-    'metros_refuerzos',
-    'metros_zunchos',
-    'metros_separadores',
-    'metros_punzos',
-    'dificultad_fabricacion',
-    'ancho_cm',
-}
-
-
-def _coerce_field_value(target_field, value):
-    """Round decimal fields to 2 places so they fit the model's DecimalField precision."""
-    if value is None or target_field not in DECIMAL_FIELDS_2_PLACES:
-        return value
-    try:
-        dec = Decimal(str(value))
-    except (TypeError, InvalidOperation):
-        return value
-    return dec.quantize(Decimal('0.01'))
-
-
-def _extract_detail_fields(row, prefix=None):
-    detail_fields = {}
-    for target_field, aliases in TECHNICAL_FIELD_ALIASES.items():
-        search_aliases = list(aliases)
-        if prefix:
-            prefixed = []
-            for alias in aliases:
-                canonical_alias = _canonicalize_key(alias)
-                prefixed.extend([
-                    f'{prefix}_{canonical_alias}',
-                    f'{prefix}{canonical_alias}',
-                ])
-            search_aliases = prefixed + search_aliases
-        value = _extract_value(row, search_aliases)
-        if value is not None:
-            detail_fields[target_field] = _coerce_field_value(target_field, value)
-    return detail_fields
-
-
-def _extract_module_fields(row):
-    module_fields = {}
-    for target_field, aliases in MODULE_FIELD_ALIASES.items():
-        value = _extract_value(row, aliases)
-        if value is not None:
-            module_fields[target_field] = _coerce_field_value(target_field, value)
-    return module_fields
-
-
-def _normalize_technical_records(records):
-    normalized_records = []
-
-    for raw_row in records:
-        row = _row_to_canonical_dict(raw_row)
-        modulo_nombre = _extract_value(row, MODULE_NAME_ALIASES)
-        planta_nombre = _extract_value(row, PLANTA_NAME_ALIASES)
-        module_fields = _extract_module_fields(row)
-
-        if not modulo_nombre:
-            continue
-
-        explicit_phase = _normalize_phase(_extract_value(row, FASE_ALIASES))
-        explicit_fields = _extract_detail_fields(row)
-
-        if explicit_phase and explicit_fields:
-            normalized_records.append({
-                'modulo_nombre': modulo_nombre,
-                'planta_nombre': planta_nombre,
-                'fase': explicit_phase,
-                'fields': explicit_fields,
-                'module_fields': module_fields,
-            })
-            continue
-
-        record_added = False
-        for prefix, fase in PHASE_PREFIXES.items():
-            prefixed_fields = _extract_detail_fields(row, prefix=prefix)
-            if not prefixed_fields:
-                continue
-            record_added = True
-            normalized_records.append({
-                'modulo_nombre': modulo_nombre,
-                'planta_nombre': planta_nombre,
-                'fase': fase,
-                'fields': prefixed_fields,
-                'module_fields': module_fields,
-            })
-
-        if not record_added and module_fields:
-            normalized_records.append({
-                'modulo_nombre': modulo_nombre,
-                'planta_nombre': planta_nombre,
-                'fase': None,
-                'fields': {},
-                'module_fields': module_fields,
-            })
-
-    return normalized_records
-
-
-def _flatten_json_technical_data(payload):
-    if isinstance(payload, list):
-        return payload
-
-    if isinstance(payload, dict):
-        for key in ['records', 'rows', 'items', 'data', 'detalles', 'detalles_fase']:
-            value = payload.get(key)
-            if isinstance(value, list):
-                return value
-
-        modules = payload.get('modulos')
-        if isinstance(modules, list):
-            flattened = []
-            for module in modules:
-                if not isinstance(module, dict):
-                    continue
-                modulo_nombre = module.get('nombre') or module.get('modulo') or module.get('modulo_nombre')
-                planta_nombre = module.get('planta') or module.get('planta_nombre')
-                ancho_cm = module.get('ancho_cm') or module.get('ancho') or module.get('ancho_modulo_cm')
-                for detalle in module.get('detalles_fase', []):
-                    if not isinstance(detalle, dict):
-                        continue
-                    flattened.append({
-                        'modulo': modulo_nombre,
-                        'planta': planta_nombre,
-                        'ancho_cm': ancho_cm,
-                        **detalle,
-                    })
-            return flattened
-
-    return []
-
-
-def _load_technical_records_from_sqlite(uploaded_file):
-    temp_path = None
-    connection = None
-    try:
-        suffix = os.path.splitext(uploaded_file.name)[1] or '.db'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-            for chunk in uploaded_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
-
-        connection = sqlite3.connect(temp_path)
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-
-        table_names = {
-            row[0]
-            for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        }
-        if 'resumen' not in table_names:
-            raise ValidationError('La base SQLite no contiene la tabla "resumen".')
-
-        technical_records = []
-        for row in cursor.execute("SELECT * FROM resumen ORDER BY id"):
-            row_dict = dict(row)
-            module_name = row_dict.get('nombre_modulo')
-            if not module_name:
-                continue
-
-            ancho_cm = (
-                row_dict.get('ancho_cm')
-                or row_dict.get('canto_armado_cm')
-                or row_dict.get('canto_armado')
-                or row_dict.get('canto')
-            )
-            if ancho_cm in [None, '']:
-                ancho_cm = 17
-
-            # Concatenate color slots (pos_color_1..pos_color_8) into a
-            # single string of 8 chars, padding empty / None with 'x'.
-            color_chars = []
-            for i in range(1, 9):
-                raw = row_dict.get(f'pos_color_{i}')
-                if raw in [None, '']:
-                    color_chars.append('x')
-                else:
-                    ch = str(raw).strip().lower()
-                    color_chars.append(ch[0] if ch else 'x')
-            codigos_color = ''.join(color_chars) or 'xxxxxxxx'
-
-            technical_records.append({
-                'modulo': module_name,
-                'ancho_cm': ancho_cm,
-                'codigos_color': codigos_color,
-                'inf_peso_malla_inicial_kg': row_dict.get('peso_mallazo_pedido_inf'),
-                'sup_peso_malla_inicial_kg': row_dict.get('peso_mallazo_pedido_sup'),
-                'inf_desperdicio_kg': row_dict.get('peso_mallazo_desperdicio_inf'),
-                'sup_desperdicio_kg': row_dict.get('peso_mallazo_desperdicio_sup'),
-                'inf_peso_malla_final_kg': row_dict.get('peso_mallazo_recortado_inf'),
-                'sup_peso_malla_final_kg': row_dict.get('peso_mallazo_recortado_sup'),
-                # Cuts split per phase (older DBs had a single numero_cortes_mallazo)
-                'inf_cantidad_cortes': row_dict.get('numero_cortes_mallazo_inf')
-                                       or row_dict.get('numero_cortes_mallazo'),
-                'sup_cantidad_cortes': row_dict.get('numero_cortes_mallazo_sup'),
-                'inf_cantidad_refuerzos': row_dict.get('cantidad_refuerzos_inf'),
-                'sup_cantidad_refuerzos': row_dict.get('cantidad_refuerzos_sup'),
-                'inf_peso_refuerzos_kg': row_dict.get('peso_refuerzos_inf'),
-                'sup_peso_refuerzos_kg': row_dict.get('peso_refuerzos_sup'),
-                # 'longitud_*' in the DB maps to metros_* on our side
-                'inf_metros_refuerzos': row_dict.get('longitud_refuerzos_inf')
-                                        or row_dict.get('metros_refuerzos_inf'),
-                'sup_metros_refuerzos': row_dict.get('longitud_refuerzos_sup')
-                                        or row_dict.get('metros_refuerzos_sup'),
-                'inf_cantidad_zunchos': row_dict.get('cantidad_zunchos'),
-                'inf_peso_zunchos_kg': row_dict.get('peso_zunchos'),
-                'inf_metros_zunchos': row_dict.get('longitud_zunchos')
-                                      or row_dict.get('metros_zunchos'),
-                'inf_cantidad_punzos': row_dict.get('cantidad_punzonamientos'),
-                'inf_peso_punzos_kg': row_dict.get('peso_punzonamientos'),
-                'inf_metros_punzos': row_dict.get('longitud_punzonamientos')
-                                     or row_dict.get('metros_punzonamientos'),
-                'inf_cantidad_separadores': row_dict.get('cantidad_separadores'),
-                'inf_peso_separadores_kg': row_dict.get('peso_separadores'),
-                'inf_metros_separadores': row_dict.get('longitud_separadores')
-                                          or row_dict.get('metros_separadores'),
-            })
-
-        return technical_records
-    except sqlite3.Error as exc:
-        raise ValidationError(f'No se pudo leer la base SQLite: {str(exc)}')
-    finally:
-        if connection is not None:
-            connection.close()
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
-
-
-def _load_technical_records_from_upload(uploaded_file):
-    filename = uploaded_file.name.lower()
-
-    if filename.endswith('.db') or filename.endswith('.sqlite') or filename.endswith('.sqlite3'):
-        return _load_technical_records_from_sqlite(uploaded_file)
-
-    content = uploaded_file.read()
-    try:
-        text = content.decode('utf-8-sig')
-    except UnicodeDecodeError:
-        text = content.decode('latin-1')
-
-    if filename.endswith('.json'):
-        return _flatten_json_technical_data(json.loads(text))
-
-    if filename.endswith('.csv'):
-        reader = csv.DictReader(io.StringIO(text))
-        return list(reader)
-
-    raise ValidationError('Formato no soportado. Usa un archivo JSON, CSV o SQLite (.db).')
-
-
-def _resolve_modulo_for_record(proyecto, modulo_nombre, planta_nombre=None):
-    """
-    Busca un modulo del proyecto por nombre tolerando prefijos comunes.
-    Acepta coincidencia exacta o cualquier variacion con prefijos MOD_, MOD-, MODULO_, MODULO-.
-    Devuelve (None, None) cuando no hay match — no es un error, significa que el
-    registro tecnico no corresponde a ningun modulo del proyecto (se omite silenciosamente).
-    """
-    target = str(modulo_nombre).strip()
-    if not target:
-        return None, None
-
-    candidates = {target}
-    # Intentar sin prefijo comun (ej: MOD_A01 -> A01)
-    for prefix in ('MODULO_', 'MODULO-', 'MOD_', 'MOD-'):
-        if target.upper().startswith(prefix):
-            candidates.add(target[len(prefix):])
-    # Intentar con prefijo (ej: A01 -> MOD_A01, MODULO_A01)
-    for prefix in ('MOD_', 'MODULO_'):
-        candidates.add(f'{prefix}{target}')
-
-    name_filter = Q()
-    for cand in candidates:
-        name_filter |= Q(nombre__iexact=cand)
-
-    queryset = proyecto.modulos.select_related('planta').filter(name_filter)
-    if planta_nombre:
-        queryset = queryset.filter(planta__nombre__iexact=str(planta_nombre).strip())
-
-    matches = list(queryset[:2])
-    if not matches:
-        # No es un error: el registro tecnico no tiene contraparte en el proyecto
-        return None, None
-    if len(matches) > 1:
-        return None, f'El modulo "{modulo_nombre}" es ambiguo; indica tambien la planta'
-    return matches[0], None
+def _job_accepted(job):
+    """Respuesta 202 de un endpoint encolado con ``?async=1`` (ver api.jobs)."""
+    response = Response({'status': 'queued', 'job_id': job.pk, 'job': JobSerializer(job).data}, status=202)
+    response['Location'] = f'/api/jobs/{job.pk}/'
+    return response
 
 
 def _natural_sort_key(value):
@@ -510,6 +141,7 @@ def _persist_bastidor_groups(proyecto):
     Calcula y persiste los GrupoBastidor del proyecto.
     Solo se debe llamar cuando el proyecto aun no tiene grupos (primera vez tras importar datos tecnicos).
     """
+    from django.utils import timezone
     from api.models import GrupoBastidor
 
     modulos = list(
@@ -529,7 +161,9 @@ def _persist_bastidor_groups(proyecto):
         )
         created_groups += 1
         modulo_ids = [m.id for m in modulos_in_group]
-        proyecto.modulos.filter(id__in=modulo_ids).update(grupo_bastidor=grupo)
+        proyecto.modulos.filter(id__in=modulo_ids).update(
+            grupo_bastidor=grupo, updated_at=timezone.now(),
+        )
 
     return created_groups
 
@@ -653,14 +287,32 @@ class ProyectoViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def _annotate_counts(self, queryset):
-        from django.db.models import Count
-        return queryset.annotate(
-            _grupos_count=Count('grupos_bastidor', distinct=True),
-            _modulos_count=Count('modulos', distinct=True),
+        """
+        Todos los contadores de ProyectoSerializer en la misma consulta: los
+        de modulos con un solo JOIN (sin DISTINCT), los grupos con una
+        subconsulta y el perfil del usuario con select_related.
+        """
+        from django.db.models import Count, OuterRef, Subquery
+        from django.db.models.functions import Coalesce
+        from django.utils import timezone
+
+        from api.services import local_day_range
+
+        start, end = local_day_range(timezone.localdate())
+        grupos = (
+            GrupoBastidor.objects.filter(proyecto=OuterRef('pk'))
+            .order_by().values('proyecto').annotate(total=Count('pk')).values('total')
+        )
+        return queryset.select_related('usuario__profile').annotate(
+            _grupos_count=Coalesce(Subquery(grupos), 0),
+            _modulos_count=Count('modulos'),
             _modulos_completados=Count(
                 'modulos',
                 filter=Q(modulos__estado__in=['COMPLETADO', 'CERRADO']),
-                distinct=True,
+            ),
+            _modulos_completados_hoy=Count(
+                'modulos',
+                filter=Q(modulos__completado_at__gte=start, modulos__completado_at__lt=end),
             ),
         )
 
@@ -688,45 +340,6 @@ class ProyectoViewSet(viewsets.ModelViewSet):
         else:
             serializer.save()
 
-    def _upsert_modulo_phase_detail(self, modulo, fase, fields):
-        existing = DetalleModuloFase.objects.filter(modulo=modulo, fase=fase).first()
-        payload = {
-            'modulo': modulo.id,
-            'fase': fase,
-            **fields,
-        }
-        serializer = DetalleModuloFaseSerializer(
-            instance=existing,
-            data=payload,
-            partial=bool(existing),
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return existing is None
-
-    def _apply_module_fields(self, modulo, fields):
-        updated_fields = []
-
-        if 'ancho_cm' in fields and fields['ancho_cm'] not in [None, '']:
-            modulo.ancho_cm = fields['ancho_cm']
-            updated_fields.append('ancho_cm')
-
-        raw_color = fields.get('codigos_color')
-        if raw_color not in [None, '']:
-            normalized = str(raw_color).lower().strip()
-            # Pad to 8, replace any non-recognized char with 'x' (skip)
-            normalized = ''.join(
-                c if c in 'ygcvmox' else 'x' for c in normalized[:8]
-            ).ljust(8, 'x')
-            if normalized != modulo.codigos_color:
-                modulo.codigos_color = normalized
-                updated_fields.append('codigos_color')
-
-        if updated_fields:
-            modulo.save(update_fields=updated_fields)
-            return True
-        return False
-
     @action(detail=True, methods=['get'])
     def modulos(self, request, pk=None):
         """Get all modules for a project."""
@@ -765,11 +378,11 @@ class ProyectoViewSet(viewsets.ModelViewSet):
         Expects multipart form with:
         - 'plantas': JSON string with structure
         - image files referenced by filename in plantas JSON
+        With ?async=1 the import runs in the job worker (202 + job id).
         """
-        import os
         import json
-        from django.conf import settings as django_settings
-        
+        from api.importers import import_structure
+
         proyecto = self.get_object()
         
         # Get uploaded files
@@ -790,110 +403,16 @@ class ProyectoViewSet(viewsets.ModelViewSet):
         
         print(f"[IMPORT] Proyecto {proyecto.id}: {len(plantas_data)} plantas, {len(files)} files")
 
-        stats = {
-            'plantas': 0, 'modulos': 0, 'imagenes': 0, 'detalles_fase': 0,
-            'plano_cargado': False, 'planilla_cargada': False, 'errors': []
-        }
+        if _wants_async(request):
+            from api.jobs import enqueue_job
+            job = enqueue_job(
+                'import_structure', request.user,
+                {'proyecto': proyecto.id, 'plantas': plantas_data}, files=files,
+            )
+            return _job_accepted(job)
+
+        stats = import_structure(proyecto, plantas_data, files)
 
-        for planta_data in plantas_data:
-            try:
-                # Create Planta
-                planta = Planta.objects.create(
-                    nombre=planta_data.get('nombre', 'Sin nombre'),
-                    proyecto=proyecto,
-                    orden=planta_data.get('orden', 0)
-                )
-                stats['plantas'] += 1
-
-                # Check for Plant Files (Plano and Corte)
-                plano_filename = planta_data.get('plano_filename')
-                if plano_filename:
-                    uploaded_file = files.get(plano_filename)
-                    if uploaded_file:
-                        planta.plano_imagen.save(uploaded_file.name, uploaded_file)
-                        stats['plano_cargado'] = True
-
-                corte_filename = planta_data.get('corte_filename')
-                if corte_filename:
-                    uploaded_file = files.get(corte_filename)
-                    if uploaded_file:
-                        planta.fichero_corte.save(uploaded_file.name, uploaded_file)
-                        stats['planilla_cargada'] = True
-                
-                modulos_data = planta_data.get('modulos', [])
-                for modulo_data in modulos_data:
-                    try:
-                        # Create Modulo
-                        modulo = Modulo.objects.create(
-                            nombre=modulo_data.get('nombre', 'Sin nombre'),
-                            ancho_cm=_extract_module_fields(_row_to_canonical_dict(modulo_data)).get('ancho_cm'),
-                            planta=planta,
-                            proyecto=proyecto,
-                            estado='PENDIENTE',
-                            codigos_color=(modulo_data.get('codigos_color') or 'xxxxxxxx').ljust(8, 'x')[:8]
-                        )
-                        stats['modulos'] += 1
-                        
-                        imagenes_data = modulo_data.get('imagenes', [])
-                        for imagen_data in imagenes_data:
-                            try:
-                                filename = imagen_data.get('filename')
-                                fase = imagen_data.get('fase', 'INFERIOR')
-                                orden = imagen_data.get('orden', 1)
-                                
-                                # Check if file was uploaded
-                                uploaded_file = files.get(filename)
-                                if uploaded_file:
-                                    # Save file to media folder
-                                    media_path = os.path.join('imagenes', str(proyecto.id), str(planta.id), str(modulo.id))
-                                    full_path = os.path.join(django_settings.MEDIA_ROOT, media_path)
-                                    os.makedirs(full_path, exist_ok=True)
-                                    
-                                    file_path = os.path.join(full_path, uploaded_file.name)
-                                    with open(file_path, 'wb+') as destination:
-                                        for chunk in uploaded_file.chunks():
-                                            destination.write(chunk)
-                                    
-                                    # Create Imagen record
-                                    url = f'/media/{media_path}/{uploaded_file.name}'
-                                    Imagen.objects.create(
-                                        url=url,
-                                        modulo=modulo,
-                                        fase=fase,
-                                        orden=orden,
-                                        activo=True
-                                    )
-                                    stats['imagenes'] += 1
-                                else:
-                                    stats['errors'].append(f"File not found: {filename}")
-                            except Exception as e:
-                                stats['errors'].append(f"Error creating imagen: {str(e)}")
-
-                        detalles_fase_data = modulo_data.get('detalles_fase', [])
-                        for detalle_data in detalles_fase_data:
-                            try:
-                                fase = _normalize_phase(detalle_data.get('fase'))
-                                if not fase:
-                                    stats['errors'].append(
-                                        f"Detalle tecnico sin fase valida para modulo {modulo.nombre}"
-                                    )
-                                    continue
-
-                                detail_fields = _extract_detail_fields(
-                                    _row_to_canonical_dict(detalle_data)
-                                )
-                                if not detail_fields:
-                                    continue
-
-                                self._upsert_modulo_phase_detail(modulo, fase, detail_fields)
-                                stats['detalles_fase'] += 1
-                            except Exception as e:
-                                stats['errors'].append(f"Error creating detalle tecnico: {str(e)}")
-                    except Exception as e:
-                        stats['errors'].append(f"Error creating modulo: {str(e)}")
-            except Exception as e:
-                stats['errors'].append(f"Error creating planta: {str(e)}")
-        
         return Response({
             'status': 'ok',
             'proyecto_id': proyecto.id,
@@ -908,77 +427,49 @@ class ProyectoViewSet(viewsets.ModelViewSet):
         - una fila por fase con columnas modulo + fase + campos
         - una fila por modulo con columnas prefijadas inf_/sup_
         - una base SQLite con tabla resumen por modulo
+        Con ?async=1 se ejecuta en el worker de trabajos (202 + id del trabajo).
         """
         proyecto = self.get_object()
+        self._check_technical_import_allowed(proyecto)
+
+        technical_file = request.FILES.get('technical_file')
+        raw_records = request.data.get('records')
 
+        if _wants_async(request):
+            from api.jobs import enqueue_job
+            job = enqueue_job(
+                'import_technical_data', request.user,
+                {'proyecto': proyecto.id, 'records': raw_records},
+                files={'technical_file': technical_file} if technical_file else None,
+            )
+            return _job_accepted(job)
+
+        return Response(self._run_import_technical_data(proyecto, technical_file, raw_records))
+
+    def _check_technical_import_allowed(self, proyecto):
         if proyecto.datos_tecnicos_importados:
             raise ValidationError(
                 'Este proyecto ya tiene datos tecnicos importados y grupos de bastidor calculados. '
                 'Para cambiarlos, elimina el proyecto y vuelve a crearlo.'
             )
 
-        technical_file = request.FILES.get('technical_file')
-        raw_records = request.data.get('records')
+    def _run_import_technical_data(self, proyecto, technical_file, raw_records):
+        """Importacion de datos tecnicos (sincrona o desde api.jobs); devuelve el cuerpo de la respuesta."""
+        self._check_technical_import_allowed(proyecto)
 
         try:
             if technical_file:
-                records = _load_technical_records_from_upload(technical_file)
+                batches = iter_technical_record_batches(technical_file)
             elif isinstance(raw_records, str):
-                records = _flatten_json_technical_data(json.loads(raw_records))
+                batches = [_flatten_json_technical_data(json.loads(raw_records))]
             elif raw_records:
-                records = _flatten_json_technical_data(raw_records)
+                batches = [_flatten_json_technical_data(raw_records)]
             else:
                 raise ValidationError('Debes enviar technical_file o records')
         except json.JSONDecodeError as exc:
             raise ValidationError(f'JSON invalido: {str(exc)}')
 
-        normalized_records = _normalize_technical_records(records)
-        stats = {
-            'processed': 0,
-            'created': 0,
-            'updated': 0,
-            'skipped': 0,
-            'errors': [],
-        }
-
-        for record in normalized_records:
-            modulo, error = _resolve_modulo_for_record(
-                proyecto,
-                record['modulo_nombre'],
-                record.get('planta_nombre'),
-            )
-            if error:
-                stats['errors'].append(error)
-                continue
-            if modulo is None:
-                # Registro tecnico sin contraparte en el proyecto: se omite
-                stats['skipped'] += 1
-                continue
-
-            module_updated = self._apply_module_fields(modulo, record.get('module_fields', {}))
-
-            if not record['fields'] or not record['fase']:
-                if module_updated:
-                    stats['processed'] += 1
-                    stats['updated'] += 1
-                else:
-                    stats['skipped'] += 1
-                continue
-
-            try:
-                created = self._upsert_modulo_phase_detail(modulo, record['fase'], record['fields'])
-                stats['processed'] += 1
-                if created:
-                    stats['created'] += 1
-                else:
-                    stats['updated'] += 1
-            except Exception as exc:
-                stats['errors'].append(
-                    f'Error importando {modulo.nombre} {record["fase"]}: {str(exc)}'
-                )
-
-        if not normalized_records:
-            stats['errors'].append('No se encontraron registros validos para importar')
+        stats = import_technical_records(proyecto, batches)
 
         grupos_creados = 0
         if stats['processed'] > 0 and not stats['errors']:
@@ -989,11 +480,11 @@ class ProyectoViewSet(viewsets.ModelViewSet):
 
         stats['grupos_bastidor'] = grupos_creados
 
-        return Response({
+        return {
             'status': 'ok',
             'proyecto_id': proyecto.id,
             'stats': stats,
-        })
+        }
 
 
 class GrupoBastidorViewSet(viewsets.ModelViewSet):
@@ -1009,8 +500,9 @@ class GrupoBastidorViewSet(viewsets.ModelViewSet):
     pagination_class = None
     http_method_names = ['get', 'patch', 'head', 'options']
 
-    def get_queryset(self):
-        queryset = GrupoBastidor.objects.prefetch_related('modulos').all().order_by('proyecto', 'indice')
+    OVERVIEW_MODULO_FIELDS = ['id', 'nombre', 'ancho_cm', 'estado', 'inferior_hecho', 'superior_hecho', 'cerrado']
+
+    def _filter_grupos(self, queryset):
         if not _is_admin(self.request.user):
             queryset = queryset.filter(proyecto__usuario=self.request.user)
         proyecto_id = self.request.query_params.get('proyecto', None)
@@ -1018,6 +510,38 @@ class GrupoBastidorViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(proyecto_id=proyecto_id)
         return queryset
 
+    def get_queryset(self):
+        # Los modulos llegan ordenados y con el numero de fotos en la misma
+        # consulta del prefetch (un order_by en el serializer lo anularia).
+        modulos = Modulo.objects.annotate(_fotos_count=Count('fotos_fabricacion')).order_by('nombre')
+        return self._filter_grupos(
+            GrupoBastidor.objects.prefetch_related(Prefetch('modulos', queryset=modulos))
+            .order_by('proyecto', 'indice')
+        )
+
+    @action(detail=False, methods=['get'])
+    def overview(self, request):
+        """
+        Lo mismo que el listado en dos consultas planas (grupos y modulos con
+        su numero de fotos), sin instanciar modelos. Filtrar con ?proyecto=ID
+        """
+        grupos = self._filter_grupos(GrupoBastidor.objects.order_by('proyecto', 'indice'))
+        # Misma representacion de la fecha que el listado.
+        created_at = GrupoBastidorSerializer().fields['created_at']
+        by_grupo = {
+            row['id']: {**row, 'created_at': created_at.to_representation(row['created_at']), 'modulos': []}
+            for row in grupos.values('id', 'proyecto', 'indice', 'nombre', 'created_at')
+        }
+        modulos = (
+            Modulo.objects.filter(grupo_bastidor__in=grupos.values('pk'))
+            .order_by('nombre')
+            .values('grupo_bastidor', *self.OVERVIEW_MODULO_FIELDS)
+            .annotate(fotos_count=Count('fotos_fabricacion'))
+        )
+        for modulo in modulos:
+            by_grupo[modulo.pop('grupo_bastidor')]['modulos'].append(modulo)
+        return Response(list(by_grupo.values()))
+
 
 class PlantaViewSet(viewsets.ModelViewSet):
     """
@@ -1132,6 +656,8 @@ class ModuloViewSet(viewsets.ModelViewSet):
             done_at=None,
             done_by=None,
         )
+        # update() no pasa por MesaQueueItem.save(): invalidar los bundles a mano.
+        Mesa.bump_version_for_modulos([modulo.pk])
 
         serializer = self.get_serializer(modulo)
         return Response(serializer.data)
@@ -1351,10 +877,10 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
             self._sync_proyecto_actual(grupo)
 
         # Auto-plan so the newly added project shows up in the mesa
-        # queues without requiring a second click. Preserves in-flight
-        # items thanks to _get_preserved_active_prefix.
+        # queues without requiring a second click. Append-only: the
+        # projects already planned keep their queues untouched.
         try:
-            self._plan_cola(grupo, request.user)
+            self._plan_cola(grupo, request.user, append_only=True)
         except ValidationError:
             # Planning issues (e.g. missing mesas) shouldn't roll back
             # the cola insertion — surface them on the next 'planificar'.
@@ -1414,96 +940,6 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
         grupo.refresh_from_db()
         return Response(GrupoMesasSerializer(grupo).data)
 
-    def _create_queue_for_mesa(self, mesa, modules, fase, user, module_group_map, group_offset=0, start_position=0, has_active_items=False):
-        created_items = []
-        for index, modulo in enumerate(modules):
-            item = MesaQueueItem.objects.create(
-                mesa=mesa,
-                modulo=modulo,
-                fase=fase,
-                imagen=None,
-                position=start_position + index,
-                plan_group_index=(group_offset + module_group_map.get(modulo.id)) if module_group_map.get(modulo.id) else None,
-                status='MOSTRANDO' if (index == 0 and not has_active_items) else 'EN_COLA',
-                assigned_by=user if user.is_authenticated else None,
-            )
-            created_items.append(item)
-
-        return created_items
-
-    def _normalize_active_queue_for_mesa(self, mesa, preserved_items):
-        normalized = []
-        ordered_items = list(sorted(preserved_items, key=lambda item: item.position))
-        for index, item in enumerate(ordered_items):
-            desired_status = 'MOSTRANDO' if index == 0 else 'EN_COLA'
-            updates = []
-            if item.position != index:
-                item.position = index
-                updates.append('position')
-            if item.status != desired_status:
-                item.status = desired_status
-                updates.append('status')
-            if updates:
-                item.save(update_fields=updates)
-            normalized.append(item)
-
-        mesa.imagen_actual = normalized[0].imagen if normalized else None
-        mesa.current_image_index = 0
-        mesa.save(update_fields=['imagen_actual', 'current_image_index', 'ultima_actualizacion'])
-        return normalized
-
-    def _get_preserved_active_prefix(self, grupo):
-        """Destructive mode: preserve only items whose bastidor group has
-        at least one fully-completed module. Everything else (in-flight
-        but not yet closed) gets wiped and re-planned. Used by the
-        explicit 'Planificar ahora' button on the head project."""
-        group_items = MesaQueueItem.objects.select_related('mesa', 'modulo').filter(mesa__grupo=grupo)
-        active_items = group_items.filter(status__in=ACTIVE_QUEUE_STATUSES)
-        completed_group_indexes = list(
-            group_items.filter(
-                plan_group_index__isnull=False,
-                modulo__inferior_hecho=True,
-                modulo__superior_hecho=True,
-            ).values_list('plan_group_index', flat=True).distinct()
-        )
-
-        preserve_until = max(completed_group_indexes) if completed_group_indexes else None
-        preserved_by_role = {}
-        preserved_keys = set()
-
-        if preserve_until is None:
-            return preserve_until, preserved_by_role, preserved_keys
-
-        preserved_items = active_items.filter(plan_group_index__lte=preserve_until).order_by('mesa_id', 'position')
-        for item in preserved_items:
-            preserved_keys.add((item.modulo_id, item.fase))
-            preserved_by_role.setdefault(item.mesa.rol, []).append(item)
-
-        return preserve_until, preserved_by_role, preserved_keys
-
-    def _get_all_active_prefix(self, grupo):
-        """Append mode: preserve every active queue item (EN_COLA /
-        MOSTRANDO). New items just slot in at the tail. Used for
-        planning subsequent projects of the cola and for auto-plan
-        after cola/add."""
-        active_items = list(
-            MesaQueueItem.objects.select_related('mesa', 'modulo').filter(
-                mesa__grupo=grupo,
-                status__in=ACTIVE_QUEUE_STATUSES,
-            ).order_by('mesa_id', 'position')
-        )
-        preserved_by_role = {}
-        preserved_keys = set()
-        preserve_until = None
-
-        for item in active_items:
-            preserved_keys.add((item.modulo_id, item.fase))
-            preserved_by_role.setdefault(item.mesa.rol, []).append(item)
-            if item.plan_group_index is not None:
-                preserve_until = max(preserve_until or 0, item.plan_group_index)
-
-        return preserve_until, preserved_by_role, preserved_keys
-
     def _build_plan_sequences(self, proyecto, excluded_phase_keys=None, group_index_offset=0,
                                initial_inf1_load=0, initial_inf2_load=0):
         excluded_phase_keys = excluded_phase_keys or set()
@@ -1599,19 +1035,61 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
             'superior_sequence': superior_sequence,
         }
 
-    def _build_group_plan(self, grupo, proyecto, user, append_mode=False):
-        grupo.ensure_default_mesas()
-        grupo.refresh_from_db()
+    def _load_plan_state(self, grupo):
+        """Estado actual de las colas activas del grupo, por rol y en orden de posicion."""
+        state = {role: [] for role, _ in PLAN_ROLES}
+        active_items = (
+            MesaQueueItem.objects.select_related('mesa', 'modulo')
+            .filter(
+                mesa__grupo=grupo,
+                mesa__rol__in=state.keys(),
+                status__in=ACTIVE_QUEUE_STATUSES,
+            )
+            .order_by('mesa_id', 'position', 'id')
+        )
+        for item in active_items:
+            state[item.mesa.rol].append({
+                'modulo_id': item.modulo_id,
+                'modulo_nombre': item.modulo.nombre,
+                'fase': item.fase,
+                'plan_group_index': item.plan_group_index,
+            })
+        return state
 
-        mesas = {mesa.rol: mesa for mesa in grupo.mesas.all()}
-        missing_roles = [rol for rol in ['INFERIOR_1', 'INFERIOR_2', 'SUPERIORES'] if rol not in mesas]
-        if missing_roles:
-            raise ValidationError(f'Faltan mesas requeridas en el grupo: {", ".join(missing_roles)}')
+    def _simulate_group_plan(self, grupo, proyecto, state, append_mode, completed_group_indexes):
+        """Planifica un proyecto sobre ``state`` en memoria (no escribe nada).
 
+        - Append mode: se conserva todo lo activo y lo nuevo va a la cola.
+        - Modo destructivo (cabeza de la cola): solo se conservan los grupos
+          de bastidor hasta el ultimo con algun modulo terminado; el resto se
+          vuelve a planificar.
+        """
         if append_mode:
-            preserved_until, preserved_by_role, preserved_phase_keys = self._get_all_active_prefix(grupo)
+            preserved_by_role = {role: list(entries) for role, entries in state.items()}
+            group_indexes = [
+                entry['plan_group_index']
+                for entries in state.values()
+                for entry in entries
+                if entry['plan_group_index'] is not None
+            ]
+            preserved_until = max(group_indexes) if group_indexes else None
         else:
-            preserved_until, preserved_by_role, preserved_phase_keys = self._get_preserved_active_prefix(grupo)
+            preserved_until = max(completed_group_indexes) if completed_group_indexes else None
+            preserved_by_role = {
+                role: [
+                    entry for entry in entries
+                    if preserved_until is not None
+                    and entry['plan_group_index'] is not None
+                    and entry['plan_group_index'] <= preserved_until
+                ]
+                for role, entries in state.items()
+            }
+        preserved_phase_keys = {
+            (entry['modulo_id'], entry['fase'])
+            for entries in preserved_by_role.values()
+            for entry in entries
+        }
+
         external_conflicts = MesaQueueItem.objects.select_related('mesa', 'modulo').filter(
             status__in=ACTIVE_QUEUE_STATUSES,
             modulo__proyecto=proyecto,
@@ -1638,166 +1116,387 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
         # Seed the balance with however many items already sit on each
         # inferior mesa (from preserved/in-flight work). Keeps INF1 and
         # INF2 leveled even across successive planificar passes.
-        initial_inf1_load = len(preserved_by_role.get('INFERIOR_1', []))
-        initial_inf2_load = len(preserved_by_role.get('INFERIOR_2', []))
-
         plan_data = self._build_plan_sequences(
             proyecto,
             excluded_phase_keys=(
                 preserved_phase_keys | external_phase_keys | reservation_phase_keys
             ),
             group_index_offset=preserved_until or 0,
-            initial_inf1_load=initial_inf1_load,
-            initial_inf2_load=initial_inf2_load,
+            initial_inf1_load=len(preserved_by_role.get('INFERIOR_1', [])),
+            initial_inf2_load=len(preserved_by_role.get('INFERIOR_2', [])),
         )
-        skipped_external_conflicts = [
-                f'{item.modulo.nombre} {item.fase} ya está en {item.mesa.nombre}'
-            for item in external_conflicts[:5]
-        ]
-
-        with transaction.atomic():
-            active_group_items = MesaQueueItem.objects.filter(
-                mesa__grupo=grupo,
-                status__in=ACTIVE_QUEUE_STATUSES,
-            )
-            preserved_ids = [
-                item.id
-                for items in preserved_by_role.values()
-                for item in items
-            ]
-            if preserved_ids:
-                active_group_items.exclude(id__in=preserved_ids).delete()
-            else:
-                active_group_items.delete()
-
-            normalized_preserved = {}
-            for role, mesa in mesas.items():
-                normalized_preserved[role] = self._normalize_active_queue_for_mesa(
-                    mesa,
-                    preserved_by_role.get(role, []),
-                )
-
-            inferior_1_items = normalized_preserved['INFERIOR_1'] + self._create_queue_for_mesa(
-                mesas['INFERIOR_1'],
-                plan_data['inferior_1_sequence'],
-                'INFERIOR',
-                user,
-                plan_data['module_group_map'],
-                start_position=len(normalized_preserved['INFERIOR_1']),
-                has_active_items=bool(normalized_preserved['INFERIOR_1']),
-            )
-            inferior_2_items = normalized_preserved['INFERIOR_2'] + self._create_queue_for_mesa(
-                mesas['INFERIOR_2'],
-                plan_data['inferior_2_sequence'],
-                'INFERIOR',
-                user,
-                plan_data['module_group_map'],
-                start_position=len(normalized_preserved['INFERIOR_2']),
-                has_active_items=bool(normalized_preserved['INFERIOR_2']),
-            )
-            superiores_items = normalized_preserved['SUPERIORES'] + self._create_queue_for_mesa(
-                mesas['SUPERIORES'],
-                plan_data['superior_sequence'],
-                'SUPERIOR',
-                user,
-                plan_data['module_group_map'],
-                start_position=len(normalized_preserved['SUPERIORES']),
-                has_active_items=bool(normalized_preserved['SUPERIORES']),
-            )
-
-            for mesa in mesas.values():
-                current_item = mesa.queue_items.filter(status=MesaQueueStatus.MOSTRANDO).order_by('position').first()
-                mesa.imagen_actual = current_item.imagen if current_item else None
-                mesa.current_image_index = 0
-                mesa.save(update_fields=['imagen_actual', 'current_image_index', 'ultima_actualizacion'])
-
-            # Reserve the GrupoBastidor rows that now have modules in this
-            # grupo's plan. Other grupos won't touch them on subsequent
-            # planificar calls until this grupo releases them (eg. via
-            # release endpoint, TBD).
-            planned_modulo_ids = {m.id for m in plan_data['inferior_1_sequence']}
-            planned_modulo_ids.update(m.id for m in plan_data['inferior_2_sequence'])
-            planned_modulo_ids.update(m.id for m in plan_data['superior_sequence'])
-            if planned_modulo_ids:
-                reserved_bastidor_ids = set(
-                    Modulo.objects.filter(
-                        id__in=planned_modulo_ids,
-                        grupo_bastidor__isnull=False,
-                    ).values_list('grupo_bastidor_id', flat=True)
-                )
-                if reserved_bastidor_ids:
-                    GrupoBastidor.objects.filter(
-                        id__in=reserved_bastidor_ids,
-                        asignado_a__isnull=True,
-                    ).update(asignado_a=grupo)
 
-        return {
+        new_state = {}
+        planned_modulo_ids = set()
+        for role, fase in PLAN_ROLES:
+            entries = list(preserved_by_role.get(role, []))
+            for modulo in plan_data[PLAN_SEQUENCE_KEYS[role]]:
+                planned_modulo_ids.add(modulo.id)
+                entries.append({
+                    'modulo_id': modulo.id,
+                    'modulo_nombre': modulo.nombre,
+                    'fase': fase,
+                    'plan_group_index': plan_data['module_group_map'].get(modulo.id) or None,
+                })
+            new_state[role] = entries
+
+        summary = {
             'project_id': proyecto.id,
             'project_name': proyecto.nombre,
             'preserved_until_group': preserved_until,
             'bastidor_groups': plan_data['group_summaries'],
             'queues': {
-                'INFERIOR_1': [item.modulo.nombre for item in inferior_1_items],
-                'INFERIOR_2': [item.modulo.nombre for item in inferior_2_items],
-                'SUPERIORES': [item.modulo.nombre for item in superiores_items],
+                role: [entry['modulo_nombre'] for entry in entries]
+                for role, entries in new_state.items()
             },
         }
+        return new_state, planned_modulo_ids, summary
+
+    def _cola_entries(self, grupo, extra_proyecto=None):
+        """Entradas de la cola en orden; ``extra_proyecto`` se anade al final sin
+        guardarlo (dry-run de planificar con un proyecto que aun no esta en cola)."""
+        entries = list(grupo.proyectos_cola.select_related('proyecto').order_by('orden', 'id'))
+        if extra_proyecto is not None and all(e.proyecto_id != extra_proyecto.id for e in entries):
+            next_orden = max((e.orden for e in entries), default=-1) + 1
+            entries.append(GrupoMesasProyecto(grupo_mesas=grupo, proyecto=extra_proyecto, orden=next_orden))
+        return entries
+
+    def _completed_group_indexes(self, grupo):
+        return set(
+            MesaQueueItem.objects.filter(
+                mesa__grupo=grupo,
+                plan_group_index__isnull=False,
+                modulo__inferior_hecho=True,
+                modulo__superior_hecho=True,
+            ).values_list('plan_group_index', flat=True).distinct()
+        )
+
+    def _plan_fingerprint(self, grupo, user, entries, append_only=False):
+        """Huella de todo lo que lee el planificador: cola, proyectos, plantas,
+        modulos, detalles, reservas de bastidor y colas activas implicadas.
+        Si no cambia, el plan calculado tampoco (sirve de ``plan_id``).
+
+        Modulos, plantas y detalles entran como agregados por proyecto
+        (numero de filas y ultimo ``updated_at``), no fila a fila: la huella
+        se calcula en cada vista previa y en cada planificar."""
+        import hashlib
+
+        proyecto_ids = sorted({entry.proyecto_id for entry in entries})
+        modulo_ids = Modulo.objects.filter(proyecto_id__in=proyecto_ids).values('id')
+
+        def per_proyecto(queryset, proyecto_field, **aggregates):
+            return list(
+                queryset.values(proyecto_field).annotate(n=Count('id'), **aggregates)
+                .order_by(proyecto_field).values_list(proyecto_field, 'n', *aggregates)
+            )
+
+        parts = {
+            'grupo': grupo.id,
+            'user': None if _is_admin(user) else user.id,
+            'append_only': bool(append_only),
+            'cola': [(entry.proyecto_id, entry.orden) for entry in entries],
+            'mesas': list(grupo.mesas.order_by('id').values_list('id', 'rol')),
+            'proyectos': list(
+                Proyecto.objects.filter(id__in=proyecto_ids).order_by('id')
+                .values_list('id', 'nombre', 'bastidor_longitud_cm')
+            ),
+            'plantas': per_proyecto(
+                Planta.objects.filter(proyecto_id__in=proyecto_ids), 'proyecto_id', last=Max('id'),
+            ),
+            'modulos': per_proyecto(
+                Modulo.objects.filter(proyecto_id__in=proyecto_ids), 'proyecto_id',
+                last=Max('id'), updated=Max('updated_at'),
+            ),
+            'detalles': per_proyecto(
+                DetalleModuloFase.objects.filter(modulo__proyecto_id__in=proyecto_ids), 'modulo__proyecto_id',
+                last=Max('id'), updated=Max('updated_at'),
+            ),
+            'bastidores': list(
+                GrupoBastidor.objects.filter(proyecto_id__in=proyecto_ids)
+                .order_by('id').values_list('id', 'indice', 'asignado_a_id')
+            ),
+            'activos': list(
+                MesaQueueItem.objects.filter(status__in=ACTIVE_QUEUE_STATUSES)
+                .filter(Q(mesa__grupo=grupo) | Q(modulo_id__in=modulo_ids))
+                .order_by('id')
+                .values_list('id', 'mesa_id', 'modulo_id', 'fase', 'position', 'status', 'plan_group_index')
+            ),
+            'completados': sorted(self._completed_group_indexes(grupo)),
+        }
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def _plan_cache_key(self, grupo, plan_id):
+        return f'planner:grupo:{grupo.id}:plan:{plan_id}'
 
-    def _plan_cola(self, grupo, user):
-        """Plans every project queued on the grupo, in order.
+    def _compute_cola_plan(self, grupo, user, append_only=False, entries=None):
+        """Calcula en memoria el estado final de las colas para toda la cola de proyectos.
 
         - The head project runs in destructive mode: non-completed queue
-          items are wiped and re-planned (so re-clicking 'Planificar
-          ahora' really recomputes).
+          items are re-planned (so re-clicking 'Planificar ahora' really
+          recomputes), unless ``append_only``.
         - Subsequent projects run in append mode: they preserve everything
           active and just slot in at the tail.
-        - Projects whose modules are all done are removed from the cola
-          before planning, so a finished P1 doesn't keep blocking P2
-          from becoming the visible head.
+        - Projects whose modules are all done are dropped from the cola
+          (on apply), so a finished P1 doesn't keep blocking P2 from
+          becoming the visible head.
         """
         from rest_framework.exceptions import PermissionDenied
 
-        # Drop completed projects from the cola so the head is always
-        # a project that still has work left.
-        dropped_ids = []
-        for entry in list(grupo.proyectos_cola.select_related('proyecto').order_by('orden', 'id')):
-            has_pending = entry.proyecto.modulos.filter(
+        if entries is None:
+            entries = self._cola_entries(grupo)
+        pending_project_ids = set(
+            Modulo.objects.filter(
+                proyecto_id__in=[entry.proyecto_id for entry in entries],
                 cerrado=False,
             ).filter(
                 Q(inferior_hecho=False) | Q(superior_hecho=False),
-            ).exists()
-            if not has_pending:
-                dropped_ids.append(entry.id)
-        if dropped_ids:
-            grupo.proyectos_cola.filter(id__in=dropped_ids).delete()
-            for index, entry in enumerate(grupo.proyectos_cola.order_by('orden', 'id')):
-                if entry.orden != index:
-                    entry.orden = index
-                    entry.save(update_fields=['orden'])
-
-        entries = list(
-            grupo.proyectos_cola.select_related('proyecto').order_by('orden', 'id')
+            ).values_list('proyecto_id', flat=True).distinct()
         )
+        # Por proyecto, no por id de la entrada: el plan cacheado puede venir
+        # de una vista previa (entrada virtual) o de un planificar revertido.
+        dropped_proyecto_ids = [
+            entry.proyecto_id for entry in entries
+            if entry.proyecto_id not in pending_project_ids
+        ]
+        entries = [entry for entry in entries if entry.proyecto_id in pending_project_ids]
+        completed_group_indexes = self._completed_group_indexes(grupo)
+
+        state = self._load_plan_state(grupo)
+        reserve_modulo_ids = set()
         plan_summaries = []
         for position, entry in enumerate(entries):
             proyecto = entry.proyecto
             if not _is_admin(user) and proyecto.usuario_id != user.id:
                 raise PermissionDenied('No puedes planificar proyectos de otra ferralla')
-            append_mode = position > 0
-            plan_summaries.append(
-                self._build_group_plan(grupo, proyecto, user, append_mode=append_mode)
+            state, planned_modulo_ids, summary = self._simulate_group_plan(
+                grupo,
+                proyecto,
+                state,
+                append_mode=append_only or position > 0,
+                completed_group_indexes=completed_group_indexes,
             )
-        return plan_summaries
+            reserve_modulo_ids |= planned_modulo_ids
+            plan_summaries.append(summary)
+
+        return {
+            'grupo_id': grupo.id,
+            'dropped_proyecto_ids': dropped_proyecto_ids,
+            'queues': state,
+            'reserve_modulo_ids': sorted(reserve_modulo_ids),
+            'plans': plan_summaries,
+        }
+
+    def _apply_cola_plan(self, grupo, plan, user):
+        """Lleva las colas activas del grupo al estado de ``plan`` tocando solo el delta.
+
+        Las filas existentes se reutilizan por (modulo, fase): solo se borran las que
+        sobran, se insertan las que faltan (bulk_create) y se recolocan las que
+        cambian de mesa / posicion / estado (bulk_update). Una mesa solo se
+        actualiza si cambia el item que tiene en pantalla.
+        """
+        grupo.ensure_default_mesas()
+
+        mesas = {mesa.rol: mesa for mesa in grupo.mesas.all()}
+        missing_roles = [rol for rol, _ in PLAN_ROLES if rol not in mesas]
+        if missing_roles:
+            raise ValidationError(f'Faltan mesas requeridas en el grupo: {", ".join(missing_roles)}')
+
+        assigned_by = user if user.is_authenticated else None
+        stats = {'created': 0, 'updated': 0, 'deleted': 0}
+
+        with transaction.atomic():
+            if plan['dropped_proyecto_ids']:
+                grupo.proyectos_cola.filter(proyecto_id__in=plan['dropped_proyecto_ids']).delete()
+                compacted = []
+                for index, entry in enumerate(grupo.proyectos_cola.order_by('orden', 'id')):
+                    if entry.orden != index:
+                        entry.orden = index
+                        compacted.append(entry)
+                if compacted:
+                    GrupoMesasProyecto.objects.bulk_update(compacted, ['orden'])
+
+            existing = {
+                (item.modulo_id, item.fase): item
+                for item in MesaQueueItem.objects.select_for_update().filter(
+                    mesa__in=[mesas[role] for role, _ in PLAN_ROLES],
+                    status__in=ACTIVE_QUEUE_STATUSES,
+                )
+            }
+            previous_heads = {
+                item.mesa_id: item.id
+                for item in existing.values()
+                if item.status == MesaQueueStatus.MOSTRANDO
+            }
+            # El plan se calculo fuera de la transaccion (o viene de la cache):
+            # una fase terminada desde entonces no se vuelve a crear. Las que
+            # siguen activas estan bloqueadas arriba y se conservan tal cual.
+            new_entries = {
+                role: [
+                    entry for entry in plan['queues'].get(role, [])
+                    if (entry['modulo_id'], entry['fase']) not in existing
+                ]
+                for role, _ in PLAN_ROLES
+            }
+            done_keys = self._done_phase_keys(new_entries)
+            queues = {
+                role: [
+                    entry for entry in plan['queues'].get(role, [])
+                    if (entry['modulo_id'], entry['fase']) not in done_keys
+                    or (entry['modulo_id'], entry['fase']) in existing
+                ]
+                for role, _ in PLAN_ROLES
+            }
+            desired_keys = {
+                (entry['modulo_id'], entry['fase'])
+                for entries in queues.values()
+                for entry in entries
+            }
+
+            stale_ids = [item.id for key, item in existing.items() if key not in desired_keys]
+            if stale_ids:
+                stats['deleted'] = MesaQueueItem.objects.filter(id__in=stale_ids).delete()[0]
+
+            to_update = []
+            to_create = []
+            heads = {}
+            for role, _ in PLAN_ROLES:
+                mesa = mesas[role]
+                for index, entry in enumerate(queues[role]):
+                    desired_status = 'MOSTRANDO' if index == 0 else 'EN_COLA'
+                    item = existing.get((entry['modulo_id'], entry['fase']))
+                    if item is None:
+                        item = MesaQueueItem(
+                            mesa=mesa,
+                            modulo_id=entry['modulo_id'],
+                            fase=entry['fase'],
+                            imagen=None,
+                            position=index,
+                            plan_group_index=entry['plan_group_index'],
+                            status=desired_status,
+                            assigned_by=assigned_by,
+                        )
+                        to_create.append(item)
+                    elif (
+                        item.mesa_id != mesa.id
+                        or item.position != index
+                        or item.status != desired_status
+                        or item.plan_group_index != entry['plan_group_index']
+                    ):
+                        item.mesa = mesa
+                        item.position = index
+                        item.status = desired_status
+                        item.plan_group_index = entry['plan_group_index']
+                        to_update.append(item)
+                    if index == 0:
+                        heads[mesa.id] = item
+
+            if to_update:
+                MesaQueueItem.objects.bulk_update(
+                    to_update, ['mesa', 'position', 'status', 'plan_group_index'], batch_size=500
+                )
+            if to_create:
+                # Las fases planificadas excluyen todo lo activo fuera del grupo y las
+                # del grupo se reutilizan, asi que no chocan con
+                # unique_active_modulo_fase_assignment. imagen=None: no hay nada que
+                # validar en MesaQueueItem.save().
+                MesaQueueItem.objects.bulk_create(to_create, batch_size=500)
+            stats['updated'] = len(to_update)
+            stats['created'] = len(to_create)
+            # Escrituras en bloque (sin MesaQueueItem.save()): invalidar los bundles.
+            Mesa.bump_version([mesas[role].id for role, _ in PLAN_ROLES])
+
+            for role, _ in PLAN_ROLES:
+                mesa = mesas[role]
+                head = heads.get(mesa.id)
+                if (head.id if head else None) == previous_heads.get(mesa.id):
+                    continue
+                mesa.imagen_actual_id = head.imagen_id if head else None
+                mesa.current_image_index = 0
+                mesa.save(update_fields=['imagen_actual', 'current_image_index', 'ultima_actualizacion'])
+
+            # Reserve the GrupoBastidor rows that now have modules in this
+            # grupo's plan. Other grupos won't touch them on subsequent
+            # planificar calls until this grupo releases them (eg. via
+            # release endpoint, TBD).
+            if plan['reserve_modulo_ids']:
+                reserved_bastidor_ids = set(
+                    Modulo.objects.filter(
+                        id__in=plan['reserve_modulo_ids'],
+                        grupo_bastidor__isnull=False,
+                    ).values_list('grupo_bastidor_id', flat=True)
+                )
+                if reserved_bastidor_ids:
+                    GrupoBastidor.objects.filter(
+                        id__in=reserved_bastidor_ids,
+                        asignado_a__isnull=True,
+                    ).update(asignado_a=grupo)
+
+        return stats
+
+    @staticmethod
+    def _done_phase_keys(queues):
+        """(modulo_id, fase) de ``queues`` ya terminados, releido de la BD.
+
+        Se lee de los flags del modulo, que es lo que usa el planificador:
+        marcar un item HECHO (marcar_hecho, advance_mesa_queue, completar)
+        los pone en la misma transaccion, y reiniciar los quita junto con
+        el HECHO de sus items."""
+        modulo_ids = {entry['modulo_id'] for entries in queues.values() for entry in entries}
+        done = set()
+        for modulo_id, inferior_hecho, superior_hecho, cerrado in Modulo.objects.filter(
+            id__in=modulo_ids,
+        ).values_list('id', 'inferior_hecho', 'superior_hecho', 'cerrado'):
+            if inferior_hecho or cerrado:
+                done.add((modulo_id, 'INFERIOR'))
+            if superior_hecho or cerrado:
+                done.add((modulo_id, 'SUPERIOR'))
+        return done
+
+    def _get_cola_plan(self, grupo, user, append_only=False, extra_proyecto=None):
+        """Plan de la cola reutilizando el cacheado si nada ha cambiado desde que se
+        calculo (p.ej. un dry-run previo). Devuelve (plan_id, plan)."""
+        from django.conf import settings
+        from django.core.cache import cache
+
+        entries = self._cola_entries(grupo, extra_proyecto=extra_proyecto)
+        plan_id = self._plan_fingerprint(grupo, user, entries, append_only=append_only)
+        cache_key = self._plan_cache_key(grupo, plan_id)
+        plan = cache.get(cache_key)
+        if plan is None:
+            plan = self._compute_cola_plan(grupo, user, append_only=append_only, entries=entries)
+            cache.set(cache_key, plan, getattr(settings, 'PLANNER_PLAN_CACHE_SECONDS', 600))
+        return plan_id, plan
+
+    def _plan_cola(self, grupo, user, append_only=False):
+        """Plans every project queued on the grupo, in order, writing only the delta.
+        See _compute_cola_plan / _apply_cola_plan."""
+        from django.core.cache import cache
+
+        plan_id, plan = self._get_cola_plan(grupo, user, append_only=append_only)
+        self._apply_cola_plan(grupo, plan, user)
+        cache.delete(self._plan_cache_key(grupo, plan_id))
+        return plan['plans']
 
     @action(detail=True, methods=['post'], url_path='planificar')
     def planificar(self, request, pk=None):
+        """Planifica la cola del grupo.
+
+        - ``?dry_run=1``: calcula el plan sin escribir nada y lo devuelve con un
+          ``plan_id``; el plan queda cacheado.
+        - Con ``plan_id`` en el cuerpo: aplica ese plan tal cual (sin recalcular) si
+          nada ha cambiado desde la vista previa; si no, 409 con el ``plan_id`` actual.
+        - ``?async=1``: lo aplica el worker de trabajos (202 + id del trabajo).
+        """
         from rest_framework.exceptions import PermissionDenied
 
         grupo = self.get_object()
+        dry_run = str(request.query_params.get('dry_run', '')).lower() in ('1', 'true', 'yes')
 
         # Back-compat: if the body carries a proyecto, make sure it's
         # in the cola (push it to the head if missing) so the planner
         # picks it up naturally.
+        proyecto = None
         explicit_id = request.data.get('proyecto_id') or request.data.get('proyecto')
         if explicit_id:
             try:
@@ -1806,7 +1505,37 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
                 raise ValidationError({'proyecto_id': 'Proyecto inválido'})
             if not _is_admin(request.user) and proyecto.usuario_id != request.user.id:
                 raise PermissionDenied('No puedes planificar proyectos de otra ferralla')
-            with transaction.atomic():
+
+        if dry_run:
+            plan_id, plan = self._get_cola_plan(grupo, request.user, extra_proyecto=proyecto)
+            return Response({
+                'status': 'preview',
+                'plan_id': plan_id,
+                'plans': plan['plans'],
+                'plan': plan['plans'][0] if plan['plans'] else None,
+            })
+
+        requested_plan_id = request.data.get('plan_id')
+        if _wants_async(request):
+            from api.jobs import enqueue_job
+            job = enqueue_job('planificar', request.user, {
+                'grupo': grupo.id,
+                'proyecto': proyecto.id if proyecto else None,
+                'plan_id': requested_plan_id,
+            })
+            return _job_accepted(job)
+
+        status_code, payload = self._run_planificar(grupo, request.user, proyecto, requested_plan_id)
+        return Response(payload, status=status_code)
+
+    def _run_planificar(self, grupo, user, proyecto=None, requested_plan_id=None):
+        """Aplica la planificacion (sincrona o desde api.jobs); devuelve ``(status, cuerpo)``."""
+        from django.core.cache import cache
+
+        # Alta en la cola, comprobacion del plan_id y aplicacion en una sola
+        # transaccion: si la vista previa esta obsoleta no queda nada escrito.
+        with transaction.atomic():
+            if proyecto is not None:
                 existing = grupo.proyectos_cola.filter(proyecto=proyecto).first()
                 if existing is None:
                     last = grupo.proyectos_cola.order_by('-orden').first()
@@ -1815,19 +1544,30 @@ class GrupoMesasViewSet(viewsets.ModelViewSet):
                         grupo_mesas=grupo, proyecto=proyecto, orden=next_orden,
                     )
 
-        plan_summaries = self._plan_cola(grupo, request.user)
+            plan_id, plan = self._get_cola_plan(grupo, user)
+            if requested_plan_id and requested_plan_id != plan_id:
+                transaction.set_rollback(True)
+                return 409, {
+                    'detail': 'La planificacion ha cambiado desde la vista previa. Vuelve a previsualizar.',
+                    'plan_id': plan_id,
+                }
+
+            changes = self._apply_cola_plan(grupo, plan, user)
+        cache.delete(self._plan_cache_key(grupo, plan_id))
+        plan_summaries = plan['plans']
         self._sync_proyecto_actual(grupo)
 
         grupo.refresh_from_db()
-        serializer = self.get_serializer(grupo)
-        return Response({
+        return 200, {
             'status': 'ok',
-            'grupo': serializer.data,
+            'grupo': GrupoMesasSerializer(grupo).data,
             'plans': plan_summaries,
             # Keep the legacy 'plan' key populated (head project) so old
             # clients don't break while they migrate.
             'plan': plan_summaries[0] if plan_summaries else None,
-        })
+            'plan_id': plan_id,
+            'changes': changes,
+        }
 
 
 def _parse_iso_date(value, default):
@@ -1862,80 +1602,38 @@ def _compute_dificultad_scale(user, fallback_detalles=None, proyecto_id=None):
     Computes the scale factor that maps the user's mean raw dificultad
     to 100. Used by both the stats endpoint and the mesa queue items
     so dificultad values in the UI share the same reference.
+
+    Reads the per-project aggregate (Proyecto.dificultad_raw_total /
+    dificultad_detalles): one query, no pass over the detalles.
     """
-    qs = DetalleModuloFase.objects.select_related('modulo')
+    qs = Proyecto.objects.all()
     if proyecto_id:
-        qs = qs.filter(modulo__proyecto_id=proyecto_id)
+        qs = qs.filter(id=proyecto_id)
     if user is not None and not (user.is_staff or user.is_superuser):
-        qs = qs.filter(modulo__proyecto__usuario=user)
-    detalles = list(qs)
-    if not detalles and fallback_detalles:
+        qs = qs.filter(usuario=user)
+    agg = qs.aggregate(total=Sum('dificultad_raw_total'), count=Sum('dificultad_detalles'))
+    total = float(agg['total'] or 0)
+    count = agg['count'] or 0
+    if not count and fallback_detalles:
         detalles = list(fallback_detalles)
-    if not detalles:
+        total = sum(_compute_dificultad(d) for d in detalles)
+        count = len(detalles)
+    if not count:
         return 1.0
-    total = 0.0
-    for d in detalles:
-        total += _compute_dificultad(d)
-    mean_raw = total / len(detalles) if total > 0 else 0
+    mean_raw = total / count if total > 0 else 0
     return 100.0 / mean_raw if mean_raw > 0 else 1.0
 
 
 def _compute_dificultad(detalle):
-    """Mirror of DetalleModuloFase.dificultad_calculada, tolerant to None.
+    """Raw dificultad of a DetalleModuloFase, tolerant to None.
 
-    Time units: cut=1, weld=2, color ribbon=1.5 (only SUPERIOR).
-    Each element: welds = (count*2 + meters) * multiplier, where
-    multiplier is 1 for refuerzos, 3 for separadores, 4 for zunchos/punzos.
-    Separadores/zunchos/punzos only count on INFERIOR phase. Weight /100.
+    Uses the persisted ``dificultad_raw``; only rows saved before that
+    column existed fall back to computing it (see
+    ``api.models.calcular_dificultad_raw``).
     """
-    def _num(value):
-        if value is None or value == '':
-            return Decimal('0')
-        try:
-            return Decimal(value)
-        except (TypeError, InvalidOperation):
-            return Decimal('0')
-
-    cortes = _num(detalle.cantidad_cortes)
-    is_sup = detalle.fase == 'SUPERIOR'
-
-    def _welds(count, meters, multiplier):
-        return (count * Decimal('2') + meters) * multiplier
-
-    welds = Decimal('0')
-    welds += _welds(_num(detalle.cantidad_refuerzos), _num(detalle.metros_refuerzos), Decimal('1'))
-    if not is_sup:
-        sep_count = _num(detalle.cantidad_separadores)
-        sep_meters = _num(detalle.metros_separadores)
-        if sep_meters <= 0 and sep_count > 0:
-            sep_meters = sep_count * Decimal('2')
-        welds += _welds(sep_count, sep_meters, Decimal('3'))
-        welds += _welds(_num(detalle.cantidad_zunchos), _num(detalle.metros_zunchos), Decimal('4'))
-        welds += _welds(_num(detalle.cantidad_punzos), _num(detalle.metros_punzos), Decimal('4'))
-
-    time_units = cortes * Decimal('1') + welds * Decimal('2')
-
-    # Color ribbons: only SUPERIOR, count non-'x' chars in modulo code.
-    if is_sup and detalle.modulo and detalle.modulo.codigos_color:
-        ribbons = sum(1 for c in detalle.modulo.codigos_color if c and c.lower() != 'x')
-        time_units += Decimal(ribbons) * Decimal('1.5')
-
-    # Weight component (normalized /100).
-    peso = Decimal('0')
-    values = [
-        detalle.peso_malla_final_kg,
-        detalle.peso_refuerzos_kg,
-        detalle.peso_zunchos_kg,
-        detalle.peso_separadores_kg,
-        detalle.peso_punzos_kg,
-    ]
-    for v in values:
-        if v is not None:
-            try:
-                peso += Decimal(v)
-            except (TypeError, InvalidOperation):
-                pass
-    return float(time_units + peso / Decimal('100'))
+    if detalle.dificultad_raw is not None:
+        return float(detalle.dificultad_raw)
+    return detalle.dificultad_calculada
 
 
 class ProductionStatsView(APIView):
@@ -1950,237 +1648,83 @@ class ProductionStatsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        from datetime import date, timedelta
         from django.utils import timezone
+        from api.services import PRODUCCION_COUNT_FIELDS, PRODUCCION_DECIMAL_FIELDS
 
         today = timezone.localdate()
         from_date = _parse_iso_date(request.query_params.get('from'), today)
         to_date = _parse_iso_date(request.query_params.get('to'), from_date)
         proyecto_id = request.query_params.get('proyecto')
 
-        # Build a tz-aware range for filtering done_at (local midnights)
-        current_tz = timezone.get_current_timezone()
-        from_dt = timezone.make_aware(
-            timezone.datetime.combine(from_date, timezone.datetime.min.time()),
-            current_tz,
-        )
-        to_dt_exclusive = timezone.make_aware(
-            timezone.datetime.combine(to_date + timedelta(days=1), timezone.datetime.min.time()),
-            current_tz,
-        )
-
-        # Source of truth: modules whose completado_at falls in the range.
-        # This covers both flows: modules finished via mesa queues and
-        # modules marked completed from the admin detail (which may or
-        # may not have MesaQueueItem rows attached).
-        modulos_qs = (
-            Modulo.objects
-            .select_related('proyecto')
-            .prefetch_related('detalles_fase')
-            .filter(completado_at__isnull=False,
-                    completado_at__gte=from_dt,
-                    completado_at__lt=to_dt_exclusive)
-        )
+        # Source of truth: the ProduccionDiaria rollup, kept up to date as
+        # modules complete (see api.services.refresh_produccion_diaria).
+        # Covers both flows: modules finished via mesa queues and modules
+        # marked completed from the admin detail.
+        rollups = ProduccionDiaria.objects.filter(fecha__gte=from_date, fecha__lte=to_date)
         if proyecto_id:
-            modulos_qs = modulos_qs.filter(proyecto_id=proyecto_id)
+            rollups = rollups.filter(proyecto_id=proyecto_id)
         if not _is_admin(request.user):
-            modulos_qs = modulos_qs.filter(proyecto__usuario=request.user)
-
-        modulos_list = list(modulos_qs)
-        modulos_completados = len(modulos_list)
+            rollups = rollups.filter(proyecto__usuario=request.user)
 
         # Dificultad normalization: mean -> 100 so every UI surface
         # speaks the same language ("relative to the average module").
-        fallback = []
-        for m in modulos_list:
-            fallback.extend(m.detalles_fase.all())
-        dificultad_scale = _compute_dificultad_scale(
-            request.user, fallback_detalles=fallback, proyecto_id=proyecto_id
-        )
+        dificultad_scale = _compute_dificultad_scale(request.user, proyecto_id=proyecto_id)
 
-        # Build a lookup of MesaQueueItem HECHO for the same (modulo, fase)
-        # so we can attribute phases to their mesa when available, and a
-        # fallback map from modulo id -> GrupoMesas id so we can guess the
-        # right mesa for phases that never went through a queue.
-        modulo_ids = [m.id for m in modulos_list]
-        item_by_modulo_fase = {}
-        grupo_mesas_by_modulo = {}
-        if modulo_ids:
-            mesa_items_qs = (
-                MesaQueueItem.objects
-                .select_related('mesa')
-                .filter(modulo_id__in=modulo_ids, status=MesaQueueStatus.HECHO)
-            )
-            for it in mesa_items_qs:
-                item_by_modulo_fase[(it.modulo_id, it.fase)] = it
-                if it.mesa and it.mesa.grupo_id:
-                    grupo_mesas_by_modulo.setdefault(it.modulo_id, it.mesa.grupo_id)
-
-        # For modulos that never went through a mesa queue (seeded demo
-        # data, admin-only completions, or projects already drained
-        # from the cola) we still want them on a mesa row. Try several
-        # sources in order: the project's current cola, any bastidor
-        # already reserved to a grupo, and finally any grupo owned by
-        # the project's user.
-        proyecto_ids_in_scope = {m.proyecto_id for m in modulos_list}
-        proyecto_to_grupo: dict = {}
-        if proyecto_ids_in_scope:
-            cola_qs = GrupoMesasProyecto.objects.filter(
-                proyecto_id__in=proyecto_ids_in_scope,
-            ).order_by('proyecto_id', 'orden', 'id')
-            for entry in cola_qs:
-                proyecto_to_grupo.setdefault(entry.proyecto_id, entry.grupo_mesas_id)
-
-        # Bastidor reservation falls back second — once a bastidor is
-        # stamped with asignado_a, it keeps pointing at its owner grupo
-        # even after the project has drained from that grupo's cola.
-        reservation_by_modulo: dict = {}
-        if proyecto_ids_in_scope:
-            bastidor_rows = Modulo.objects.filter(
-                id__in=[m.id for m in modulos_list],
-                grupo_bastidor__asignado_a__isnull=False,
-            ).values_list('id', 'grupo_bastidor__asignado_a_id')
-            for modulo_id, grupo_id in bastidor_rows:
-                reservation_by_modulo[modulo_id] = grupo_id
-
-        # Last resort: first grupo operativo of the project's user.
-        proyecto_usuario_map = {
-            p.id: p.usuario_id
-            for p in Proyecto.objects.filter(id__in=proyecto_ids_in_scope)
+        sums = {
+            'modulos_completados': Sum('modulos_completados'),
+            'fases_completadas': Sum('fases_completadas'),
+            'dificultad_raw': Sum('dificultad_raw'),
+            **{field: Sum(field) for field in PRODUCCION_DECIMAL_FIELDS + PRODUCCION_COUNT_FIELDS},
         }
-        usuario_to_first_grupo: dict = {}
-        usuarios_needed = {uid for uid in proyecto_usuario_map.values() if uid}
-        if usuarios_needed:
-            for grupo in GrupoMesas.objects.filter(
-                usuario_id__in=usuarios_needed
-            ).order_by('usuario_id', 'nombre'):
-                usuario_to_first_grupo.setdefault(grupo.usuario_id, grupo.id)
-
-        for m in modulos_list:
-            if m.id in grupo_mesas_by_modulo:
-                continue
-            grupo = proyecto_to_grupo.get(m.proyecto_id)
-            if grupo is None:
-                grupo = reservation_by_modulo.get(m.id)
-            if grupo is None:
-                usuario_id = proyecto_usuario_map.get(m.proyecto_id)
-                if usuario_id is not None:
-                    grupo = usuario_to_first_grupo.get(usuario_id)
-            if grupo is not None:
-                grupo_mesas_by_modulo[m.id] = grupo
-
-        # Cache: GrupoMesas id -> {rol: Mesa} so we can attribute orphan
-        # phases to the right mesa in the same group.
-        grupo_mesa_by_rol: dict = {}
-        grupo_ids_needed = set(grupo_mesas_by_modulo.values())
-        if grupo_ids_needed:
-            for mesa in Mesa.objects.filter(grupo_id__in=grupo_ids_needed):
-                grupo_mesa_by_rol.setdefault(mesa.grupo_id, {})[mesa.rol] = mesa
-
-        def _rol_for_fase(fase, modulo):
-            # INFERIOR phases split between INF1 and INF2 based on the
-            # bastidor group parity (odd -> INF1, even -> INF2). Matches
-            # how the planner already distributes bastidores.
-            if fase == 'SUPERIOR':
-                return ['SUPERIORES']
-            gb = getattr(modulo, 'grupo_bastidor', None)
-            if gb is not None and gb.indice % 2 == 0:
-                return ['INFERIOR_2', 'INFERIOR_1']
-            return ['INFERIOR_1', 'INFERIOR_2']
-
-        def empty_totals():
+
+        def totals_from(row):
             return {
-                'fases_completadas': 0,
-                'peso_malla_inicial_kg': 0.0,
-                'peso_malla_final_kg': 0.0,
-                'desperdicio_kg': 0.0,
-                'cantidad_cortes': 0,
-                'cantidad_refuerzos': 0,
-                'cantidad_zunchos': 0,
-                'cantidad_separadores': 0,
-                'cantidad_punzos': 0,
-                'dificultad_total': 0.0,
+                'fases_completadas': row['fases_completadas'] or 0,
+                **{field: float(row[field] or 0) for field in PRODUCCION_DECIMAL_FIELDS},
+                **{field: row[field] or 0 for field in PRODUCCION_COUNT_FIELDS},
+                'dificultad_total': float(row['dificultad_raw'] or 0) * dificultad_scale,
             }
 
-        def add_detalle(target, detalle):
-            target['fases_completadas'] += 1
-            if detalle is None:
-                return
-            if detalle.peso_malla_inicial_kg is not None:
-                target['peso_malla_inicial_kg'] += float(detalle.peso_malla_inicial_kg)
-            if detalle.peso_malla_final_kg is not None:
-                target['peso_malla_final_kg'] += float(detalle.peso_malla_final_kg)
-            if detalle.desperdicio_kg is not None:
-                target['desperdicio_kg'] += float(detalle.desperdicio_kg)
-            target['cantidad_cortes'] += detalle.cantidad_cortes or 0
-            target['cantidad_refuerzos'] += detalle.cantidad_refuerzos or 0
-            target['cantidad_zunchos'] += detalle.cantidad_zunchos or 0
-            target['cantidad_separadores'] += detalle.cantidad_separadores or 0
-            target['cantidad_punzos'] += detalle.cantidad_punzos or 0
-            target['dificultad_total'] += _compute_dificultad(detalle) * dificultad_scale
-
-        totals = empty_totals()
-        por_mesa = {}
-        por_dia = {}
-
-        # Each completed module contributes its INF + SUP phases to the
-        # aggregated stats. For per-mesa break-down we look up the
-        # matching MesaQueueItem; if not present, phases are attributed
-        # to a synthetic "Manual" bucket (no mesa id).
-        for modulo in modulos_list:
-            dia_key = timezone.localtime(modulo.completado_at, current_tz).date().isoformat()
-            if dia_key not in por_dia:
-                por_dia[dia_key] = {'fecha': dia_key, 'modulos_completados': 0, **empty_totals()}
-            por_dia[dia_key]['modulos_completados'] += 1
-
-            for detalle in modulo.detalles_fase.all():
-                add_detalle(totals, detalle)
-                add_detalle(por_dia[dia_key], detalle)
-
-                it = item_by_modulo_fase.get((modulo.id, detalle.fase))
-                if it is not None:
-                    mesa_key = it.mesa_id
-                    if mesa_key not in por_mesa:
-                        por_mesa[mesa_key] = {
-                            'mesa_id': mesa_key,
-                            'mesa_nombre': it.mesa.nombre,
-                            'rol': it.mesa.rol,
-                            **empty_totals(),
-                        }
-                    add_detalle(por_mesa[mesa_key], detalle)
-                    continue
+        por_dia = [
+            {
+                'fecha': row['fecha'].isoformat(),
+                'modulos_completados': row['modulos_completados'] or 0,
+                **totals_from(row),
+            }
+            for row in rollups.values('fecha').annotate(**sums).order_by('fecha')
+        ]
+        modulos_completados = sum(dia['modulos_completados'] for dia in por_dia)
+        totals = {
+            'fases_completadas': sum(dia['fases_completadas'] for dia in por_dia),
+            **{
+                field: sum(dia[field] for dia in por_dia)
+                for field in PRODUCCION_DECIMAL_FIELDS + PRODUCCION_COUNT_FIELDS + ('dificultad_total',)
+            },
+        }
 
-                # Fallback: use any mesa in the same group with the right
-                # role for this fase. Keeps 'manual' completions visible
-                # on the correct mesa instead of a LEGACY bucket.
-                fallback_mesa = None
-                grupo_id = grupo_mesas_by_modulo.get(modulo.id)
-                if grupo_id:
-                    group_roles = grupo_mesa_by_rol.get(grupo_id, {})
-                    for rol_candidate in _rol_for_fase(detalle.fase, modulo):
-                        if rol_candidate in group_roles:
-                            fallback_mesa = group_roles[rol_candidate]
-                            break
-                if fallback_mesa is not None:
-                    mesa_key = fallback_mesa.id
-                    if mesa_key not in por_mesa:
-                        por_mesa[mesa_key] = {
-                            'mesa_id': mesa_key,
-                            'mesa_nombre': fallback_mesa.nombre,
-                            'rol': fallback_mesa.rol,
-                            **empty_totals(),
-                        }
-                    add_detalle(por_mesa[mesa_key], detalle)
-                else:
-                    manual_key = f'sin-mesa-{detalle.fase}'
-                    if manual_key not in por_mesa:
-                        por_mesa[manual_key] = {
-                            'mesa_id': None,
-                            'mesa_nombre': f'Sin mesa asignada ({detalle.fase})',
-                            'rol': detalle.fase,
-                            **empty_totals(),
-                        }
-                    add_detalle(por_mesa[manual_key], detalle)
+        # Phases without an attributable mesa go to a synthetic
+        # "Sin mesa asignada" bucket per fase.
+        mesa_rows = list(rollups.exclude(fase='').values('mesa_id', 'fase').annotate(**sums))
+        mesas = Mesa.objects.in_bulk({row['mesa_id'] for row in mesa_rows if row['mesa_id']})
+        por_mesa = {}
+        for row in mesa_rows:
+            mesa = mesas.get(row['mesa_id'])
+            if mesa is not None:
+                key = mesa.id
+                bucket = {'mesa_id': mesa.id, 'mesa_nombre': mesa.nombre, 'rol': mesa.rol}
+            else:
+                key = f"sin-mesa-{row['fase']}"
+                bucket = {
+                    'mesa_id': None,
+                    'mesa_nombre': f"Sin mesa asignada ({row['fase']})",
+                    'rol': row['fase'],
+                }
+            if key not in por_mesa:
+                por_mesa[key] = {**bucket, **totals_from(row)}
+                continue
+            # A mesa can carry both fases (e.g. LEGACY mesas).
+            for field, value in totals_from(row).items():
+                por_mesa[key][field] += value
 
         # Expected output for the range. Stats are per ferralla, so the
         # capacity comes from the logged user's profile. Admins with an
@@ -2210,7 +1754,7 @@ class ProductionStatsView(APIView):
                 **totals,
             },
             'por_mesa': sorted(por_mesa.values(), key=lambda x: (x['rol'], x['mesa_nombre'])),
-            'por_dia': sorted(por_dia.values(), key=lambda x: x['fecha']),
+            'por_dia': por_dia,
             'esperado': {
                 'capacidad_diaria_modulos': capacidad_diaria,
                 'modulos_esperados': capacidad_diaria * working_days,
@@ -2444,6 +1988,7 @@ class DeviceViewSet(viewsets.ViewSet):
                 # Also copy the token hash to mesa for future auth
                 session.mesa.device_token_hash = session.device_token_hash
                 session.mesa.save(update_fields=['device_token_hash'])
+                device_token_cache.invalidate_mesa(session.mesa.id)
                 return Response({'status': 'PAIRED', 'device_token': token, 'mesa_id': session.mesa.id})
             
             return Response({'status': 'PAIRED', 'mesa_id': session.mesa.id})  # Token already retrieved
@@ -2505,6 +2050,7 @@ class DeviceViewSet(viewsets.ViewSet):
         mesa.pairing_code = None
         mesa.pairing_code_expires_at = None
         mesa.save(update_fields=['device_token_hash', 'last_error', 'pairing_code', 'pairing_code_expires_at'])
+        device_token_cache.invalidate_mesa(mesa.id)
         
         # If using session, save token hash there too so status check knows it's done
         if 'session' in locals() and session:
@@ -2539,28 +2085,10 @@ class DeviceViewSet(viewsets.ViewSet):
         mesa.pairing_code = None
         mesa.last_error = None
         mesa.save(update_fields=['device_token_hash', 'pairing_code', 'last_error'])
+        device_token_cache.invalidate_mesa(mesa.id)
         
         return Response({'status': 'ok'})
 
-    @action(detail=False, methods=['post'])
-    def heartbeat(self, request):
-        mesa = self._authenticate_device(request)
-        if not mesa:
-            return Response({'detail': 'Unauthorized'}, status=401)
-            
-        from api.serializers import DeviceHeartbeatSerializer
-        from django.utils import timezone
-        
-        serializer = DeviceHeartbeatSerializer(data=request.data)
-        if serializer.is_valid():
-            # Update generic stats
-            mesa.last_seen = timezone.now()
-            # Could save other stats if model supports it
-            mesa.save(update_fields=['last_seen'])
-            
-        return Response({'status': 'ok'})
-
-
     @action(detail=False, methods=['post'])
     def toggle_mapper(self, request):
         """
@@ -2569,7 +2097,9 @@ class DeviceViewSet(viewsets.ViewSet):
         mesa = self._authenticate_device(request)
         if not mesa:
             return Response({'detail': 'Unauthorized'}, status=401)
-            
+
+        from api.device import load_mesa_fields
+        load_mesa_fields(mesa, ['mapper_enabled'])
         mesa.mapper_enabled = not mesa.mapper_enabled
         mesa.save(update_fields=['mapper_enabled'])
         return Response({'status': 'ok', 'mapper_enabled': mesa.mapper_enabled})
@@ -2595,93 +2125,6 @@ class DeviceViewSet(viewsets.ViewSet):
             return Response({'status': 'ok', 'index': mesa.current_image_index})
         return Response({'detail': 'Index required'}, status=400)
 
-    @action(detail=False, methods=['get'], renderer_classes=[ServerSentEventRenderer])
-    def stream(self, request):
-        """
-        Server-Sent Events (SSE) stream for real-time updates.
-        """
-        mesa = self._authenticate_device(request)
-        if not mesa:
-            return Response({'detail': 'Unauthorized'}, status=401)
-            
-        import time
-        import json
-        from django.http import StreamingHttpResponse
-        
-        def event_stream():
-            last_check = mesa.ultima_actualizacion
-            
-            # Send initial state immediately
-            initial_data = {
-                'type': 'calibration',
-                'data': {
-                    'corners': mesa.calibration_json.get('corners') if mesa.calibration_json else None,
-                    'mapper_enabled': mesa.mapper_enabled,
-                    'current_image_index': mesa.current_image_index
-                }
-            }
-            yield f"data: {json.dumps(initial_data)}\n\n"
-            
-            last_ping = time.time()
-            
-            while True:
-                # Refresh from DB to check for updates
-                mesa.refresh_from_db()
-                
-                if mesa.ultima_actualizacion > last_check:
-                    last_check = mesa.ultima_actualizacion
-                    payload = {
-                        'type': 'calibration',
-                        'data': {
-                            'corners': mesa.calibration_json.get('corners') if mesa.calibration_json else None,
-                            'mapper_enabled': mesa.mapper_enabled,
-                            'current_image_index': mesa.current_image_index
-                        }
-                    }
-                    yield f"data: {json.dumps(payload)}\n\n"
-                
-                # Keep-Alive
-                now = time.time()
-                if now - last_ping > 15:
-                    yield ": keep-alive\n\n"
-                    last_ping = now
-
-                # Check updates at a lower rate to reduce DB pressure
-                time.sleep(1.0)
-
-        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-        response['Cache-Control'] = 'no-cache'
-        response['X-Accel-Buffering'] = 'no'  # Disable Nginx buffering
-        return response
-
-    @action(detail=False, methods=['get'])
-    def current_item(self, request):
-        """
-        Device-friendly current item endpoint.
-        Returns current MOSTRANDO item plus preloaded image list for that modulo/fase.
-        """
-        mesa = self._authenticate_device(request)
-        if not mesa:
-            return Response({'detail': 'Unauthorized'}, status=401)
-
-        from api.models import MesaQueueStatus
-
-        item = mesa.queue_items.select_related(
-            'modulo', 'imagen', 'mesa', 'modulo__planta', 'modulo__planta__proyecto'
-        ).filter(status=MesaQueueStatus.MOSTRANDO).first()
-
-        if not item:
-            return Response(None)
-
-        item_data = MesaQueueItemSerializer(item, context={'request': request}).data
-        images = Imagen.objects.filter(
-            modulo_id=item.modulo_id,
-            fase=item.fase,
-            activo=True
-        ).order_by('orden')
-        item_data['images'] = ImagenSerializer(images, many=True, context={'request': request}).data
-        return Response(item_data)
-
     @action(detail=False, methods=['post'])
     def mark_done(self, request):
         """
@@ -2692,26 +2135,18 @@ class DeviceViewSet(viewsets.ViewSet):
         if not mesa:
             return Response({'detail': 'Unauthorized'}, status=401)
 
-        from api.models import MesaQueueStatus
+        from api.device import queue_item_payload
+        from api.services import advance_mesa_queue
 
-        current_item = mesa.queue_items.filter(status=MesaQueueStatus.MOSTRANDO).first()
-        if not current_item:
+        result = advance_mesa_queue(mesa.id)
+        if result.item is None:
             return Response({'detail': 'No item currently showing'}, status=404)
 
-        current_item.marcar_hecho(user=None)
-
-        next_item = mesa.queue_items.filter(status=MesaQueueStatus.EN_COLA).order_by('position').first()
-        if next_item:
-            next_item.status = MesaQueueStatus.MOSTRANDO
-            next_item.save(update_fields=['status'])
-            mesa.imagen_actual = next_item.imagen
-            mesa.current_image_index = 0
-        else:
-            mesa.imagen_actual = None
-            mesa.current_image_index = 0
-        mesa.save(update_fields=['imagen_actual', 'current_image_index'])
-
-        return Response({'status': 'ok'})
+        # El player recibe directamente el nuevo item en pantalla (sin otro current_item).
+        return Response({
+            'status': 'ok',
+            'current_item': queue_item_payload(result.next_item, request),
+        })
 
     @action(detail=False, methods=['post'])
     def upload_foto(self, request):
@@ -2805,16 +2240,6 @@ class DeviceViewSet(viewsets.ViewSet):
         serializer = FotoFabricacionSerializer(foto)
         return Response(serializer.data, status=201)
 
-    @action(detail=False, methods=['get'])
-    def state(self, request):
-        mesa = self._authenticate_device(request)
-        if not mesa:
-            return Response({'detail': 'Unauthorized'}, status=401)
-
-        from api.serializers import MesaStateSerializer
-        serializer = MesaStateSerializer(mesa)
-        return Response(serializer.data)
-        
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def revoke(self, request):
         # Admin action (normally authenticated, for PoC maybe just open or requires Secret)
@@ -2841,27 +2266,15 @@ class DeviceViewSet(viewsets.ViewSet):
             mesa.pairing_code = None
             mesa.last_error = None
             mesa.save()
+            device_token_cache.invalidate_mesa(mesa.id)
             return Response({'status': 'revoked'})
         except Mesa.DoesNotExist:
             return Response({'detail': 'Mesa not found'}, status=404)
 
     def _authenticate_device(self, request):
-        """Helper to validate Bearer token against hashes."""
-        import hashlib
-        auth_header = request.headers.get('Authorization')
-        token = None
-        
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-        elif request.query_params.get('token'):
-            token = request.query_params.get('token')
-            
-        if not token or token.lower() in ['undefined', 'null', '']:
-            return None
-            
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
-        
-        return Mesa.objects.filter(device_token_hash=token_hash).first()
+        """Helper to validate Bearer token against hashes (cached, see api.device)."""
+        from api.device import authenticate_device
+        return authenticate_device(request)
 
 
 class MesaQueueItemViewSet(viewsets.ModelViewSet):
@@ -2965,58 +2378,22 @@ class MesaQueueItemViewSet(viewsets.ModelViewSet):
             raise ValidationError(str(exc))
 
     def perform_destroy(self, instance):
-        from api.models import MesaQueueStatus
-        mesa = instance.mesa
-        was_mostrando = (instance.status == MesaQueueStatus.MOSTRANDO)
-        
-        # Perform deletion
-        instance.delete()
-        
-        # If we deleted the active item, promote the next one
-        if was_mostrando:
-            next_item = MesaQueueItem.objects.filter(
-                mesa=mesa,
-                status=MesaQueueStatus.EN_COLA
-            ).order_by('position').first()
-            
-            if next_item:
-                next_item.status = MesaQueueStatus.MOSTRANDO
-                next_item.save(update_fields=['status'])
-                mesa.imagen_actual = next_item.imagen
-                mesa.current_image_index = 0
-                mesa.save(update_fields=['imagen_actual', 'current_image_index'])
-            else:
-                # No more items, clear projection
-                mesa.imagen_actual = None
-                mesa.current_image_index = 0
-                mesa.save(update_fields=['imagen_actual', 'current_image_index'])
+        from api.services import advance_mesa_queue
+        # Borra y, si era el item en pantalla, promociona el siguiente.
+        advance_mesa_queue(instance.mesa_id, item_id=instance.pk, delete=True)
 
     @action(detail=True, methods=['post'])
     def marcar_hecho(self, request, pk=None):
         """Mark a work item as done."""
+        from api.services import advance_mesa_queue
         item = self.get_object()
-        from api.models import MesaQueueStatus
-
-        previous_status = item.status
-        mesa = item.mesa
-        item.marcar_hecho(user=request.user)
 
         # Auto-advance only if the item was currently showing.
-        if previous_status == MesaQueueStatus.MOSTRANDO:
-            next_item = MesaQueueItem.objects.filter(
-                mesa=mesa,
-                status=MesaQueueStatus.EN_COLA
-            ).order_by('position').first()
-
-            if next_item:
-                next_item.status = MesaQueueStatus.MOSTRANDO
-                next_item.save(update_fields=['status'])
-                mesa.imagen_actual = next_item.imagen
-                mesa.current_image_index = 0
-            else:
-                mesa.imagen_actual = None
-                mesa.current_image_index = 0
-            mesa.save(update_fields=['imagen_actual', 'current_image_index'])
+        result = advance_mesa_queue(item.mesa_id, item_id=item.pk, user=request.user)
+        if result.item is not None:
+            item.status = result.item.status
+            item.done_at = result.item.done_at
+            item.done_by = result.item.done_by
 
         serializer = self.get_serializer(item)
         return Response(serializer.data)
@@ -3027,6 +2404,7 @@ class MesaQueueItemViewSet(viewsets.ModelViewSet):
         from api.models import MesaQueueStatus
         item = self.get_object()
         # Unset any other MOSTRANDO items for this desk
+        # (item.save() y mesa.save() de abajo ya suben Mesa.version).
         MesaQueueItem.objects.filter(
             mesa=item.mesa,
             status=MesaQueueStatus.MOSTRANDO
@@ -3154,58 +2532,133 @@ class FotoFabricacionViewSet(viewsets.ReadOnlyModelViewSet):
         Query params: ?proyecto=ID or ?planta=ID or ?modulo=ID
         ZIP name uses the entity name; internal structure excludes the
         top-level folder (Windows "Extract All" creates it from the ZIP name).
+
+        The archive is streamed (ZIP_STORED, see api.zipstream): constant
+        memory, known Content-Length and resumable with Range/If-Range.
+        With ?async=1 the job worker writes it to disk and the job result
+        carries its download URL.
         """
         import os
-        import zipfile
-        import io
         from django.conf import settings as django_settings
-        from django.http import HttpResponse
+        from django.http import HttpResponse, StreamingHttpResponse
+        from api.ranges import (
+            RangeNotSatisfiable, etag_matches, if_range_matches, parse_byte_range,
+        )
+        from api.streaming import streaming_body
+        from api.zipstream import ZipStream
 
         proyecto_id = request.query_params.get('proyecto')
         planta_id = request.query_params.get('planta')
         modulo_id = request.query_params.get('modulo')
 
-        fotos = self.get_queryset()
+        fotos = self.get_queryset().select_related('modulo__proyecto', 'modulo__planta')
 
-        if not fotos.exists():
+        files = []
+        zip_entity_name = None
+        for foto in fotos:
+            proyecto_nombre = foto.modulo.proyecto.nombre if foto.modulo.proyecto else 'sin_proyecto'
+            planta_nombre = foto.modulo.planta.nombre if foto.modulo.planta else 'sin_planta'
+            modulo_nombre = foto.modulo.nombre
+            filename = os.path.basename(foto.url)
+
+            # Adapt folder structure to download scope.
+            # The top-level entity name becomes the ZIP filename
+            # (Windows "Extract All" creates a folder from the ZIP name).
+            if modulo_id:
+                archive_path = filename
+                if not zip_entity_name:
+                    zip_entity_name = modulo_nombre
+            elif planta_id:
+                archive_path = f"{modulo_nombre}/{filename}"
+                if not zip_entity_name:
+                    zip_entity_name = planta_nombre
+            else:
+                archive_path = f"{planta_nombre}/{modulo_nombre}/{filename}"
+                if not zip_entity_name:
+                    zip_entity_name = proyecto_nombre
+
+            # Resolve actual file on disk
+            relative_path = foto.url.lstrip('/')
+            if relative_path.startswith('media/'):
+                relative_path = relative_path[len('media/'):]
+            files.append((archive_path, os.path.join(django_settings.MEDIA_ROOT, relative_path)))
+
+        if not files:
             return Response({'detail': 'No photos found'}, status=404)
 
-        buffer = io.BytesIO()
-        zip_entity_name = None
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for foto in fotos:
-                proyecto_nombre = foto.modulo.proyecto.nombre if foto.modulo.proyecto else 'sin_proyecto'
-                planta_nombre = foto.modulo.planta.nombre if foto.modulo.planta else 'sin_planta'
-                modulo_nombre = foto.modulo.nombre
-                filename = os.path.basename(foto.url)
-
-                # Adapt folder structure to download scope.
-                # The top-level entity name becomes the ZIP filename
-                # (Windows "Extract All" creates a folder from the ZIP name).
-                if modulo_id:
-                    archive_path = filename
-                    if not zip_entity_name:
-                        zip_entity_name = modulo_nombre
-                elif planta_id:
-                    archive_path = f"{modulo_nombre}/{filename}"
-                    if not zip_entity_name:
-                        zip_entity_name = planta_nombre
-                else:
-                    archive_path = f"{planta_nombre}/{modulo_nombre}/{filename}"
-                    if not zip_entity_name:
-                        zip_entity_name = proyecto_nombre
-
-                # Resolve actual file on disk
-                relative_path = foto.url.lstrip('/')
-                if relative_path.startswith('media/'):
-                    relative_path = relative_path[len('media/'):]
-                file_path = os.path.join(django_settings.MEDIA_ROOT, relative_path)
-                if os.path.exists(file_path):
-                    zf.write(file_path, archive_path)
-
-        buffer.seek(0)
-        response = HttpResponse(buffer.read(), content_type='application/zip')
+        if zip_entity_name:
+            # Los nombres son libres: sin separadores de ruta en el adjunto.
+            zip_entity_name = zip_entity_name.replace('/', '-').replace('\\', '-')
         dl_name = f'{zip_entity_name}.zip' if zip_entity_name else 'fotos.zip'
+        if _wants_async(request):
+            from api.jobs import enqueue_job
+            job = enqueue_job('download_zip', request.user, {'entries': files, 'filename': dl_name})
+            return _job_accepted(job)
 
+        archive = ZipStream(files)
+        etag = archive.etag
+
+        if etag_matches(request, etag):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        byte_range = None
+        if if_range_matches(request, etag):
+            try:
+                byte_range = parse_byte_range(request.headers.get('Range'), archive.size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{archive.size}'
+                return response
+
+        if byte_range is None:
+            response = StreamingHttpResponse(
+                streaming_body(request, archive.iter_range()), content_type='application/zip',
+            )
+            response['Content-Length'] = str(archive.size)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                streaming_body(request, archive.iter_range(start, end)),
+                content_type='application/zip', status=206,
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{archive.size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
         response['Content-Disposition'] = f'attachment; filename="{dl_name}"'
         return response
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Trabajos en segundo plano (ver api.jobs). Consultar ``/api/jobs/<id>/``
+    hasta que ``estado`` sea COMPLETADO o ERROR; ``resultado`` es la respuesta
+    del endpoint original.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Job.objects.all().order_by('-created_at')
+        if not _is_admin(self.request.user):
+            queryset = queryset.filter(usuario=self.request.user)
+        estado = self.request.query_params.get('estado')
+        if estado:
+            queryset = queryset.filter(estado=estado)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Fichero generado por el trabajo (ZIP de fotos)."""
+        from django.http import Http404
+        from api.jobs import RESULT_FILENAME, job_dir
+        from api.streaming import file_download
+
+        job = self.get_object()
+        filename = (job.resultado or {}).get('filename') if job.estado == JobEstado.COMPLETADO else None
+        path = job_dir(job.pk, 'result', RESULT_FILENAME) if filename else None
+        if not path or not os.path.isfile(path):
+            raise Http404('El trabajo no tiene fichero de resultado')
+        return file_download(request, path, filename)
@@ -0,0 +1,294 @@
+"""
+ZIP en streaming (sin compresion) con soporte de rangos.
+
+Las fotos de fabricacion son JPEG: comprimirlas no reduce nada y obliga a
+construir el archivo entero en memoria. Aqui las entradas se guardan con
+``ZIP_STORED`` y el archivo se calcula de antemano a partir de ``os.stat``,
+de modo que:
+
+- el tamano total se conoce antes de leer nada (``Content-Length``),
+- cualquier byte del archivo se puede generar de forma independiente
+  (``Range`` para reanudar descargas),
+- la memoria usada es la de un bloque de lectura, no la del archivo.
+
+El CRC32 de cada fichero va en un *data descriptor* tras sus datos (bit 3),
+asi no hay que leer el fichero antes de emitir su cabecera. Se usa ZIP64 por
+entrada y al final solo cuando los tamanos u offsets lo requieren.
+"""
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+
+_FLAGS = 0x0008 | 0x0800  # data descriptor + nombres UTF-8
+_VERSION_ZIP = 20
+_VERSION_ZIP64 = 45
+_MADE_BY_UNIX = 3 << 8  # para que los permisos de external_attr tengan sentido
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<IIQI')
+
+
+class _CrcCache:
+    """CRC32 ya calculados por (ruta, tamano, mtime): reanudar no relee todo."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+crc_cache = _CrcCache()
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class _Entry:
+    __slots__ = ('name', 'path', 'size', 'mtime_ns', 'dos_time', 'dos_date', 'offset', 'zip64', 'crc')
+
+    def __init__(self, name, path, stat):
+        self.name = name.encode('utf-8')
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.dos_time, self.dos_date = _dos_datetime(stat.st_mtime)
+        self.offset = 0
+        self.zip64 = False
+        self.crc = crc_cache.get(self.cache_key)
+
+    @property
+    def cache_key(self):
+        return (self.path, self.size, self.mtime_ns)
+
+    def local_header(self):
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            sizes = _ZIP32_LIMIT
+            version = _VERSION_ZIP64
+        else:
+            extra = b''
+            sizes = 0
+            version = _VERSION_ZIP
+        return _LOCAL_HEADER.pack(
+            0x04034b50, version, _FLAGS, 0, self.dos_time, self.dos_date,
+            0, sizes, sizes, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self):
+        if self.zip64:
+            extra = struct.pack('<HHQQQ', 0x0001, 24, self.size, self.size, self.offset)
+            size = offset = _ZIP32_LIMIT
+            version = _VERSION_ZIP64
+        else:
+            extra = b''
+            size, offset = self.size, self.offset
+            version = _VERSION_ZIP
+        return _CENTRAL_HEADER.pack(
+            0x02014b50, _MADE_BY_UNIX | version, version, _FLAGS, 0, self.dos_time, self.dos_date,
+            self.crc, size, size, len(self.name), len(extra), 0, 0, 0,
+            0o100644 << 16, offset,
+        ) + self.name + extra
+
+    def central_size(self):
+        return 46 + len(self.name) + (28 if self.zip64 else 0)
+
+
+class ZipStream:
+    """
+    Archivo ZIP virtual a partir de ``[(nombre_en_zip, ruta_en_disco), ...]``.
+
+    Las rutas que no existen se omiten (igual que hacia la descarga antigua).
+    ``size`` y ``etag`` estan disponibles sin leer los ficheros;
+    ``iter_range(start, end)`` genera los bytes ``[start, end]``.
+    """
+
+    def __init__(self, files):
+        self.entries = []
+        seen = set()
+        for name, path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Nombres repetidos: el segundo pisaria al primero al extraer.
+            base, ext = os.path.splitext(name)
+            unique, n = name, 1
+            while unique in seen:
+                unique = f"{base} ({n}){ext}"
+                n += 1
+            seen.add(unique)
+            self.entries.append(_Entry(unique, path, stat))
+        self._layout()
+
+    def _layout(self):
+        offset = 0
+        # Partes consecutivas: (inicio, longitud, tipo, entrada)
+        self._parts = []
+        for entry in self.entries:
+            entry.offset = offset
+            entry.zip64 = entry.size >= _ZIP32_LIMIT or offset >= _ZIP32_LIMIT
+            header = entry.local_header()
+            for kind, length in (
+                ('static', len(header)),
+                ('data', entry.size),
+                ('descriptor', entry.descriptor_size()),
+            ):
+                self._parts.append((offset, length, kind, entry if kind != 'static' else header))
+                offset += length
+
+        self._central_offset = offset
+        self._central_size = sum(entry.central_size() for entry in self.entries)
+        self._zip64_end = (
+            any(entry.zip64 for entry in self.entries)
+            or len(self.entries) >= _ZIP16_LIMIT
+            or self._central_offset >= _ZIP32_LIMIT
+            or self._central_size >= _ZIP32_LIMIT
+        )
+        tail_size = self._central_size + _END_RECORD.size
+        if self._zip64_end:
+            tail_size += _ZIP64_END_RECORD.size + _ZIP64_LOCATOR.size
+        self._parts.append((offset, tail_size, 'tail', None))
+        self.size = offset + tail_size
+
+    @property
+    def etag(self):
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(entry.name)
+            digest.update(f"\0{entry.size}\0{entry.mtime_ns}\0".encode())
+        return f'"zip-{digest.hexdigest()[:32]}"'
+
+    # -- generacion ----------------------------------------------------------
+
+    def _ensure_crc(self, entry):
+        if entry.crc is None:
+            crc = 0
+            for chunk in self._read(entry, 0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+            entry.crc = crc
+            crc_cache.put(entry.cache_key, crc)
+        return entry.crc
+
+    def _read(self, entry, start, length):
+        """Bytes ``[start, start+length)`` del fichero; rellena con ceros si encogio."""
+        remaining = length
+        try:
+            with open(entry.path, 'rb') as fh:
+                fh.seek(start)
+                while remaining > 0:
+                    chunk = fh.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        except OSError:
+            logger.exception("[ZIP] No se pudo leer %s", entry.path)
+        if remaining > 0:
+            logger.warning("[ZIP] %s cambio de tamano durante la descarga", entry.path)
+            while remaining > 0:
+                pad = min(CHUNK_SIZE, remaining)
+                remaining -= pad
+                yield b'\0' * pad
+
+    def _data(self, entry, start, length):
+        if start == 0 and length == entry.size and entry.crc is None:
+            # Lectura completa: calcular el CRC de paso para el descriptor.
+            crc = 0
+            for chunk in self._read(entry, 0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            entry.crc = crc
+            crc_cache.put(entry.cache_key, crc)
+            return
+        yield from self._read(entry, start, length)
+
+    def _tail(self):
+        for entry in self.entries:
+            self._ensure_crc(entry)
+        chunks = [entry.central_header() for entry in self.entries]
+        count = len(self.entries)
+        if self._zip64_end:
+            zip64_end_offset = self._central_offset + self._central_size
+            chunks.append(_ZIP64_END_RECORD.pack(
+                0x06064b50, _ZIP64_END_RECORD.size - 12, _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, count, count, self._central_size, self._central_offset,
+            ))
+            chunks.append(_ZIP64_LOCATOR.pack(0x07064b50, 0, zip64_end_offset, 1))
+            chunks.append(_END_RECORD.pack(
+                0x06054b50, 0, 0,
+                min(count, _ZIP16_LIMIT), min(count, _ZIP16_LIMIT),
+                min(self._central_size, _ZIP32_LIMIT), min(self._central_offset, _ZIP32_LIMIT), 0,
+            ))
+        else:
+            chunks.append(_END_RECORD.pack(
+                0x06054b50, 0, 0, count, count, self._central_size, self._central_offset, 0,
+            ))
+        return b''.join(chunks)
+
+    def iter_range(self, start=0, end=None):
+        """Genera los bytes ``[start, end]`` (inclusivo) del archivo."""
+        if end is None:
+            end = self.size - 1
+        for part_start, length, kind, payload in self._parts:
+            part_end = part_start + length - 1
+            if length == 0 or part_end < start:
+                continue
+            if part_start > end:
+                break
+            lo = max(start, part_start) - part_start
+            hi = min(end, part_end) - part_start + 1
+            if kind == 'static':
+                yield payload[lo:hi]
+            elif kind == 'data':
+                yield from self._data(payload, lo, hi - lo)
+            elif kind == 'descriptor':
+                self._ensure_crc(payload)
+                yield payload.descriptor()[lo:hi]
+            else:
+                yield self._tail()[lo:hi]
+
+    def __iter__(self):
+        return self.iter_range()
@@ -3,14 +3,46 @@ ASGI config for proyeccion_moden project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Solo las vistas async (``api.async_views``: stream, heartbeat, state,
+current_item y bundle del player) se atienden con el handler ASGI de
+Django. El resto de la API es sincrona y va por la aplicacion WSGI en un
+pool de ``SYNC_API_THREADS`` hilos por worker (proyeccion_moden.wsgi_bridge),
+asi una peticion larga del dashboard no hace cola delante de las demas.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+from functools import lru_cache
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyeccion_moden.settings')
 
-application = get_asgi_application()
+django_asgi = get_asgi_application()
+
+from asgiref.sync import iscoroutinefunction  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.urls import Resolver404, resolve  # noqa: E402
+
+from proyeccion_moden.wsgi import application as wsgi_application  # noqa: E402
+from proyeccion_moden.wsgi_bridge import WsgiBridge  # noqa: E402
+
+sync_api = WsgiBridge(wsgi_application, settings.SYNC_API_THREADS)
+
+
+@lru_cache(maxsize=1024)
+def is_async_view(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    return iscoroutinefunction(match.func)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not is_async_view(scope['path']):
+        await sync_api(scope, receive, send)
+    else:
+        await django_asgi(scope, receive, send)
@@ -113,6 +113,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'proyeccion_moden.wsgi.application'
+ASGI_APPLICATION = 'proyeccion_moden.asgi.application'
+# Hilos por worker para la API sincrona bajo ASGI (proyeccion_moden.asgi):
+# el equivalente al --threads del gunicorn gthread.
+SYNC_API_THREADS = int(os.environ.get('SYNC_API_THREADS', 4))
 
 
 # Database
@@ -178,11 +182,22 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Entrega de /media/ (api.media.serve_media): 'x-accel' (nginx internal
+# location en MEDIA_ACCEL_PREFIX apuntando a MEDIA_ROOT) o 'x-sendfile'.
+# En produccion detras de nginx usar 'x-accel'. Vacio => el propio worker
+# envia el fichero por bloques (sin cargarlo entero, tambien bajo ASGI).
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
 
 # File upload settings for large imports
 DATA_UPLOAD_MAX_NUMBER_FILES = 10000  # Allow up to 10000 files per request
 DATA_UPLOAD_MAX_MEMORY_SIZE = 524288000  # 500MB in memory
 
+# Trabajos en segundo plano (api.jobs, manage.py run_jobs). Los ficheros
+# subidos con ?async=1 esperan aqui al worker: fuera de MEDIA_ROOT (no son
+# publicos) y en un disco compartido entre web y worker.
+JOB_FILES_ROOT = os.environ.get('JOB_FILES_ROOT', os.path.join(BASE_DIR, 'job_files'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,9 +1,7 @@
-from django.urls import include, path
-from django.conf import settings
-from django.conf.urls.static import static
+from django.urls import include, path, re_path
 from rest_framework import routers
 
-from api import views
+from api import async_views, media, views
 
 from django.contrib import admin
 
@@ -22,12 +20,19 @@ router.register(r"mesa-queue-items", views.MesaQueueItemViewSet)
 router.register(r"device", views.DeviceViewSet, basename="device")
 router.register(r"fotos", views.FotoFabricacionViewSet)
 router.register(r"grupos-bastidor", views.GrupoBastidorViewSet)
+router.register(r"jobs", views.JobViewSet, basename="job")
 
 from rest_framework.authtoken import views as drf_views
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
+    # Endpoints async del player (ASGI); van antes del router para tener prioridad.
+    path("api/device/stream/", async_views.device_stream, name="device-stream"),
+    path("api/device/heartbeat/", async_views.device_heartbeat, name="device-heartbeat"),
+    path("api/device/state/", async_views.device_state, name="device-state"),
+    path("api/device/current_item/", async_views.device_current_item, name="device-current-item"),
+    path("api/device/bundle/", async_views.device_bundle, name="device-bundle"),
     path("api/", include(router.urls)),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
     path("api/token-auth/", views.CustomAuthToken.as_view()),
@@ -35,18 +40,8 @@ urlpatterns = [
     path("admin/", admin.site.urls),
 ]
 
-# Serve media files in development
-from django.urls import re_path
-from django.views.static import serve
-
-# Serve media files in development AND production (since we don't have separate media server)
+# /media/ (planos y fotos): ETag, cache inmutable para URLs versionadas,
+# rangos y X-Accel-Redirect/X-Sendfile si hay servidor web delante.
 urlpatterns += [
-    re_path(r'^media/(?P<path>.*)$', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }),
+    re_path(r'^media/(?P<path>.*)$', media.serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    # Static is handled by WhiteNoise in prod, but media needs manual serving here
-    pass
-
@@ -0,0 +1,168 @@
+"""
+Puente ASGI -> WSGI con un pool de hilos propio.
+
+El despliegue corre uvicorn (ASGI) por los endpoints async del player,
+pero el resto de la API es DRF sincrono. En lugar de pasar cada vista por
+``sync_to_async`` se sirve con la aplicacion WSGI en un pool de
+``SYNC_API_THREADS`` hilos por worker, igual que el ``--threads`` del
+gunicorn gthread: una importacion larga ocupa un hilo, no el worker.
+
+Las respuestas en streaming (ZIP, /media/) salen trozo a trozo: el hilo
+espera a que cada trozo se haya entregado antes de leer el siguiente, y
+deja de leer si el cliente se desconecta.
+"""
+import asyncio
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BODY_SPOOL_BYTES = 1024 * 1024
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+class FileWrapper:
+    """``wsgi.file_wrapper`` que lee en bloques grandes (FileResponse pide 4 KB)."""
+
+    def __init__(self, filelike, blksize=FILE_CHUNK_SIZE):
+        self.filelike = filelike
+        self.blksize = max(blksize, FILE_CHUNK_SIZE)
+
+    def __iter__(self):
+        while True:
+            chunk = self.filelike.read(self.blksize)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        close = getattr(self.filelike, 'close', None)
+        if close is not None:
+            close()
+
+
+def build_environ(scope, body):
+    """environ WSGI (PEP 3333) para un scope HTTP de ASGI."""
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': str(client[0]),
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = f'HTTP_{name}'
+        if key in environ:
+            separator = '; ' if key == 'HTTP_COOKIE' else ','
+            value = f'{environ[key]}{separator}{value}'
+        environ[key] = value
+    if 'CONTENT_LENGTH' not in environ:
+        # Cuerpo chunked: Django solo lee wsgi.input hasta CONTENT_LENGTH.
+        environ['CONTENT_LENGTH'] = str(body.seek(0, 2))
+        body.seek(0)
+    return environ
+
+
+class WsgiBridge:
+    """Aplicacion ASGI que ejecuta ``wsgi_app`` en un pool de ``threads`` hilos."""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self._run, scope, body, send, loop, disconnected)
+        finally:
+            watcher.cancel()
+            body.close()
+
+    @staticmethod
+    async def _read_body(receive):
+        # Las subidas grandes (importaciones) van a disco, no a memoria.
+        body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    def _run(self, scope, body, send, loop, disconnected):
+        state = {'started': False}
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start():
+            if not state['started']:
+                state['started'] = True
+                emit({'type': 'http.response.start', 'status': state['status'], 'headers': state['headers']})
+
+        def write(data):
+            if data:
+                start()
+                emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and state['started']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'] = int(status.split(' ', 1)[0])
+            state['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+            return write
+
+        result = self.wsgi_app(build_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if disconnected.is_set():
+                    return
+                write(chunk)
+            start()
+            emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
@@ -155,6 +155,11 @@ export interface Imagen {
     orden: number;
     version: number;
     activo: boolean;
+    checksum?: string | null;
+    /** Original upload name (the url points at content-addressed storage). */
+    nombre_archivo?: string;
+    /** Pre-rendered derivatives: {'1080' | '2160' | 'thumb': {webp, jpg}}. */
+    variantes?: { [size: string]: { [format: string]: string } };
 }
 
 export interface Mesa {
@@ -170,6 +175,7 @@ export interface Mesa {
     locked: boolean;
     blackout: boolean;
     last_seen: string | null;
+    online: boolean;
     is_linked: boolean;
 }
 
@@ -522,7 +528,7 @@ export class ApiService {
 
     getGruposBastidor(proyectoId: number): Observable<GrupoBastidor[]> {
         return this.http.get<GrupoBastidor[]>(
-            `${this.baseUrl}/grupos-bastidor/?proyecto=${proyectoId}`,
+            `${this.baseUrl}/grupos-bastidor/overview/?proyecto=${proyectoId}`,
             { headers: this.getHeaders() }
         );
     }
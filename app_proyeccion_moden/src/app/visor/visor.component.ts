@@ -3,7 +3,7 @@ import { CommonModule, isPlatformBrowser } from '@angular/common';
 import { ActivatedRoute } from '@angular/router';
 import { Title } from '@angular/platform-browser';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { interval, Subscription, switchMap, of, catchError, exhaustMap, startWith } from 'rxjs';
+import { interval, Subscription, switchMap, of, catchError, exhaustMap, startWith, map } from 'rxjs';
 import { Mapper } from '../mapper/mapper';
 import { environment } from '../../environments/environment';
 
@@ -56,6 +56,7 @@ export class VisorComponent implements OnInit, OnDestroy {
   // Photo capture
   private captureServiceUrl = 'http://127.0.0.1:5555';
   private capturingPhoto = false;
+  private assetCacheOnline = false;
   captureStatus: 'idle' | 'capturing' | 'uploading' | 'done' | 'error' = 'idle';
 
   // Local capture-service health (null = unknown, true = ok, false = down)
@@ -76,6 +77,9 @@ export class VisorComponent implements OnInit, OnDestroy {
   private statePollSub: Subscription | null = null;
   private heartbeatSub: Subscription | null = null;
   private itemPollSub: Subscription | null = null;
+  private bundleVersion: number | null = null;
+  // Keeps references so the preloaded plans stay in the image cache.
+  private preloadedImages: HTMLImageElement[] = [];
 
   private apiUrl = `${environment.apiUrl}/device/`;
   private isBrowser: boolean;
@@ -136,8 +140,13 @@ export class VisorComponent implements OnInit, OnDestroy {
     ).subscribe(stats => {
       if (stats === null) {
         this.captureServiceOnline = false;
+        this.assetCacheOnline = false;
       } else {
         this.captureServiceOnline = true;
+        this.assetCacheOnline = !!stats?.asset_cache?.enabled;
+        if (this.assetCacheOnline && !stats.asset_cache.device_registered) {
+          this.registerWithAssetCache();
+        }
         const status = stats?.sharpness_status;
         if (status === 'ok' || status === 'warning' || status === 'blurry' || status === 'unknown') {
           this.cameraSharpness = status;
@@ -305,11 +314,50 @@ export class VisorComponent implements OnInit, OnDestroy {
     if (this.currentIndex === -1) return `${this.assetBase}assets/calibration_grid.jpg`;
     if (this.currentIndex === -2) return `${this.assetBase}assets/calibration_grid_with_x.jpg`;
     if (this.images.length > 0 && this.currentIndex >= 0 && this.currentIndex < this.images.length) {
-      return this.images[this.currentIndex].url || this.images[this.currentIndex].src || this.images[this.currentIndex];
+      const image = this.images[this.currentIndex];
+      return this.localAsset(this.projectorVariant(image) || image.url || image.src || image);
     }
     return this.mesaState?.image_url ?? null;
   }
 
+  /**
+   * Pre-rendered derivative matching the projector resolution (see
+   * api/derivatives.py), so the browser doesn't decode and downscale the
+   * full-size plan on every step. WebP first, JPEG as fallback.
+   */
+  private projectorVariant(image: any): string | null {
+    const variantes = image?.variantes;
+    if (!variantes) return null;
+    const physicalWidth = window.screen.width * (window.devicePixelRatio || 1);
+    const preferred = physicalWidth > 1920 ? ['2160', '1080'] : ['1080'];
+    for (const size of preferred) {
+      const formats = variantes[size];
+      if (formats) return formats.webp || formats.jpg || null;
+    }
+    return null;
+  }
+
+  /**
+   * Plans go through the capture service's local cache (capture_service.py)
+   * while it is up: it prefetches the upcoming queue, so a step change is
+   * served from the mini-PC disk and survives Wi-Fi dropouts.
+   */
+  private localAsset(url: string): string {
+    if (this.assetCacheOnline && typeof url === 'string' && url.startsWith('/media/')) {
+      return `${this.captureServiceUrl}${url}`;
+    }
+    return url;
+  }
+
+  /** Hands the device token to the capture service so its prefetcher can read the queue. */
+  private registerWithAssetCache(): void {
+    if (this.isSupervisor || !this.deviceToken) return;
+    this.http.post(`${this.captureServiceUrl}/asset-cache/device`, {
+      token: this.deviceToken,
+      server: window.location.origin,
+    }).pipe(catchError(() => of(null))).subscribe();
+  }
+
   get showOverlay(): boolean {
     return !!this.activeItem && this.currentIndex >= 0;
   }
@@ -421,14 +469,19 @@ export class VisorComponent implements OnInit, OnDestroy {
       return;
     }
 
-    this.http.post(`${this.apiUrl}mark_done/`, {}, { headers: this.getAuthHeaders() })
+    this.http.post<any>(`${this.apiUrl}mark_done/`, {}, { headers: this.getAuthHeaders() })
       .subscribe({
-        next: () => {
+        next: (res) => {
           this.activeItem = null;
           this.images = [];
           this.currentIndex = 0;
           this.cdr.detectChanges();
-          this.checkActiveItem();
+          // mark_done already returns the promoted item; only poll on older backends.
+          if (res && 'current_item' in res) {
+            this.handleActiveItemUpdate(res.current_item);
+          } else {
+            this.checkActiveItem();
+          }
         },
         error: (err) => console.error('[Visor] Error finishing item (device):', err)
       });
@@ -444,8 +497,10 @@ export class VisorComponent implements OnInit, OnDestroy {
     const currentImage = this.images[this.currentIndex];
     if (!currentImage) return;
 
+    // Stored files are content-addressed (cas/<sha256>.png), so the
+    // original upload name comes in nombre_archivo.
     const imageUrl: string = currentImage.url || currentImage.src || '';
-    const filename = (imageUrl.split('/').pop() || '').toLowerCase();
+    const filename = (currentImage.nombre_archivo || imageUrl.split('?')[0].split('/').pop() || '').toLowerCase();
 
     // Fire the capture when the image filename marks a verification
     // step: '_foto' / '_photo' (proceso intermedio) or '_check' (final).
@@ -676,16 +731,48 @@ export class VisorComponent implements OnInit, OnDestroy {
             catchError(() => of(null))
           );
         }
-        return this.http.get<any>(`${this.apiUrl}current_item/`, { headers: this.getAuthHeaders() }).pipe(
-          catchError((err) => {
-            if (err.status === 401) this.handleUnauthorized('CurrentItemPolling');
-            return of(null);
-          })
-        );
+        return this.getDeviceBundleItem('CurrentItemPolling');
       })
     ).subscribe(item => this.handleActiveItemUpdate(item));
   }
 
+  /**
+   * Current item from /device/bundle/. The endpoint answers with an ETag and
+   * `no-cache`, so the browser revalidates each poll and gets a 304 while the
+   * queue is unchanged. The next items' plans are preloaded so the following
+   * step is already decoded when the operator advances.
+   */
+  private getDeviceBundleItem(source: string) {
+    return this.http.get<any>(`${this.apiUrl}bundle/`, { headers: this.getAuthHeaders() }).pipe(
+      map((bundle) => {
+        if (bundle?.version !== this.bundleVersion) {
+          this.bundleVersion = bundle?.version ?? null;
+          this.preloadImages(bundle?.next ?? []);
+        }
+        return bundle?.current ?? null;
+      }),
+      catchError((err) => {
+        if (err.status === 401) this.handleUnauthorized(source);
+        return of(null);
+      })
+    );
+  }
+
+  private preloadImages(items: any[]): void {
+    const urls = new Set<string>();
+    for (const item of items) {
+      for (const image of item?.images ?? []) {
+        const url = this.projectorVariant(image) || image.url;
+        if (url) urls.add(this.localAsset(url));
+      }
+    }
+    this.preloadedImages = Array.from(urls).map((url) => {
+      const img = new Image();
+      img.src = url;
+      return img;
+    });
+  }
+
   checkActiveItem(): void {
     if (this.isSupervisor) {
       const id = this.mesaIdForPairing || this.mesaState?.id;
@@ -696,11 +783,7 @@ export class VisorComponent implements OnInit, OnDestroy {
       return;
     }
 
-    this.http.get<any>(`${this.apiUrl}current_item/`, { headers: this.getAuthHeaders() })
-      .pipe(catchError((err) => {
-        if (err.status === 401) this.handleUnauthorized('CurrentItemCheck');
-        return of(null);
-      }))
+    this.getDeviceBundleItem('CurrentItemCheck')
       .subscribe(item => this.handleActiveItemUpdate(item));
   }
 
@@ -4,12 +4,17 @@ Runs on each mini-PC alongside the browser Player.
 
 Listens on localhost:5555. Two jobs in one process:
 
-  1. HTTP server (on-demand)
+  1. HTTP server (on-demand, one thread per request)
      POST /capture   -> take a fresh 4K JPEG and return the bytes
                         (used by the visor when an image filename
                          contains _foto / _photo / _check)
      GET  /health    -> { "status": "ok" }
      GET  /stats     -> { documentation / counters / local disk usage }
+     GET  /media/... -> plan images through the local asset cache
+     POST /asset-cache/device -> { "token": ..., "server": ... } from the
+                        visor, so the prefetcher can read the mesa queue
+                        (only from the visor origin; the server is
+                        learnt once)
 
   2. Documentation thread (periodic, configurable)
      Every `interval_seconds` saves a resized JPEG into
@@ -19,17 +24,32 @@ Listens on localhost:5555. Two jobs in one process:
      and prunes the oldest day folders when the local footprint exceeds
      `max_local_gb`.
 
+  3. Asset cache + prefetcher (optional, on by default)
+     Immutable plan images (the server marks them `Cache-Control:
+     immutable`) are kept under `cache_dir` with an LRU budget of
+     `max_cache_gb`. A background thread follows the mesa queue through
+     `/api/device/bundle/` and downloads the current and next plans
+     ahead of time, so a step change renders from local disk and a
+     Wi-Fi dropout doesn't blank the projector.
+
 All settings come from `config.ini` next to this script.
 """
 import configparser
+import hashlib
 import json
+import mimetypes
 import os
+import posixpath
 import shutil
 import threading
 import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
 from datetime import datetime, time as dtime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
+from urllib.parse import unquote, urlsplit
 
 import cv2
 
@@ -71,6 +91,19 @@ class Config:
         self.sharpness_threshold_blurry = 50.0
         self.sharpness_threshold_warning = 150.0
 
+        # Asset cache. server_url / device_token may stay empty: the visor
+        # registers them through POST /asset-cache/device.
+        self.cache_enabled = True
+        self.cache_dir = Path('C:/moden/asset_cache')
+        self.max_cache_gb = 5.0
+        self.server_url = ''
+        self.visor_origin = ''
+        self.device_token = ''
+        self.prefetch_enabled = True
+        self.prefetch_interval_seconds = 5.0
+        self.prefetch_next = 5
+        self.prefetch_variant = '1080'
+
         if path.exists():
             self._load(path)
 
@@ -116,6 +149,21 @@ class Config:
                 'threshold_warning', self.sharpness_threshold_warning
             )
 
+        if cp.has_section('asset_cache'):
+            a = cp['asset_cache']
+            self.cache_enabled = a.getboolean('enabled', self.cache_enabled)
+            self.cache_dir = Path(a.get('cache_dir', str(self.cache_dir)))
+            self.max_cache_gb = a.getfloat('max_cache_gb', self.max_cache_gb)
+            self.server_url = a.get('server_url', self.server_url).strip().rstrip('/')
+            self.visor_origin = a.get('visor_origin', self.visor_origin).strip().rstrip('/')
+            self.device_token = a.get('device_token', self.device_token).strip()
+            self.prefetch_enabled = a.getboolean('prefetch_enabled', self.prefetch_enabled)
+            self.prefetch_interval_seconds = a.getfloat(
+                'prefetch_interval_seconds', self.prefetch_interval_seconds
+            )
+            self.prefetch_next = a.getint('prefetch_next', self.prefetch_next)
+            self.prefetch_variant = a.get('prefetch_variant', self.prefetch_variant).strip()
+
 
 CONFIG = Config(CONFIG_PATH)
 
@@ -128,14 +176,15 @@ _camera_lock = threading.Lock()
 
 
 def get_camera():
+    """Opens the camera on first use. Caller must hold _camera_lock
+    (threading.Lock is not reentrant, so this must not take it again)."""
     global _camera
-    with _camera_lock:
-        if _camera is None or not _camera.isOpened():
-            _camera = cv2.VideoCapture(CONFIG.camera_index)
-            _camera.set(cv2.CAP_PROP_FRAME_WIDTH, CONFIG.capture_width)
-            _camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CONFIG.capture_height)
-            time.sleep(0.5)
-        return _camera
+    if _camera is None or not _camera.isOpened():
+        _camera = cv2.VideoCapture(CONFIG.camera_index)
+        _camera.set(cv2.CAP_PROP_FRAME_WIDTH, CONFIG.capture_width)
+        _camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CONFIG.capture_height)
+        time.sleep(0.5)
+    return _camera
 
 
 def capture_frame():
@@ -147,6 +196,65 @@ def capture_frame():
     return cam.read()
 
 
+class SharedCapture:
+    """
+    On-demand 4K photo for POST /capture. Concurrent callers join the
+    capture already in flight and get the same JPEG instead of taking the
+    camera one after another. Only reading the frame holds _camera_lock;
+    the (slow) JPEG encoding runs outside it, so the documentation loop
+    can keep going meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = None  # (threading.Event, result dict)
+
+    def take(self):
+        """JPEG bytes of a fresh frame. Raises RuntimeError on failure."""
+        with self._lock:
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = (threading.Event(), {})
+        done, result = inflight
+        with _stats_lock:
+            _stats['capture_requests'] += 1
+            if not leader:
+                _stats['capture_shared'] += 1
+
+        if leader:
+            try:
+                result['data'] = self._capture_jpeg()
+            except Exception as exc:
+                result['error'] = str(exc) or exc.__class__.__name__
+            finally:
+                with self._lock:
+                    self._inflight = None
+                done.set()
+        else:
+            done.wait()
+
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result['data']
+
+    @staticmethod
+    def _capture_jpeg():
+        with _camera_lock:
+            ret, frame = capture_frame()
+        if not ret or frame is None:
+            raise RuntimeError('Camera capture failed')
+        ok, jpeg_bytes = cv2.imencode(
+            '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CONFIG.jpeg_quality]
+        )
+        if not ok:
+            raise RuntimeError('JPEG encoding failed')
+        return jpeg_bytes.tobytes()
+
+
+_shared_capture = SharedCapture()
+
+
 # ---------------------------------------------------------------------------
 # Documentation stats (shared with /stats endpoint)
 # ---------------------------------------------------------------------------
@@ -160,6 +268,9 @@ _stats = {
     'local_disk_bytes': 0,
     'last_error': None,
     'skipped_out_of_schedule': 0,
+    # On-demand /capture calls and how many of them joined one in flight
+    'capture_requests': 0,
+    'capture_shared': 0,
     # Sharpness check (runs once per day on the first active tick)
     'sharpness_status': 'unknown',  # unknown | ok | warning | blurry
     'sharpness_score': None,
@@ -202,9 +313,9 @@ def _sharpness_status_for(score: float) -> str:
 
 
 def _ensure_sharpness_checked_today():
-    """Runs the sharpness analysis once per active day. Needs _camera_lock
-    on entry. No-op if already checked today, disabled, or we already
-    have a fresh capture in flight."""
+    """Runs the sharpness analysis once per active day. Takes _camera_lock
+    itself (only around the frame read), so the caller must not hold it.
+    No-op if already checked today or disabled."""
     if not CONFIG.sharpness_enabled:
         return
     today_iso = datetime.now().date().isoformat()
@@ -376,13 +487,308 @@ def documentation_loop():
         time.sleep(sleep_for)
 
 
+# ---------------------------------------------------------------------------
+# Asset cache (local /media/ proxy with an LRU disk budget)
+# ---------------------------------------------------------------------------
+UPSTREAM_TIMEOUT = 30
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class UpstreamError(Exception):
+    """The central server could not be reached or answered with an error."""
+
+
+class AssetCache:
+    """
+    Files live in `cache_dir` as `<sha256(origin + url path + query)><ext>`,
+    so the cache survives restarts without any index file and a file
+    downloaded from one server is never served for another. LRU order is the file
+    mtime, bumped on every hit; `put` evicts the oldest files once the
+    folder goes above `max_bytes`.
+
+    Only responses the server marks `immutable` are stored (content-
+    addressed plans and `?v=<checksum>` URLs), so a cached file is never
+    stale and can be served without asking the server again.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # filename -> size, oldest first
+        self._total = 0
+        self._inflight = {}  # key -> threading.Event
+        self.counters = {'hits': 0, 'misses': 0, 'upstream_errors': 0, 'evicted': 0}
+        self.last_error = None
+        self._load()
+
+    def _load(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.tmp'):
+                # Leftover from an interrupted download.
+                Path(entry.path).unlink(missing_ok=True)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    @staticmethod
+    def filename_for(key: str) -> str:
+        ext = os.path.splitext(urlsplit(key).path)[1].lower()
+        if not ext[1:].isalnum() or len(ext) > 11:
+            ext = ''
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() + ext
+
+    def get(self, key: str):
+        """Path of the cached file for `key` (marking it as recently used) or None."""
+        name = self.filename_for(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = self.root / name
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+            return None
+        return path
+
+    def put(self, key: str, chunks) -> Path:
+        """Stores the bytes of `chunks` under `key` and returns the file path."""
+        name = self.filename_for(key)
+        path = self.root / name
+        tmp = path.with_name(f'{name}.{threading.get_ident()}.tmp')
+        size = 0
+        try:
+            with open(tmp, 'wb') as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        with self._lock:
+            self._total += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict_locked(keep=name)
+        return path
+
+    def _evict_locked(self, keep: str):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                break
+            del self._entries[name]
+            self._total -= size
+            self.counters['evicted'] += 1
+            try:
+                (self.root / name).unlink()
+            except OSError:
+                pass
+
+    def fetch(self, key: str, origin: str):
+        """
+        Cached path for `key`, downloading it from `origin` on a miss.
+        Entries are keyed by `origin + key`. Returns `(path, None)` when
+        the file is in the cache, or `(None, (content_type, body))` for a
+        response that must not be cached. Concurrent misses for the same
+        URL share one download. Raises UpstreamError if there is no copy
+        and the server fails.
+        """
+        if not origin:
+            self._count('upstream_errors')
+            raise UpstreamError('server_url unknown (waiting for the visor to register)')
+        url = origin + key
+        while True:
+            path = self.get(url)
+            if path is not None:
+                self._count('hits')
+                return path, None
+            with self._lock:
+                event = self._inflight.get(url)
+                if event is None:
+                    event = self._inflight[url] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if owner:
+                break
+            event.wait(UPSTREAM_TIMEOUT)
+
+        self._count('misses')
+        try:
+            return self._download(url)
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+
+    def _download(self, url: str):
+        try:
+            with urllib.request.urlopen(url, timeout=UPSTREAM_TIMEOUT) as resp:
+                cache_control = resp.headers.get('Cache-Control', '')
+                if 'immutable' not in cache_control:
+                    return None, (resp.headers.get('Content-Type'), resp.read())
+                return self.put(url, iter(lambda: resp.read(256 * 1024), b'')), None
+        except (urllib.error.URLError, OSError) as exc:
+            self._count('upstream_errors')
+            self.last_error = f'{url}: {exc}'
+            raise UpstreamError(str(exc)) from exc
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': True,
+                'files': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'last_error': self.last_error,
+                **self.counters,
+            }
+
+
+_asset_cache = None
+_device_lock = threading.Lock()
+_device = {'server': CONFIG.server_url, 'token': CONFIG.device_token}
+_prefetch_stats = {'last_run_at': None, 'last_error': None, 'queued_files': 0}
+
+
+def _device_credentials():
+    with _device_lock:
+        return _device['server'], _device['token']
+
+
+def visor_origin():
+    """Origin allowed to register the device, or None until the first registration."""
+    with _device_lock:
+        return CONFIG.visor_origin or _device['server'] or None
+
+
+def register_device(origin: str, server: str, token: str) -> bool:
+    """
+    Called by the visor: learn the device token (and the server if it is
+    not configured). Only the visor origin may call it. The server is set
+    once, on the first registration and only to the calling page's own
+    origin, so a later page cannot point the prefetcher (and the Bearer
+    token it sends) somewhere else. Returns False if refused.
+    """
+    origin = origin.rstrip('/')
+    if urlsplit(origin).scheme not in ('http', 'https'):
+        return False
+    with _device_lock:
+        allowed = CONFIG.visor_origin or _device['server'] or origin
+        if origin != allowed:
+            return False
+        if not _device['server']:
+            if server.rstrip('/') != origin:
+                return False
+            _device['server'] = origin
+        if token:
+            _device['token'] = token
+    return True
+
+
+def media_key(request_path: str):
+    """Normalised `/media/...` path + query, or None if it isn't a media URL."""
+    parts = urlsplit(request_path)
+    path = posixpath.normpath(unquote(parts.path))
+    if not path.startswith('/media/') or '..' in path.split('/'):
+        return None
+    key = parts.path
+    if parts.query:
+        key += '?' + parts.query
+    return key
+
+
+def _bundle_image_urls(bundle: dict):
+    """Plan URLs the visor will show for the current and next items, in order."""
+    items = [bundle.get('current')] + list(bundle.get('next') or [])
+    for item in items:
+        for image in (item or {}).get('images') or []:
+            formats = (image.get('variantes') or {}).get(CONFIG.prefetch_variant) or {}
+            url = formats.get('webp') or formats.get('jpg') or image.get('url')
+            if url:
+                yield url
+
+
+def prefetch_loop():
+    """Follows the mesa queue and downloads its plans before they're shown."""
+    if _asset_cache is None or not CONFIG.prefetch_enabled:
+        print('[Prefetch] Disabled')
+        return
+    print(f'[Prefetch] Enabled. next={CONFIG.prefetch_next} '
+          f'every {CONFIG.prefetch_interval_seconds}s')
+
+    etag = None
+    pending = []
+    while True:
+        time.sleep(CONFIG.prefetch_interval_seconds)
+        server, token = _device_credentials()
+        if not server or not token:
+            continue
+        try:
+            request = urllib.request.Request(
+                f'{server}/api/device/bundle/?next={CONFIG.prefetch_next}',
+                headers={'Authorization': f'Bearer {token}'},
+            )
+            if etag and not pending:
+                request.add_header('If-None-Match', etag)
+            try:
+                with urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT) as resp:
+                    etag = resp.headers.get('ETag')
+                    bundle = json.loads(resp.read().decode('utf-8'))
+                pending = list(dict.fromkeys(_bundle_image_urls(bundle)))
+            except urllib.error.HTTPError as exc:
+                if exc.code != 304:
+                    raise
+
+            failed = []
+            for url in pending:
+                key = media_key(url)
+                if key is None:
+                    continue
+                try:
+                    _asset_cache.fetch(key, server)
+                except UpstreamError:
+                    failed.append(url)
+            # Whatever failed (Wi-Fi dropout) is retried on the next tick.
+            pending = failed
+            with _stats_lock:
+                _prefetch_stats['last_run_at'] = datetime.now().isoformat(timespec='seconds')
+                _prefetch_stats['queued_files'] = len(pending)
+                _prefetch_stats['last_error'] = None
+        except Exception as exc:
+            with _stats_lock:
+                _prefetch_stats['last_error'] = str(exc)
+
+
 # ---------------------------------------------------------------------------
 # HTTP handler
 # ---------------------------------------------------------------------------
 class CaptureHandler(BaseHTTPRequestHandler):
 
     def _cors(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
+        if self.path == '/asset-cache/device':
+            # Registration: only the visor page, never any origin.
+            origin = self.headers.get('Origin', '')
+            allowed = visor_origin()
+            self.send_header('Vary', 'Origin')
+            if origin and origin.rstrip('/') == (allowed or origin.rstrip('/')):
+                self.send_header('Access-Control-Allow-Origin', origin)
+        else:
+            self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
 
@@ -392,13 +798,16 @@ class CaptureHandler(BaseHTTPRequestHandler):
         self.end_headers()
 
     def do_GET(self):
-        if self.path == '/health':
+        if self.path.startswith('/media/'):
+            self._handle_media()
+        elif self.path == '/health':
             self._respond_json(200, {'status': 'ok'})
         elif self.path == '/stats':
             with _stats_lock:
                 payload = dict(_stats)
             payload['in_active_window'] = in_active_window()
             payload['output_dir'] = str(CONFIG.output_dir)
+            payload['asset_cache'] = _asset_cache_stats()
             self._respond_json(200, payload)
         else:
             self.send_error(404)
@@ -406,24 +815,18 @@ class CaptureHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         if self.path == '/capture':
             self._handle_capture()
+        elif self.path == '/asset-cache/device':
+            self._handle_register_device()
         else:
             self.send_error(404)
 
     def _handle_capture(self):
-        with _camera_lock:
-            ret, frame = capture_frame()
-        if not ret or frame is None:
-            self.send_error(500, 'Camera capture failed')
-            return
-
-        ok, jpeg_bytes = cv2.imencode(
-            '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, CONFIG.jpeg_quality]
-        )
-        if not ok:
-            self.send_error(500, 'JPEG encoding failed')
+        try:
+            data = _shared_capture.take()
+        except RuntimeError as exc:
+            self.send_error(500, str(exc))
             return
 
-        data = jpeg_bytes.tobytes()
         self.send_response(200)
         self.send_header('Content-Type', 'image/jpeg')
         self.send_header('Content-Length', str(len(data)))
@@ -431,6 +834,62 @@ class CaptureHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(data)
 
+    def _handle_media(self):
+        key = media_key(self.path)
+        if _asset_cache is None or key is None:
+            self.send_error(404)
+            return
+        server, _ = _device_credentials()
+        try:
+            path, passthrough = _asset_cache.fetch(key, server)
+        except UpstreamError as exc:
+            self.send_error(502, f'Upstream unavailable: {exc}')
+            return
+
+        if passthrough is not None:
+            content_type, body = passthrough
+            self.send_response(200)
+            self.send_header('Content-Type', content_type or 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-cache')
+            self._cors()
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        try:
+            fh = open(path, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+        with fh:
+            size = os.fstat(fh.fileno()).st_size
+            content_type = mimetypes.guess_type(urlsplit(key).path)[0]
+            self.send_response(200)
+            self.send_header('Content-Type', content_type or 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.send_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+            self._cors()
+            self.end_headers()
+            shutil.copyfileobj(fh, self.wfile)
+
+    def _handle_register_device(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            self._respond_json(400, {'detail': 'invalid JSON'})
+            return
+        registered = register_device(
+            self.headers.get('Origin', ''), str(data.get('server') or ''), str(data.get('token') or ''),
+        )
+        if not registered:
+            self._respond_json(403, {'detail': 'origin not allowed'})
+            return
+        self._respond_json(200, {'status': 'ok'})
+
     def _respond_json(self, status, payload):
         body = json.dumps(payload, default=str).encode('utf-8')
         self.send_response(status)
@@ -445,21 +904,49 @@ class CaptureHandler(BaseHTTPRequestHandler):
         pass
 
 
+def _asset_cache_stats():
+    if _asset_cache is None:
+        return {'enabled': False}
+    server, token = _device_credentials()
+    with _stats_lock:
+        prefetch = dict(_prefetch_stats)
+    return {
+        **_asset_cache.stats(),
+        'server_url': server,
+        'device_registered': bool(token),
+        'prefetch': prefetch,
+    }
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 def main():
+    global _asset_cache
+
     # Start the documentation thread (no-op if disabled in config)
     doc_thread = threading.Thread(
         target=documentation_loop, name='DocumentationLoop', daemon=True
     )
     doc_thread.start()
 
-    server = HTTPServer((CONFIG.host, CONFIG.port), CaptureHandler)
+    if CONFIG.cache_enabled:
+        try:
+            _asset_cache = AssetCache(CONFIG.cache_dir, int(CONFIG.max_cache_gb * (1024 ** 3)))
+            print(f'[AssetCache] {CONFIG.cache_dir} (max {CONFIG.max_cache_gb} GB)')
+        except OSError as exc:
+            _set_last_error(f'cache_dir: {exc}')
+            print(f'[AssetCache] Cannot use cache_dir: {exc}')
+    threading.Thread(target=prefetch_loop, name='PrefetchLoop', daemon=True).start()
+
+    # One thread per request: /health, /stats and cached plans never wait
+    # behind a capture or an upstream download.
+    server = ThreadingHTTPServer((CONFIG.host, CONFIG.port), CaptureHandler)
     print(f'[CaptureService] Listening on http://{CONFIG.host}:{CONFIG.port}')
     print('[CaptureService] POST /capture  -> take a 4K photo')
     print('[CaptureService] GET  /health   -> health check')
     print('[CaptureService] GET  /stats    -> documentation stats')
+    print('[CaptureService] GET  /media/.. -> plan images via the local cache')
     try:
         server.serve_forever()
     except KeyboardInterrupt: